@@ -0,0 +1,96 @@
+"""
+Compares the telemetry archive formats of src.event_archive: the size on disk of the archives of a synthetic
+catalogue in each format and the time to read all of their events back. Then compares loading the events dataframe
+one archive at a time, concatenating lists as get_archived_satellites_events used to, with the parallel loader.
+
+Run from the root of the project with:
+    python -m benchmarks.bench_archive --satellites 200 --events 2000
+"""
+import argparse
+from os.path import getsize
+import shutil
+import tempfile
+import time
+
+from multiprocessing import cpu_count
+
+import pandas as pd
+
+from benchmarks.standin import Recording
+from src.event_archive import archive_formats, archive_path, iter_archive, list_archives, load_events_df, \
+    read_archive, write_archive
+from src.schema import apply_schema
+
+
+def write(recording, events_path, archive_format):
+    """
+    Writes the events of a recording as archives in a format
+    :return: The seconds taken and the total size of the archives in bytes
+    """
+    start = time.perf_counter()
+    for sat_id, events in recording.events.items():
+        write_archive(archive_path(events_path, sat_id, archive_format), events)
+    seconds = time.perf_counter() - start
+    return seconds, sum([getsize(path) for _, path in list_archives(events_path)])
+
+
+def read(events_path, repeats):
+    """
+    Reads every event of the archives of a directory
+    :return: The fastest time in seconds and the number of events
+    """
+    times = []
+    count = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        count = sum([1 for _, path in list_archives(events_path) for _ in iter_archive(path)])
+        times.append(time.perf_counter() - start)
+    return min(times), count
+
+
+def serial_load(events_path):
+    """
+    Loads the events dataframe one archive at a time, concatenating the lists of events
+    """
+    events = []
+    for _, path in list_archives(events_path):
+        events = events + read_archive(path)
+    return apply_schema(pd.DataFrame.from_dict(events), 'events')
+
+
+def fastest(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the telemetry archive formats")
+    parser.add_argument('--satellites', type=int, default=200)
+    parser.add_argument('--events', type=int, default=2000, help="The number of events of each satellite")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--processes', type=int, nargs='+', default=sorted({1, cpu_count()}),
+                        help="The numbers of workers to time the parallel loader with")
+    args = parser.parse_args()
+
+    recording = Recording.synthetic(num_sats=args.satellites, events_per_sat=args.events, observations_per_sat=5)
+    results = {}
+    for archive_format in archive_formats:
+        events_path = tempfile.mkdtemp() + '/'
+        write_seconds, size = write(recording, events_path, archive_format)
+        read_seconds, count = read(events_path, args.repeats)
+        results[archive_format] = size
+        print(f"{archive_format:<10}{size / 2 ** 20:>10.1f} MiB  write {write_seconds:>7.2f}s  "
+              f"read {read_seconds:>7.2f}s  {count} events")
+        if archive_format == 'jsonl.gz':
+            serial_seconds = fastest(lambda: serial_load(events_path), args.repeats)
+            print(f"{'  serial dataframe load':<34}{serial_seconds:>7.2f}s")
+            for processes in args.processes:
+                seconds = fastest(lambda: load_events_df(events_path, processes), args.repeats)
+                print(f"{f'  parallel load, {processes} workers':<34}{seconds:>7.2f}s  "
+                      f"{serial_seconds / seconds:.1f}x")
+        shutil.rmtree(events_path)
+    print(f"The compressed archives are {results['json'] / results['jsonl.gz']:.1f}x smaller")
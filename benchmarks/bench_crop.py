@@ -0,0 +1,53 @@
+"""
+Compares the time and peak resident memory of cropping one waterfall with the original getpixel based path in
+benchmarks.reference against the strip wise decode path in src.image_utils.
+
+Run from the root of the project with:
+    python -m benchmarks.bench_crop
+"""
+import argparse
+import importlib
+import os
+import shutil
+import tempfile
+
+from benchmarks.measure import measure
+from benchmarks.synthetic import sizes, write_waterfall
+
+implementations = {
+    'reference': 'benchmarks.reference',
+    'image_utils': 'src.image_utils',
+}
+
+
+def crop(module_name, image_path):
+    """
+    Prepares a crop of one waterfall with the given implementation
+    :param module_name: The module providing crop_and_save_psd
+    :param image_path: The PNG to crop
+    :return: Callable performing the crop
+    """
+    module = importlib.import_module(module_name)
+    return lambda: module.crop_and_save_psd(image_path, delete_original=False)
+
+
+def main(size_names, repeats):
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'size':<10}{'implementation':<16}{'seconds':>10}{'peak RSS MB':>14}")
+        for size_name in size_names:
+            image_path = os.path.join(work_dir, f'{size_name}.png')
+            write_waterfall(image_path, *sizes[size_name])
+            for name, module_name in implementations.items():
+                result = measure('benchmarks.bench_crop:crop', (module_name, image_path), repeats)
+                print(f"{size_name:<10}{name:<16}{result['seconds']:>10.3f}{result['peak_rss_mb']:>14.1f}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark cropping a waterfall")
+    parser.add_argument('--sizes', nargs='+', default=list(sizes.keys()), choices=list(sizes.keys()))
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    main(args.sizes, args.repeats)
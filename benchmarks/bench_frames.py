@@ -0,0 +1,74 @@
+"""
+Compares the vectorized frame analytics in src.frame_analytics with decoding the telemetry frames one row at a
+time, on synthetic events in which each frame is received by several stations.
+
+Run from the root of the project with:
+    python -m benchmarks.bench_frames --events 400000
+"""
+import argparse
+from collections import defaultdict
+import random
+import time
+
+import pandas as pd
+
+from src.frame_analytics import duplicate_frames, frame_stats
+
+
+def synthetic_events(num_events, num_frames, seed=0):
+    """
+    Generates events whose frames are drawn from a smaller set of frames, with random trailing zero padding
+    :param num_events: The number of events
+    :param num_frames: The number of distinct frames
+    :param seed: Seed for the random choices
+    :return: pandas dataframe with the frame and station_id columns
+    """
+    rng = random.Random(seed)
+    frames = [(bytes(rng.getrandbits(8) for _ in range(rng.randint(8, 120))) +
+               b'\x00' * rng.randint(0, 20)).hex().upper() for _ in range(num_frames)]
+    return pd.DataFrame({'frame': [rng.choice(frames) for _ in range(num_events)],
+                         'station_id': [rng.randint(1, 300) for _ in range(num_events)]})
+
+
+def row_by_row(events_df):
+    """
+    The length, padding and duplicates of the frames computed one row at a time
+    """
+    stations = defaultdict(set)
+    rows = []
+    for frame, station in zip(events_df['frame'], events_df['station_id']):
+        data = bytes.fromhex(frame)
+        rows.append((len(data), len(data) - len(data.rstrip(b'\x00'))))
+        stations[data].add(station)
+    return rows, {data: receivers for data, receivers in stations.items() if len(receivers) > 1}
+
+
+def vectorized(events_df):
+    """
+    The length, padding and duplicates of the frames computed by src.frame_analytics
+    """
+    stats = frame_stats(events_df)
+    return stats, duplicate_frames(events_df, stats=stats)
+
+
+def fastest(function, events_df, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(events_df)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the frame analytics")
+    parser.add_argument('--events', type=int, default=400000)
+    parser.add_argument('--frames', type=int, default=50000, help="The number of distinct frames")
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    events = synthetic_events(args.events, args.frames)
+    loop_seconds = fastest(row_by_row, events, args.repeats)
+    vectorized_seconds = fastest(vectorized, events, args.repeats)
+    print(f"{'row by row':<16}{loop_seconds:>8.3f}s")
+    print(f"{'vectorized':<16}{vectorized_seconds:>8.3f}s  {loop_seconds / vectorized_seconds:.1f}x")
@@ -0,0 +1,159 @@
+"""
+Benchmark suite for src.image_utils on synthetic waterfalls. Times each find_*_bound, find_crop_box and the full
+crop_and_save_psd at every size in benchmarks.synthetic.sizes, tracks the peak memory of each, and compares the
+results against the stored baseline so Pillow upgrades and code changes that slow cropping down are caught.
+
+Run from the root of the project with:
+    python -m benchmarks.bench_image_utils
+Record a new baseline with:
+    python -m benchmarks.bench_image_utils --update-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+from benchmarks.measure import measure
+from benchmarks.synthetic import sizes, write_waterfall
+
+baseline_file = os.path.join(os.path.dirname(__file__), 'baseline_image_utils.json')
+
+functions = ['find_left_bound', 'find_upper_bound', 'find_right_bound', 'find_bottom_bound', 'find_crop_box',
+             'crop_and_save_psd']
+
+
+def prepare(function_name, image_path):
+    """
+    Loads the inputs of an image_utils function outside of the timed region
+    :param function_name: The name of the function in image_utils
+    :param image_path: The synthetic waterfall PNG
+    :return: Callable running the function once
+    """
+    from PIL import Image
+    import src.image_utils as iu
+
+    if function_name == 'crop_and_save_psd':
+        return lambda: iu.crop_and_save_psd(image_path, delete_original=False)
+    if function_name == 'find_crop_box':
+        return lambda: iu.find_crop_box(Image.open(image_path))
+    im_greyscale = Image.open(image_path).convert('L')
+    function = getattr(iu, function_name)
+    return lambda: function(im_greyscale)
+
+
+def environment():
+    """
+    Describes the versions the benchmark ran with
+    :return: Dictionary of versions
+    """
+    import numpy
+    import PIL
+    return {'python': platform.python_version(), 'numpy': numpy.__version__, 'pillow': PIL.__version__,
+            'machine': platform.machine()}
+
+
+def run(size_names, repeats, rounds=3):
+    """
+    Runs every function at every size, each in a fresh process. Timings vary between processes by more than they
+    vary within one, so each measurement is taken in several processes, interleaved with the other measurements, and
+    the fastest is kept.
+    :param size_names: The names of the sizes in benchmarks.synthetic.sizes to run
+    :param repeats: The number of timed calls per measurement, the fastest is kept
+    :param rounds: The number of processes each measurement is taken in
+    :return: Dictionary of 'size/function' to the measurement
+    """
+    results = {}
+    work_dir = tempfile.mkdtemp()
+    try:
+        cases = []
+        for size_name in size_names:
+            image_path = os.path.join(work_dir, f'{size_name}.png')
+            write_waterfall(image_path, *sizes[size_name])
+            cases += [(f'{size_name}/{function_name}', function_name, image_path) for function_name in functions]
+        for _ in range(rounds):
+            for case, function_name, image_path in cases:
+                result = measure('benchmarks.bench_image_utils:prepare', (function_name, image_path), repeats)
+                if case not in results or result['seconds'] < results[case]['seconds']:
+                    results[case] = result
+        for case, result in results.items():
+            print(f"{case:<32}{result['seconds']:>10.4f}s{result['peak_rss_mb']:>10.1f} MB")
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance_mb, min_delta_seconds=0.0002):
+    """
+    Compares the results against the baseline. A measurement is only slower than the baseline when it is slower by
+    both the fractional and the absolute tolerance, since the timings of the bound searches are tens of
+    microseconds and vary by more than the fractional tolerance between runs.
+    :param results: Dictionary of measurements from run
+    :param baseline: Dictionary of measurements from the stored baseline
+    :param time_tolerance: Allowed fractional slowdown before a measurement counts as a regression
+    :param min_delta_seconds: Allowed slowdown in seconds before a measurement counts as a regression
+    :param memory_tolerance_mb: Allowed growth in peak memory before a measurement counts as a regression
+    :return: List of regression messages
+    """
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            print(f"{case:<32} no baseline")
+            continue
+        expected = baseline[case]
+        ratio = result['seconds'] / expected['seconds'] if expected['seconds'] > 0 else 1
+        memory_growth = result['peak_rss_mb'] - expected['peak_rss_mb']
+        print(f"{case:<32}{ratio:>8.2f}x time{memory_growth:>+10.1f} MB")
+        if ratio > 1 + time_tolerance and result['seconds'] - expected['seconds'] > min_delta_seconds:
+            regressions.append(f"{case} took {ratio:.2f}x the baseline time")
+        if memory_growth > memory_tolerance_mb:
+            regressions.append(f"{case} used {memory_growth:.1f} MB more than the baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image_utils on synthetic waterfalls")
+    parser.add_argument('--sizes', nargs='+', default=list(sizes.keys()), choices=list(sizes.keys()))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=3,
+                        help="The number of fresh processes each measurement is taken in, the fastest is kept")
+    parser.add_argument('--time-tolerance', type=float, default=0.25)
+    parser.add_argument('--min-delta-seconds', type=float, default=0.0002,
+                        help="Allowed slowdown in seconds, on top of the fractional tolerance")
+    parser.add_argument('--memory-tolerance-mb', type=float, default=5.0)
+    parser.add_argument('--update-baseline', action='store_true', help="Store the results as the new baseline")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeats, args.rounds)
+    report = {'environment': environment(), 'results': results}
+
+    if args.output is not None:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+
+    if args.update_baseline:
+        with open(baseline_file, 'w') as out:
+            json.dump(report, out, indent=2)
+            out.write('\n')
+        print(f"Updated {baseline_file}")
+        return
+
+    if not os.path.exists(baseline_file):
+        print(f"No baseline at {baseline_file}, record one with --update-baseline")
+        return
+    with open(baseline_file) as file_in:
+        baseline = json.load(file_in)
+    if baseline['environment'] != report['environment']:
+        print(f"Baseline was recorded with {baseline['environment']}")
+    regressions = compare(results, baseline['results'], args.time_tolerance, args.memory_tolerance_mb,
+                          args.min_delta_seconds)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    sys.exit(1 if len(regressions) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
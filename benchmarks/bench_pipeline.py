@@ -0,0 +1,130 @@
+"""
+End-to-end throughput benchmark of the data pull against the local stand-in for SATNOGS in benchmarks.standin.
+Fetches the satellites, the telemetry of every satellite and every referenced observation with its waterfall, then
+compiles the combined dataset, and reports the events, observations and waterfalls processed per second.
+
+Run from the root of the project with:
+    python -m benchmarks.bench_pipeline --satellites 20 --latency 0.02
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.standin import Recording, start_standin
+from benchmarks.synthetic import sizes
+import src.constants as cnst
+
+
+def run(recording, latency=0.0, page_size=25, throttle_every=0, streaming=False, processes=None):
+    """
+    Runs the data pull against a stand-in replaying a recording, in a temporary data directory
+    :param recording: The Recording the stand-in replays
+    :param latency: Seconds each response of the stand-in is delayed by
+    :param page_size: The number of telemetry events per page
+    :param throttle_every: Every this many API requests is throttled, 0 never throttles
+    :param streaming: Boolean on whether to scrape observations while telemetry is fetched, see streaming_pull
+    :param processes: The number of worker processes of the streaming pull, None uses the number of CPUs
+    :return: Dictionary of the counts, the seconds of each stage and the rates
+    """
+    from src.data_pull import complete_dataset, prepare_directory, streaming_pull
+    from src.observation_scraper import ObservationScraper
+    from src.satellites import Satellites
+    from src.telemetry import Telemetry
+
+    server, site = start_standin(recording, latency=latency, page_size=page_size, throttle_every=throttle_every)
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    api, web_address = cnst.api, cnst.web_address
+    seconds = {}
+    try:
+        os.chdir(work_dir)
+        cnst.api, cnst.web_address = f'{site}api/', site
+        prepare_directory()
+
+        start = time.perf_counter()
+        sat_ids = list(Satellites(prints=False).get_dataframe().index.values)
+        seconds['satellites'] = time.perf_counter() - start
+
+        tm = Telemetry(prints=False)
+        scraper = ObservationScraper(prints=False, fetch_logging=False)
+        if streaming:
+            start = time.perf_counter()
+            streaming_pull(sat_ids, tm, scraper, telemetry_processes=processes, scrape_processes=processes)
+            events = tm.get_events_df(save_csv=True).shape[0]
+            seconds['telemetry and observations'] = time.perf_counter() - start
+        else:
+            start = time.perf_counter()
+            tm.multiprocess_fetch(sat_ids)
+            events_df = tm.get_events_df(save_csv=True)
+            events = events_df.shape[0]
+            seconds['telemetry'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            observation_ids = events_df['observation_id'].dropna().astype(int).unique()
+            scraper.multiprocess_scrape_observations(observation_ids)
+            seconds['observations'] = time.perf_counter() - start
+        scraper.get_dataframe(load_from_disk_first=False, save_csv=True)
+        observations = len([observation for observation in scraper.observations_list
+                            if observation['Observation_id'] is not None])
+        waterfalls = len([observation for observation in scraper.observations_list
+                          if observation['Downloads'] is not None and
+                          observation['Downloads']['waterfall_shape'] is not None])
+
+        start = time.perf_counter()
+        rows = complete_dataset().shape[0]
+        seconds['combined'] = time.perf_counter() - start
+    finally:
+        cnst.api, cnst.web_address = api, web_address
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+        server.terminate()
+
+    total = sum(seconds.values())
+    return {
+        'counts': {'satellites': len(sat_ids), 'events': events, 'observations': observations,
+                   'waterfalls': waterfalls, 'combined_rows': rows},
+        'seconds': {stage: round(value, 3) for stage, value in seconds.items()},
+        'rates': {'events_per_second': events / total, 'observations_per_second': observations / total,
+                  'waterfalls_per_second': waterfalls / total},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data pull against a local stand-in for SATNOGS")
+    parser.add_argument('--satellites', type=int, default=20)
+    parser.add_argument('--events-per-satellite', type=int, default=250)
+    parser.add_argument('--observations-per-satellite', type=int, default=10)
+    parser.add_argument('--waterfall-size', choices=list(sizes.keys()), default='small')
+    parser.add_argument('--recording', default=None, help="Replay the data directory of an earlier run instead")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds each response is delayed by")
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    parser.add_argument('--streaming', action='store_true', help="Overlap the telemetry and observation stages")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.recording is not None:
+        recording = Recording.from_directory(args.recording, args.waterfall_size)
+    else:
+        recording = Recording.synthetic(args.satellites, args.events_per_satellite, args.observations_per_satellite,
+                                        args.waterfall_size)
+    result = run(recording, latency=args.latency, page_size=args.page_size, throttle_every=args.throttle_every,
+                 streaming=args.streaming, processes=args.processes)
+
+    for stage, seconds in result['seconds'].items():
+        print(f"{stage:<28}{seconds:>10.3f}s")
+    for name, count in result['counts'].items():
+        print(f"{name:<28}{count:>10}")
+    for name, rate in result['rates'].items():
+        print(f"{name:<28}{rate:>10.1f}")
+    if args.output is not None:
+        with open(args.output, 'w') as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures the cold start of the package: the wall time of importing each module and of the data pull command line
+in a fresh interpreter, and which heavy dependencies each one loads. The processes run from an empty directory, so
+neither keys.txt nor a data directory is available to them.
+
+Run from the root of the project with:
+    python -m benchmarks.bench_startup
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+modules = ['src.constants', 'src.schema', 'src.storage', 'src.metrics', 'src.satellites', 'src.telemetry',
+           'src.observation_scraper', 'src.image_utils', 'src.query_index', 'src.data_pull', 'src.pipeline']
+
+heavy = ['pandas', 'numpy', 'pyarrow', 'PIL', 'bs4', 'html5lib', 'requests']
+
+
+def cold_start(arguments, work_dir, repeats):
+    """
+    Times a command in fresh interpreters
+    :param arguments: The arguments of the python interpreter
+    :param work_dir: The directory to run in
+    :param repeats: The number of runs
+    :return: The median wall time in seconds
+    """
+    environment = dict(os.environ, PYTHONPATH=os.getcwd())
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, cwd=work_dir, env=environment, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def loaded(module, work_dir):
+    """
+    Lists the heavy dependencies importing a module loads
+    :param module: The module to import
+    :param work_dir: The directory to import it in
+    :return: List of the names in heavy that were loaded
+    """
+    environment = dict(os.environ, PYTHONPATH=os.getcwd())
+    script = f'import sys, json, {module}; print(json.dumps([name for name in {heavy} if name in sys.modules]))'
+    output = subprocess.run([sys.executable, '-c', script], cwd=work_dir, env=environment, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(repeats, output=None):
+    work_dir = tempfile.mkdtemp()
+    interpreter = cold_start(['-c', 'pass'], work_dir, repeats)
+    results = {'interpreter_seconds': round(interpreter, 4), 'modules': {}}
+    print(f"{'interpreter':<28}{interpreter * 1000:>8.0f} ms")
+    for module in modules:
+        seconds = cold_start(['-c', f'import {module}'], work_dir, repeats)
+        heavy_loaded = loaded(module, work_dir)
+        results['modules'][module] = {'seconds': round(seconds, 4), 'loads': heavy_loaded}
+        print(f"{module:<28}{seconds * 1000:>8.0f} ms  {', '.join(heavy_loaded)}")
+    seconds = cold_start(['-m', 'src.data_pull', '--help'], work_dir, repeats)
+    results['data_pull_help_seconds'] = round(seconds, 4)
+    print(f"{'src.data_pull --help':<28}{seconds * 1000:>8.0f} ms")
+    os.rmdir(work_dir)
+    if output is not None:
+        with open(output, 'w') as out:
+            json.dump(results, out, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the cold start of the package")
+    parser.add_argument('--repeats', type=int, default=7)
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    main(args.repeats, args.output)
@@ -0,0 +1,102 @@
+"""
+Helpers shared by the benchmarks for running a measurement in a fresh process and reading its peak memory.
+"""
+import importlib
+import multiprocessing
+import os
+from queue import Empty
+import resource
+import time
+import traceback
+
+
+def peak_rss_kb():
+    """
+    Reads the peak resident set size of this process. VmHWM is used on Linux because ru_maxrss carries the peak of
+    the parent over into spawned processes.
+    :return: The peak resident set size in kilobytes
+    """
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_measurement(target, args, repeats, results, min_sample_seconds=0.05):
+    """
+    Runs a benchmark target and records the fastest time per call and the growth of the peak resident set size.
+    Like timeit, fast callables are called several times per sample so each sample takes at least
+    min_sample_seconds.
+    :param target: 'module:function' to import and call. The function is given args and returns a callable to time.
+    :param args: Tuple of arguments for the target
+    :param repeats: The number of samples to take
+    :param results: Queue the measurement dictionary is put on, or a dictionary with the traceback under 'error' if
+    the target raised
+    :param min_sample_seconds: The shortest time a sample should take
+    """
+    try:
+        results.put(sample(target, args, repeats, min_sample_seconds))
+    except Exception:
+        results.put({'error': traceback.format_exc()})
+
+
+def sample(target, args, repeats, min_sample_seconds):
+    """
+    Takes the samples of run_measurement
+    :return: Dictionary with the fastest seconds taken and the peak RSS growth in MB
+    """
+    module_name, function_name = target.split(':')
+    timed = getattr(importlib.import_module(module_name), function_name)(*args)
+    rss_before = peak_rss_kb()
+
+    start = time.perf_counter()
+    timed()
+    first = time.perf_counter() - start
+    number = max(1, int(min_sample_seconds / first)) if first > 0 else 1
+
+    times = [first]
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            timed()
+        times.append((time.perf_counter() - start) / number)
+    return {'seconds': min(times), 'peak_rss_mb': round((peak_rss_kb() - rss_before) / 1024, 2)}
+
+
+def measure(target, args=(), repeats=1, timeout=600):
+    """
+    Measures a benchmark target in a spawned process so imports and the peak memory of earlier runs are not
+    carried over
+    :param target: 'module:function' returning the callable to time, see run_measurement
+    :param args: Tuple of arguments for the target
+    :param repeats: The number of samples to take
+    :param timeout: The seconds to wait for the measurement before the process is terminated
+    :return: Dictionary with the fastest seconds taken and the peak RSS growth in MB
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_measurement, args=(target, args, repeats, results))
+    process.start()
+    deadline = time.monotonic() + timeout
+    result = None
+    try:
+        while result is None:
+            exited = not process.is_alive()
+            try:
+                result = results.get(timeout=1)
+            except Empty:
+                # a process that was killed or crashed before reporting never puts a result
+                if exited:
+                    raise RuntimeError(f"Measuring {target} exited with code {process.exitcode} without a result")
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Measuring {target} took longer than {timeout} seconds")
+    finally:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    if 'error' in result:
+        raise RuntimeError(f"Measuring {target} failed:\n{result['error']}")
+    return result
@@ -0,0 +1,318 @@
+"""
+A local stand-in for db.satnogs.org and network.satnogs.org. It serves the satellites endpoint, the paginated
+telemetry endpoint (with link headers and optional HTTP 429 throttling), observation pages in the markup the
+ObservationScraper reads (with an ETag, answering a conditional GET with 304 when the page is unchanged) and
+waterfall PNGs, each after a configurable latency. The responses are replayed from a Recording, which is either
+synthetic or loaded from the data directory of an earlier run.
+
+Serve one from the root of the project with:
+    python -m benchmarks.standin --port 8080
+and point the pipeline at it by setting cnst.api to http://127.0.0.1:8080/api/ and cnst.web_address to
+http://127.0.0.1:8080/.
+"""
+import argparse
+import hashlib
+import html
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import multiprocessing
+from os.path import exists
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from benchmarks.synthetic import make_waterfall, sizes
+from src.event_archive import list_archives, read_archive
+
+
+class Recording:
+    def __init__(self, satellites, events, observations, waterfall):
+        """
+        The responses the stand-in replays
+        :param satellites: List of satellite records, as the satellites endpoint returns them
+        :param events: Dictionary of sat_id to its list of telemetry events, newest first
+        :param observations: Dictionary of observation ID to the scraped fields of its page
+        :param waterfall: The bytes of the waterfall PNG served for every observation
+        """
+        self.satellites = satellites
+        self.events = events
+        self.observations = observations
+        self.waterfall = waterfall
+
+    @staticmethod
+    def waterfall_png(size='small', seed=0):
+        """
+        Draws a synthetic waterfall and encodes it as a PNG
+        :param size: The name of a size in benchmarks.synthetic.sizes
+        :param seed: Seed for the noise and signal of the PSD
+        :return: PNG bytes
+        """
+        figure, _ = make_waterfall(*sizes[size], seed=seed)
+        out = io.BytesIO()
+        Image.fromarray(figure, 'RGB').convert('RGBA').save(out, format='PNG')
+        return out.getvalue()
+
+    @classmethod
+    def synthetic(cls, num_sats=10, events_per_sat=100, observations_per_sat=5, waterfall_size='small', seed=0):
+        """
+        Generates a deterministic recording
+        :param num_sats: The number of satellites
+        :param events_per_sat: The number of telemetry events of each satellite
+        :param observations_per_sat: The number of observations the events of each satellite reference
+        :param waterfall_size: The name of a size in benchmarks.synthetic.sizes
+        :param seed: Seed for the random choices
+        :return: Recording
+        """
+        rng = random.Random(seed)
+        satellites = []
+        events = {}
+        observations = {}
+        for i in range(num_sats):
+            sat_id = f'STND-{i:04d}-0000-0000-0000'
+            norad = 80000 + i
+            satellites.append({'sat_id': sat_id, 'norad_cat_id': norad, 'name': f'STANDIN-{i}', 'names': '',
+                               'status': 'alive', 'decayed': None, 'launched': '2020-01-01T00:00:00Z',
+                               'countries': 'US', 'telemetries': [{'decoder': 'ax25'}]})
+            observation_ids = [1000 + i * observations_per_sat + o for o in range(observations_per_sat)]
+            for observation_id in observation_ids:
+                station = rng.randint(1, 20)
+                observations[str(observation_id)] = {
+                    'Satellite': f'{norad} - STANDIN-{i}',
+                    'Station': f'{station} - Station {station}',
+                    'Status': 'Good',
+                    'Status_Message': 'Vetted as good by a station owner',
+                    'Transmitter': 'AFSK 1k2 - Downlink',
+                    'Frequency': f'{rng.randint(144, 146)},{rng.randint(100, 999)},000 Hz',
+                    'Mode': ['AFSK'],
+                    'Metadata': json.dumps({'radio': {'name': 'gr-satnogs', 'version': 'v2.3'},
+                                            'latitude': 47.5, 'longitude': 19.0}),
+                    'Waterfall_Status': 'With Signal',
+                }
+            events[sat_id] = [{'sat_id': sat_id, 'norad_cat_id': norad, 'transmitter': '', 'app_source': 'network',
+                               'schema': '', 'decoded': '', 'frame': 'A5' * rng.randint(4, 60),
+                               'observer': f'Station {rng.randint(1, 20)}-JN97ml',
+                               'timestamp': f'2022-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T'
+                                            f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z',
+                               'version': '', 'observation_id': rng.choice(observation_ids),
+                               'station_id': rng.randint(1, 20), 'associated_satellites': []}
+                              for _ in range(events_per_sat)]
+        return cls(satellites, events, observations, cls.waterfall_png(waterfall_size, seed))
+
+    @classmethod
+    def from_directory(cls, data_directory, waterfall_size='small'):
+        """
+        Loads a recording from the data directory of an earlier run. The cropped waterfalls of a run are not the
+        PNGs the network serves, so a synthetic waterfall is served in their place.
+        :param data_directory: The data directory, such as './data/'
+        :param waterfall_size: The name of a size in benchmarks.synthetic.sizes
+        :return: Recording
+        """
+        with open(f'{data_directory}satellites/satellites.json', 'r') as file_in:
+            satellites = json.load(file_in)
+        events = {}
+        for sat_id, path in list_archives(f'{data_directory}telemetry_events/'):
+            events[sat_id] = read_archive(path)
+        observations = {}
+        if exists(f'{data_directory}observations/observations.json'):
+            with open(f'{data_directory}observations/observations.json', 'r') as file_in:
+                for observation in json.load(file_in):
+                    if observation['Observation_id'] is not None:
+                        observations[str(observation['Observation_id'])] = observation
+        return cls(satellites, events, observations, cls.waterfall_png(waterfall_size))
+
+
+def render_observation(observation_id, observation, site):
+    """
+    Renders an observation page with the markup of network.satnogs.org that the ObservationScraper reads
+    :param observation_id: The ID of the observation
+    :param observation: Dictionary of the scraped fields of the page
+    :param site: The base URL of the stand-in, such as 'http://127.0.0.1:8080/'
+    :return: The HTML of the page
+    """
+    def escape(value):
+        return html.escape(str(value) if value is not None else '', quote=True)
+
+    modes = ''.join([f'<span>{escape(mode)}</span>' for mode in (observation.get('Mode') or [])])
+    return f"""<!DOCTYPE html>
+<html><head><title>Observation {observation_id}</title></head><body>
+<div class="front-line"><span class="front-title">Satellite</span>
+<span class="front-data"><a href="{site}satellites/">{escape(observation.get('Satellite'))}</a></span></div>
+<div class="front-line"><span class="front-title">Station</span>
+<span class="front-data"><a href="{site}stations/">{escape(observation.get('Station'))}</a></span></div>
+<div class="front-line"><span class="front-title">Transmitter</span>
+<span class="front-data">{escape(observation.get('Transmitter'))}</span></div>
+<div class="front-line"><span class="front-title">Frequency</span>
+<span class="front-data" title="{escape(observation.get('Frequency'))}">{escape(observation.get('Frequency'))}</span></div>
+<div class="front-line"><span class="front-title">Mode</span><span class="front-data">{modes}</span></div>
+<div class="front-line"><span class="front-title">Metadata</span>
+<pre data-json="{escape(observation.get('Metadata'))}"></pre></div>
+<div class="front-line"><span class="front-title">Downloads</span>
+<a href="{site}media/audio/{observation_id}.ogg">Audio</a>
+<a href="{site}media/waterfalls/{observation_id}.png">Waterfall</a></div>
+<span id="waterfall-status-label" title="{escape(observation.get('Waterfall_Status'))}"></span>
+<div id="rating-status"><span title="{escape(observation.get('Status_Message'))}">{escape(observation.get('Status'))}</span></div>
+</body></html>"""
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Serves the responses of the server's recording
+    """
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        url = urlparse(self.path)
+        site = f'http://{self.headers["Host"]}/'
+        if url.path.startswith('/api/'):
+            with server.lock:
+                server.api_requests += 1
+                throttled = server.throttle_every > 0 and server.api_requests % server.throttle_every == 0
+            if throttled:
+                detail = f'Request was throttled. Expected available in {server.throttle_seconds} seconds.'
+                return self.respond(429, json.dumps({'detail': detail}).encode('utf-8'), 'application/json')
+
+        if url.path == '/api/satellites/':
+            return self.respond(200, json.dumps(server.recording.satellites).encode('utf-8'), 'application/json')
+        if url.path == '/api/telemetry/':
+            return self.telemetry(parse_qs(url.query), site)
+        if url.path.startswith('/observations/'):
+            observation_id = url.path.strip('/').split('/')[-1]
+            observation = server.recording.observations.get(observation_id)
+            if observation is None:
+                return self.respond(404, b'Not Found', 'text/html')
+            with server.lock:
+                server.observation_requests += 1
+            page = render_observation(observation_id, observation, site).encode('utf-8')
+            # the page is validated by the hash of its content, so it is modified whenever the observation is
+            etag = f'"{hashlib.sha256(page).hexdigest()[:32]}"'
+            if self.headers.get('If-None-Match') == etag:
+                return self.respond(304, b'', 'text/html; charset=utf-8', {'ETag': etag})
+            return self.respond(200, page, 'text/html; charset=utf-8', {'ETag': etag})
+        if url.path.startswith('/media/waterfalls/'):
+            return self.respond(200, server.recording.waterfall, 'image/png')
+        return self.respond(404, b'Not Found', 'text/plain')
+
+    def telemetry(self, query, site):
+        """
+        Serves one page of the telemetry of a satellite, with a link header to the next page as the API sends it
+        """
+        sat_id = query.get('sat_id', [''])[0]
+        page = int(query.get('page', ['1'])[0])
+        with self.server.lock:
+            failing = self.server.failures.get((sat_id, page), 0) > 0
+            if failing:
+                self.server.failures[(sat_id, page)] -= 1
+        if failing:
+            return self.respond(503, json.dumps({'detail': 'Service unavailable'}).encode('utf-8'), 'application/json')
+        events = self.server.recording.events.get(sat_id, [])
+        # the API filters on the timestamp before paging, so the links below only page through the events within it
+        start, end = query.get('start', [None])[0], query.get('end', [None])[0]
+        if start is not None or end is not None:
+            events = [event for event in events if (start is None or event['timestamp'] >= start) and
+                      (end is None or event['timestamp'] <= end)]
+        page_size = self.server.page_size
+        body = json.dumps(events[(page - 1) * page_size:page * page_size]).encode('utf-8')
+        links = []
+        if page * page_size < len(events):
+            links.append(f'<{site}api/telemetry/?page={page + 1}&sat_id={sat_id}>; rel="next"')
+        if page > 1:
+            links.append(f'<{site}api/telemetry/?page={page - 1}&sat_id={sat_id}>; rel="prev"')
+        headers = {'Link': ', '.join(links)} if len(links) > 0 else {}
+        return self.respond(200, body, 'application/json', headers)
+
+    def respond(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(recording, port=0, host='127.0.0.1', latency=0.0, page_size=25, throttle_every=0,
+                throttle_seconds=0, failures=None):
+    """
+    Creates a stand-in server
+    :param recording: The Recording to replay
+    :param port: The port to listen on, 0 picks a free one
+    :param host: The address to listen on
+    :param latency: Seconds each response is delayed by
+    :param page_size: The number of telemetry events per page
+    :param throttle_every: Every this many API requests is answered with HTTP 429, 0 never throttles
+    :param throttle_seconds: The wait the throttled responses ask for. The Telemetry class waits a second longer.
+    :param failures: Dictionary of (sat_id, page) to the number of times that telemetry page is answered with
+    HTTP 503 before it is served
+    :return: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.recording = recording
+    server.latency = latency
+    server.page_size = page_size
+    server.throttle_every = throttle_every
+    server.throttle_seconds = throttle_seconds
+    server.failures = dict(failures) if failures is not None else {}
+    server.api_requests = 0
+    server.observation_requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def serve(recording, ready, **options):
+    """
+    Runs a stand-in server until the process is terminated
+    :param recording: The Recording to replay
+    :param ready: Queue the base URL of the server is put on once it is listening
+    :param options: Keyword arguments of make_server
+    :return: None
+    """
+    server = make_server(recording, **options)
+    ready.put(f'http://{server.server_address[0]}:{server.server_address[1]}/')
+    server.serve_forever()
+
+
+def start_standin(recording, **options):
+    """
+    Starts a stand-in server in a process of its own, so it does not compete with the pipeline for the GIL
+    :param recording: The Recording to replay
+    :param options: Keyword arguments of make_server
+    :return: The server process, terminate() it when done, and the base URL of the server
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(recording, ready), kwargs=options, daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for SATNOGS")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--recording', default=None, help="Replay the data directory of an earlier run")
+    parser.add_argument('--satellites', type=int, default=10)
+    parser.add_argument('--events-per-satellite', type=int, default=100)
+    parser.add_argument('--observations-per-satellite', type=int, default=5)
+    parser.add_argument('--waterfall-size', choices=list(sizes.keys()), default='small')
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds each response is delayed by")
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    parser.add_argument('--throttle-seconds', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.recording is not None:
+        standin_recording = Recording.from_directory(args.recording, args.waterfall_size)
+    else:
+        standin_recording = Recording.synthetic(args.satellites, args.events_per_satellite,
+                                                args.observations_per_satellite, args.waterfall_size)
+    standin = make_server(standin_recording, port=args.port, latency=args.latency, page_size=args.page_size,
+                          throttle_every=args.throttle_every, throttle_seconds=args.throttle_seconds)
+    print(f"Serving the stand-in at http://127.0.0.1:{args.port}/")
+    standin.serve_forever()
@@ -0,0 +1,102 @@
+"""
+Generates synthetic waterfall PNGs in the layout network.satnogs.org serves them: a white figure with the PSD in the
+center, a black frame with ticks, tick labels and axis titles on the left and bottom axes and a colorbar on the
+right separated from the PSD by a white gap.
+"""
+from PIL import Image
+import numpy as np
+
+# width and height in pixels of waterfalls at the sizes found on the network
+sizes = {
+    'small': (320, 480),
+    'typical': (1024, 1600),
+    'tall': (1024, 8000),
+}
+
+
+def colormap(values):
+    """
+    Maps intensities onto a dark blue to yellow colormap that never reaches white
+    :param values: uint8 array of intensities
+    :return: uint8 array of RGB colors with a trailing axis of 3
+    """
+    values = values.astype(np.uint16)
+    red = values * 253 // 255
+    green = 20 + values * 211 // 255
+    blue = 120 - values * 100 // 255
+    return np.stack([red, green, blue], axis=-1).astype(np.uint8)
+
+
+def make_waterfall(width, height, seed=0):
+    """
+    Draws a synthetic waterfall
+    :param width: The width of the figure in pixels
+    :param height: The height of the figure in pixels
+    :param seed: Seed for the noise and signal of the PSD
+    :return: uint8 RGB array of shape (height, width, 3) and the [left, upper, right, bottom] box of the PSD frame
+    """
+    rng = np.random.default_rng(seed)
+    figure = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    left, right = int(width * 0.14), int(width * 0.76)
+    upper, bottom = int(height * 0.04), int(height * 0.93)
+
+    # PSD: noise with a drifting carrier and a few bursts
+    psd = rng.normal(60, 12, size=(bottom - upper, right - left)).clip(0, 255)
+    rows = np.arange(bottom - upper)
+    carrier = ((right - left) * (0.45 + 0.1 * np.sin(rows / max(len(rows), 1) * np.pi))).astype(int)
+    psd[rows, carrier] = 230
+    psd[rows, np.minimum(carrier + 1, right - left - 1)] = 200
+    for burst in rng.integers(0, bottom - upper, size=8):
+        psd[burst:burst + 3, :] += 40
+    figure[upper:bottom, left:right] = colormap(psd.clip(0, 255).astype(np.uint8))
+
+    # axes frame, ticks and tick labels
+    black = (0, 0, 0)
+    grey = (60, 60, 60)
+    figure[upper, left:right] = black
+    figure[bottom - 1, left:right] = black
+    figure[upper:bottom, left] = black
+    figure[upper:bottom, right - 1] = black
+    label_height = max(height // 400, 2)
+    label_width = max((right - left) // 50, 3)
+    for y in np.linspace(upper, bottom - 1, 9).astype(int):
+        figure[y, left - 5:left] = black
+        figure[max(y - label_height, 0):y + label_height, left - 10 - 4 * label_width:left - 10] = grey
+    for x in np.linspace(left, right - 1, 6).astype(int):
+        figure[bottom:bottom + 5, x] = black
+        figure[bottom + 8:bottom + 8 + 2 * label_height, max(x - label_width, 0):x + label_width] = grey
+
+    # axis titles
+    middle_y, middle_x = (upper + bottom) // 2, (left + right) // 2
+    figure[middle_y - height // 40:middle_y + height // 40, left - 14 - 5 * label_width:left - 12 - 4 * label_width] = \
+        black
+    figure[bottom + 12 + 2 * label_height:bottom + 14 + 4 * label_height, middle_x - label_width * 3:
+           middle_x + label_width * 3] = black
+
+    # colorbar with its own frame and labels, separated from the PSD by a white gap
+    bar_left, bar_right = int(width * 0.82), int(width * 0.86)
+    gradient = np.linspace(255, 0, bottom - upper).astype(np.uint8)
+    figure[upper:bottom, bar_left:bar_right] = colormap(gradient)[:, None, :]
+    figure[upper:bottom, bar_left] = black
+    figure[upper:bottom, bar_right - 1] = black
+    for y in np.linspace(upper, bottom - 1, 6).astype(int):
+        figure[y, bar_right:bar_right + 5] = black
+        figure[max(y - label_height, 0):y + label_height, bar_right + 8:bar_right + 8 + 3 * label_width] = grey
+
+    return figure, [left, upper, right, bottom]
+
+
+def write_waterfall(path, width, height, seed=0, mode='RGBA'):
+    """
+    Draws a synthetic waterfall and writes it to the disk as a PNG
+    :param path: The file to write
+    :param width: The width of the figure in pixels
+    :param height: The height of the figure in pixels
+    :param seed: Seed for the noise and signal of the PSD
+    :param mode: The PIL mode of the written PNG
+    :return: The [left, upper, right, bottom] box of the PSD frame
+    """
+    figure, box = make_waterfall(width, height, seed)
+    Image.fromarray(figure, 'RGB').convert(mode).save(path)
+    return box
@@ -1,14 +1,42 @@
+from os import environ
+from os.path import exists
+
 api = "https://db.satnogs.org/api/"
 observations = 'observations/'
 satellites = "satellites/"
 telemetry = "telemetry/?"
 web_address = "https://network.satnogs.org/"
 
-keys = dict()
-with open("./keys.txt", 'r') as file_in:
-    keys['api'] = file_in.readline().strip()
-    keys['cookie'] = file_in.readline().strip()
-    keys['token'] = file_in.readline().strip()
+# The credentials file holds the API key, the cookie and the CSRF token, one per line. Each can also be set with its
+# environment variable, which takes precedence over the file.
+keys_file_variable = 'SATNOGS_KEYS_FILE'
+key_variables = {'api': 'SATNOGS_API_KEY', 'cookie': 'SATNOGS_COOKIE', 'token': 'SATNOGS_CSRF_TOKEN'}
+
+
+def load_keys():
+    """
+    Reads the credentials from the environment and the credentials file. Missing credentials are empty strings.
+    :return: Dictionary of the api key, cookie and token
+    """
+    lines = []
+    keys_file = environ.get(keys_file_variable, './keys.txt')
+    if exists(keys_file):
+        with open(keys_file, 'r') as file_in:
+            lines = [line.strip() for line in file_in.readlines()]
+    return {key: environ.get(variable, lines[i] if i < len(lines) else '')
+            for i, (key, variable) in enumerate(key_variables.items())}
+
+
+def __getattr__(name):
+    """
+    Loads the credentials the first time cnst.keys is used rather than on import, so importing the package needs
+    neither the credentials file nor the working directory it sits in
+    """
+    if name == 'keys':
+        globals()['keys'] = load_keys()
+        return globals()['keys']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 observation_template = {
     'Observation_id': None,
@@ -24,23 +52,64 @@ observation_template = {
     'Waterfall_Status': None,
 }
 
-directories = {
-    "data": "./data",
-    "satellites": "./data/satellites/",
-    "satellites_json": "./data/satellites/satellites.json",
-    "satellites_csv": "./data/satellites/satellites.csv",
-    "tm_events":  "./data/telemetry_events/",
-    "tm_compiled": "./data/telemetry_compiled/",
-    "tm_compiled_json": "./data/telemetry_compiled/events.json",
-    "tm_compiled_csv": "./data/telemetry_compiled/events.csv",
-    "observations": "./data/observations/",
-    "waterfalls": "./data/observations/waterfalls/",
-    "observation_json": "./data/observations/observations.json",
-    "observation_csv": "./data/observations/observations.csv",
-    "logs": "./data/logs/",
-    "log_file": "./data/logs/log.txt",
-    "combined_csv": "./data/combined.csv"
-}
+# An observation is settled once it is vetted with one of these statuses and its waterfall, if it has one, with one of
+# these waterfall statuses. Until then a refresh checks it again, see observation_scraper.needs_refresh
+final_statuses = ['Good', 'Bad', 'Failed']
+final_waterfall_statuses = ['With Signal', 'Without Signal']
+
+# The fields of a scraped observation that change once it is vetted, which a refresh updates
+refresh_fields = ['Status', 'Status_Message', 'Waterfall_Status']
+
+# Summary features of the cropped PSD stored as columns on each observation, see image_utils.psd_features
+waterfall_features = ['bin_mean_power', 'row_energy', 'noise_floor', 'peak_column']
+
+
+def data_directories(root):
+    """
+    The locations of the artifacts of a run under a data directory
+    :param root: The data directory, such as './data'
+    :return: Dictionary of the name of each location to its path
+    """
+    return {
+        "data": root,
+        "satellites": f"{root}/satellites/",
+        "satellites_json": f"{root}/satellites/satellites.json",
+        "satellites_csv": f"{root}/satellites/satellites.csv",
+        "satellites_delta": f"{root}/satellites/delta.json",
+        "tm_events": f"{root}/telemetry_events/",
+        "tm_compiled": f"{root}/telemetry_compiled/",
+        "tm_compiled_json": f"{root}/telemetry_compiled/events.json",
+        "tm_compiled_csv": f"{root}/telemetry_compiled/events.csv",
+        "observations": f"{root}/observations/",
+        "waterfalls": f"{root}/observations/waterfalls/",
+        "observation_json": f"{root}/observations/observations.json",
+        "observation_csv": f"{root}/observations/observations.csv",
+        "scrape_queue": f"{root}/observations/scrape_queue.sqlite",
+        "observation_validators": f"{root}/observations/validators.json",
+        "logs": f"{root}/logs/",
+        "log_file": f"{root}/logs/log.txt",
+        "combined_csv": f"{root}/combined.csv",
+        "summary_csv": f"{root}/summary.csv",
+        "query_index": f"{root}/combined.sqlite",
+        "columnar": f"{root}/columnar/",
+        "pipeline_manifest": f"{root}/pipeline_manifest.json",
+        "shards": f"{root}/shards/",
+        "metrics": f"{root}/metrics/",
+        "metrics_report": f"{root}/metrics_report.json",
+        "profiles": f"{root}/profiles/",
+        "profile_report": f"{root}/profile_report/"
+    }
+
+
+# The data directory can be moved with SATNOGS_DATA_DIR, it defaults to ./data under the working directory
+data_directory_variable = 'SATNOGS_DATA_DIR'
+directories = data_directories(environ.get(data_directory_variable, './data').rstrip('/'))
+
+# Backend the tabular artifacts are written with, 'csv' or 'parquet'. See storage.ArtifactStore
+storage_backend = 'csv'
+
+# Format the telemetry archive of each satellite is written in, 'jsonl.gz' or 'json'. See event_archive
+archive_format = 'jsonl.gz'
 
 if __name__ == '__main__':
     print(f'api = {api}')
@@ -48,5 +117,5 @@ if __name__ == '__main__':
     print(f'satellites = {satellites}')
     print(f'telemetry = {telemetry}')
     print(f'web_address = {web_address}')
-    print(f'keys = {keys}')
+    print(f'keys = {load_keys()}')
     print(f'observation_template: {observation_template}')
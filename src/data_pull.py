@@ -1,11 +1,22 @@
+import argparse
 import json
-import pandas as pd
+from multiprocessing import Manager, Pool
+from queue import Empty
 from src.satellites import Satellites
 from src.telemetry import Telemetry
-from src.observation_scraper import ObservationScraper
+from src.observation_scraper import ObservationScraper, expand_metadata
 import src.constants as cnst
+from src.event_archive import archive_size, iter_archive, list_archives
+from src.filters import FilterSpec
+from src.metrics import enable_metrics, metrics, serve_report, write_report
+from src.profiling import enable_profiling, modes, traced, write_profile_report
+from src.query_index import QueryIndex
+from src.sharding import activate_shard, merge_shards, select_shard
+from src.schema import align_categories, apply_schema, concat_fragments
+from src.storage import ArtifactStore, backends
 import os
 import shutil
+import time
 
 
 def fix_freqs(freq):
@@ -20,34 +31,313 @@ def fix_freqs(freq):
     return freq[:-2]
 
 
-def complete_dataset():
+def fix_freqs_series(freqs):
+    """
+    Vectorized version of fix_freqs for a whole column of scraped frequencies
+    :param freqs: pandas series of frequency strings, such as '145,900,000 Hz'
+    :return: pandas series of integer frequencies, 0 where the frequency is missing
+    """
+    cleaned = freqs.astype(object).where(freqs.notna(), None)
+    cleaned = cleaned.str.replace(",", "", regex=False).str[:-2].str.strip()
+    return cleaned.where(freqs.notna(), 0).astype('int64')
+
+
+def observation_part(event, parts):
+    """
+    The part of an archive that is split into parts by observation an event belongs to
+    :param event: A telemetry event
+    :param parts: The number of parts
+    :return: The index of the part
+    """
+    return int(event.get('observation_id') or 0) % parts
+
+
+def iter_event_batches(memory_budget_mb=256, events_path=None):
+    """
+    Reads the archived telemetry events one batch of satellites at a time, so the events never have to be in
+    memory all at once. The events of an observation are always in the same batch.
+    :param memory_budget_mb: Approximate memory the batch and its joins may use. A batch is filled with archive
+    files until their decompressed size reaches a quarter of the budget, leaving room for the parsed records, the
+    dataframe and the joined copy. An archive larger than that is split into batches by observation_id, reading it
+    once to count its observations and once for each batch. A JSON array archive is parsed whole on each read.
+    :param events_path: The directory of the per satellite telemetry archives. Defaults to the location in
+    cnst.directories.
+    :return: Generator of pandas dataframes of events
+    """
+    import pandas as pd
+    events_path = events_path if events_path is not None else cnst.directories['tm_events']
+    batch_bytes = memory_budget_mb * 1024 * 1024 // 4
+    batch = []
+    size = 0
+    for _, file_name in list_archives(events_path):
+        file_size = archive_size(file_name)
+        if file_size > batch_bytes:
+            if len(batch) > 0:
+                yield apply_schema(pd.DataFrame.from_dict(batch), 'events')
+                batch = []
+                size = 0
+            # more parts than observations would only leave parts empty
+            observation_ids = set([event.get('observation_id') for event in iter_archive(file_name)])
+            parts = max(min(-(-file_size // max(batch_bytes, 1)), len(observation_ids)), 1)
+            for part in range(parts):
+                events = [event for event in iter_archive(file_name) if observation_part(event, parts) == part]
+                if len(events) > 0:
+                    yield apply_schema(pd.DataFrame.from_dict(events), 'events')
+            continue
+        batch.extend(iter_archive(file_name))
+        size += file_size
+        if size >= batch_bytes:
+            yield apply_schema(pd.DataFrame.from_dict(batch), 'events')
+            batch = []
+            size = 0
+    if len(batch) > 0:
+        yield apply_schema(pd.DataFrame.from_dict(batch), 'events')
+
+
+@traced('data_pull.stream_complete_dataset')
+def stream_complete_dataset(memory_budget_mb=256, store=None, build_index=False, prints=True):
+    """
+    Creates the completed dataset like complete_dataset, but joins the telemetry events onto the observations one
+    batch at a time and appends each batch to the combined dataset instead of building one large dataframe.
+    Peak memory stays near the memory budget plus the observations and satellites, which are read whole, rather than
+    growing with the number of events.
+    :param memory_budget_mb: Approximate memory a batch of events and its joins may use
+    :param store: The ArtifactStore the inputs are read from and the combined dataset is written through. Defaults
+    to the parquet backend.
+    :param build_index: Boolean on whether to also build the SQLite query index, appending each batch to it
+    :param prints: Boolean on whether to print to the screen
+    :return: The number of rows written
+    """
+    import pandas as pd
+    store = store if store is not None else ArtifactStore(backend='parquet')
+    observations_df = read_observations(store)
+    sat_df = read_satellites(store)
+    store.delete('combined')
+    index = QueryIndex(prints=prints) if build_index else None
+    if index is not None:
+        index.clear()
+
+    matched = pd.Series([], dtype='int64')
+    combined_columns = list(observations_df.columns)
+    rows = 0
+    for events_df in iter_event_batches(memory_budget_mb):
+        events_df['observation_id'] = events_df['observation_id'].fillna(-1).astype('int32')
+        combined_df = observations_df.merge(events_df, left_on='Observation_id', right_on='observation_id')
+        del events_df
+        if combined_df.shape[0] == 0:
+            continue
+        align_categories(combined_df, sat_df, 'sat_id')
+        combined_df = apply_schema(combined_df.merge(sat_df, on='sat_id', how='left'), 'combined')
+        combined_columns = list(combined_df.columns)
+        matched = pd.concat([matched, combined_df['Observation_id'].drop_duplicates()], ignore_index=True)
+        store.append('combined', combined_df)
+        if index is not None:
+            index.append(combined_df)
+        rows += combined_df.shape[0]
+        print(f"Added {combined_df.shape[0]} rows to the combined dataset") if prints else None
+
+    # Observations without telemetry events are kept, as they are by the left join in complete_dataset
+    unmatched_df = observations_df[~observations_df['Observation_id'].isin(matched)]
+    if unmatched_df.shape[0] > 0:
+        unmatched_df = apply_schema(unmatched_df.reindex(columns=combined_columns), 'combined')
+        store.append('combined', unmatched_df)
+        if index is not None:
+            index.append(unmatched_df)
+        rows += unmatched_df.shape[0]
+    if index is not None:
+        index.create_indexes()
+    return rows
+
+
+def read_satellites(store):
+    """
+    Reads the satellites, from the store when they have been written through it and from the satellites CSV otherwise
+    :param store: The ArtifactStore to read from
+    :return: pandas dataframe of the satellites
+    """
+    import pandas as pd
+    if store.exists('satellites'):
+        return store.read('satellites')
+    return apply_schema(pd.read_csv(cnst.directories['satellites_csv']), 'satellites')
+
+
+def read_observations(store):
+    """
+    Reads the scraped observations, from the store when they have been written through it and from the observations
+    JSON otherwise, fills in the Metadata_* columns of observations scraped before they were parsed during the scrape,
+    and cleans up the frequencies and IDs for joining.
+    :param store: The ArtifactStore to read from
+    :return: pandas dataframe of the observations
+    """
+    import pandas as pd
+    if store.exists('observations'):
+        observations_df = store.read('observations')
+    else:
+        with open(cnst.directories['observation_json'], 'r') as file_in:
+            observations_df = pd.DataFrame.from_dict(json.load(file_in))
+    observations_df = apply_schema(expand_metadata(observations_df), 'observations')
+    observations_df['Frequency'] = fix_freqs_series(observations_df['Frequency'])
+    observations_df['Observation_id'] = observations_df['Observation_id'].fillna(-1).astype('int32')
+    return observations_df
+
+
+def summarize_events(events_df):
+    """
+    Summarizes the frames of each observation
+    :param events_df: pandas dataframe of telemetry events
+    :return: pandas dataframe with a row for each observation_id and sat_id, with the number of frames, the number of
+    stations that received them and the timestamps of the first and last frame
+    """
+    events_df = events_df[events_df['observation_id'].notna()]
+    grouped = events_df.groupby(['observation_id', 'sat_id'], observed=True)
+    return grouped.agg(frame_count=('timestamp', 'size'), station_count=('station_id', 'nunique'),
+                       first_timestamp=('timestamp', 'min'), last_timestamp=('timestamp', 'max')).reset_index()
+
+
+@traced('data_pull.summarize_dataset')
+def summarize_dataset(memory_budget_mb=256, store=None):
+    """
+    Creates an aggregated alternative to the combined dataset with one row per observation instead of one per frame.
+    The frames of each observation are summarized by summarize_events, and the observation and its satellite are
+    stored once. The frames stay in the events dataset, keyed by the observation_id and sat_id of the summary rows,
+    so the summary grows with the number of observations rather than the number of frames. The events are read one
+    batch at a time, as in stream_complete_dataset.
+    :param memory_budget_mb: Approximate memory a batch of events may use
+    :param store: The ArtifactStore the inputs are read from and the summary is written through. Defaults to the
+    configured backend.
+    :return: pandas dataframe of the summary
+    """
+    store = store if store is not None else ArtifactStore()
+    observations_df = read_observations(store)
+    frames_df = concat_fragments([summarize_events(events_df) for events_df in iter_event_batches(memory_budget_mb)],
+                                 'summary')
+    frames_df = frames_df.reindex(columns=['observation_id', 'sat_id', 'frame_count', 'station_count',
+                                           'first_timestamp', 'last_timestamp'])
+    frames_df['observation_id'] = frames_df['observation_id'].astype('int32')
+    summary_df = observations_df.merge(frames_df, left_on='Observation_id', right_on='observation_id', how='left')
+    summary_df = summary_df.drop(columns=['observation_id'])
+    # observations without telemetry events are kept with no frames
+    summary_df['frame_count'] = summary_df['frame_count'].fillna(0)
+    summary_df['station_count'] = summary_df['station_count'].fillna(0)
+
+    sat_df = read_satellites(store)
+    align_categories(summary_df, sat_df, 'sat_id')
+    summary_df = apply_schema(summary_df.merge(sat_df, on='sat_id', how='left'), 'summary')
+    store.write('summary', summary_df)
+    return summary_df
+
+
+@traced('data_pull.complete_dataset')
+def complete_dataset(store=None, build_index=False, prints=True):
     """
     Creates the completed dataset by combining the events, observations, and satellite data into one dataframe.
+    :param store: The ArtifactStore the inputs are read from and the combined dataset is written through. Defaults
+    to the configured backend.
+    :param build_index: Boolean on whether to also build the SQLite query index of the combined dataset
+    :param prints: Boolean on whether to print to the screen
     :return: Returns a copy of the completed dataframe.
     """
-    with open(cnst.directories['observation_json'], 'r') as file_in:
-        observations_df = pd.DataFrame.from_dict(json.load(file_in))
-    observations_df['Frequency'] = observations_df['Frequency'].apply(lambda x: fix_freqs(x)).astype(int)
-    observations_df['Observation_id'] = observations_df['Observation_id'].fillna(-1).astype(int)
+    import pandas as pd
+    store = store if store is not None else ArtifactStore()
+    observations_df = read_observations(store)
 
-    with open(cnst.directories['tm_compiled_json'], 'r') as file_in:
-        events_df = pd.DataFrame.from_dict(json.load(file_in))
-    events_df['observation_id'] = events_df['observation_id'].fillna(-1).astype(int)
+    if store.exists('events'):
+        events_df = store.read('events')
+    else:
+        with open(cnst.directories['tm_compiled_json'], 'r') as file_in:
+            events_df = apply_schema(pd.DataFrame.from_dict(json.load(file_in)), 'events')
+    events_df['observation_id'] = events_df['observation_id'].fillna(-1).astype('int32')
     observations_df = observations_df.merge(events_df, left_on='Observation_id', right_on='observation_id', how='left')
 
-    sat_df = pd.read_csv(cnst.directories['satellites_csv'])
-    observations_df = observations_df.merge(sat_df, on='sat_id', how='left')
-    observations_df.to_csv(cnst.directories['combined_csv'])
+    sat_df = read_satellites(store)
+    align_categories(observations_df, sat_df, 'sat_id')
+    observations_df = apply_schema(observations_df.merge(sat_df, on='sat_id', how='left'), 'combined')
+    store.write('combined', observations_df, index=True)
+    if build_index:
+        QueryIndex(prints=prints).build(observations_df)
     return observations_df
 
 
-def prepare_directory():
+def streaming_pull(sat_ids, telemetry, scraper, telemetry_processes=None, scrape_processes=None):
     """
-    Clears the data directory and creates the required subdirectories
+    Fetches telemetry and scrapes observations at the same time. Each telemetry worker puts the observation IDs of
+    every page it fetches on a queue, and new IDs are handed to the scrape workers straight away, so scraping
+    starts while telemetry is still being fetched and the run takes about as long as the slower of the two.
+    :param sat_ids: The list of sat_ids to fetch telemetry for
+    :param telemetry: The Telemetry object to fetch with. Its observation queue is replaced for the run.
+    :param scraper: The ObservationScraper to scrape with. Its observations list is replaced with the results.
+    :param telemetry_processes: The number of telemetry worker processes, None uses the number of CPUs
+    :param scrape_processes: The number of scrape worker processes, None uses the number of CPUs
+    :return: The number of observations scraped
+    """
+    # leaving the block terminates the pools and shuts the manager down, also when a fetch or a scrape raised
+    with Manager() as manager, Pool(telemetry_processes) as telemetry_pool, Pool(scrape_processes) as scrape_pool:
+        telemetry.observation_queue = manager.Queue()
+        try:
+            telemetry_done = telemetry_pool.map_async(telemetry.fetch_telemetry_by_satellite, sat_ids, chunksize=1)
+            seen = set()
+            scrapes = []
+            while True:
+                try:
+                    observation_id = telemetry.observation_queue.get(timeout=0.5)
+                except Empty:
+                    # IDs are put on the queue before their fetch returns, so once every fetch has returned an empty
+                    # queue means there is nothing left to scrape
+                    if telemetry_done.ready() and telemetry.observation_queue.empty():
+                        break
+                    continue
+                if observation_id in seen:
+                    continue
+                seen.add(observation_id)
+                url = f'{cnst.web_address}{cnst.observations}{observation_id}/'
+                scrapes.append(scrape_pool.apply_async(scraper.scrape_observation, (url,)))
+
+            telemetry_done.get()
+            telemetry_pool.close()
+            print(f"Telemetry finished, waiting on {len(scrapes)} observation scrapes") if scraper.prints else None
+            scraper.observations_list = [scrape.get() for scrape in scrapes]
+            scrape_pool.close()
+            telemetry_pool.join()
+            scrape_pool.join()
+        finally:
+            telemetry.observation_queue = None
+
+    scraper.keep_validators(scraper.observations_list)
+    scraper.write_observations()
+    return len(scraper.observations_list)
+
+
+def clear_directory(directory, keep):
+    """
+    Removes everything in a directory except the kept files and the directories holding them
+    :param directory: The directory to clear
+    :param keep: List of absolute paths of the files to keep
+    :return: None
+    """
+    for entry in os.listdir(directory):
+        path = os.path.abspath(os.path.join(directory, entry))
+        if path in keep:
+            continue
+        if any([kept.startswith(path + os.sep) for kept in keep]):
+            clear_directory(path, keep)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def prepare_directory(clear=True, keep=None):
+    """
+    Clears the data directory and creates the required subdirectories. The outputs of the shards of a crawl are
+    never cleared, since --merge-shards still has to read them.
+    :param clear: Boolean on whether to remove what is already in the data directory
+    :param keep: List of files in the data directory that are not removed when it is cleared, such as the scrape
+    queue of a run that is resumed
     :return: None
     """
 
     root_dir = cnst.directories['data']
+    keep = list(keep if keep is not None else []) + [cnst.directories['shards']]
 
     sub_dirs = [
         cnst.directories['satellites'],
@@ -60,30 +350,115 @@ def prepare_directory():
     # Second part is a quick fix for a docker issue
     os.makedirs(root_dir, exist_ok=True)
 
-    if len([file for file in os.listdir(root_dir)]) > 0:
-        shutil.rmtree(root_dir)
-        os.makedirs(root_dir, exist_ok=True)
+    if clear:
+        clear_directory(root_dir, [os.path.abspath(path) for path in keep])
 
     for d in sub_dirs:
         os.makedirs(d, exist_ok=True)
 
 
 if __name__ == '__main__':
-    # Pull list of satellite IDs from SATNOGs Database
-    prepare_directory()
-    sat = Satellites()
-    sat_ids = sat.get_dataframe().index.values
-    # Use satellite IDs to query TM events and find observation IDs
-    tm = Telemetry(prints=True, max_pages=10000000)
-    tm.clear_archived_events()
-    tm.multiprocess_fetch(sat_ids, update_tm_events=True)
-    tm_df = tm.get_events_df(save_csv=True)
-    # extract observation IDs from the telemetry data frame
-    tm_df['observation_id'] = tm_df['observation_id'].fillna(0)
-    tm_df['observation_id'] = tm_df['observation_id'].astype(int)
-    observations = pd.unique(tm_df[tm_df['observation_id'] > 0]['observation_id'])
-    # start web scraping from the observation IDs
-    scraper = ObservationScraper()
-    scraper.multiprocess_scrape_observations(observations)
-    obs_df = scraper.get_dataframe(save_csv=True)
-    complete_dataset()
+    parser = argparse.ArgumentParser(description="Compile a dataset from SATNOGS")
+    parser.add_argument('--storage', choices=backends, default=cnst.storage_backend,
+                        help="Backend the satellites, events, observations and combined datasets are written with")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Scrape observations while telemetry is still being fetched")
+    parser.add_argument('--filters', default=None,
+                        help="JSON file of the satellite, event and waterfall filters that limit the crawl")
+    parser.add_argument('--scrape-queue', action='store_true',
+                        help="Scrape observations through the persistent work queue, retrying failed fetches. The "
+                             "queue is kept when the data directory is cleared, so an interrupted pull resumes.")
+    parser.add_argument('--drop-raw-metadata', action='store_true',
+                        help="Keep only the Metadata fields parsed into Metadata_* columns, not the Metadata JSON")
+    parser.add_argument('--stream-join', action='store_true',
+                        help="Join the events onto the observations in batches, appending to the combined dataset")
+    parser.add_argument('--memory-budget-mb', type=int, default=256,
+                        help="Approximate memory a batch of events of the streamed join or the summary may use. The "
+                             "observations and satellites are read whole on top of it.")
+    parser.add_argument('--summary', action='store_true',
+                        help="Write one row per observation with its frames summarized instead of the combined dataset")
+    parser.add_argument('--build-index', action='store_true',
+                        help="Also build the SQLite query index of the combined dataset")
+    parser.add_argument('--shard-index', type=int, default=None,
+                        help="Crawl only this shard of the satellites, writing under the shard's own directories")
+    parser.add_argument('--shard-count', type=int, default=1, help="The number of shards the crawl is split into")
+    parser.add_argument('--merge-shards', action='store_true',
+                        help="Combine the output of --shard-count shards and compile the dataset from it")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Record request, throttle, parse and crop metrics and write a run report")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Also serve the live run report as JSON on this port")
+    parser.add_argument('--profile', choices=modes, default=None,
+                        help="Trace the hot paths of every process, with 'cprofile' also profiling them")
+    args = parser.parse_args()
+    if args.streaming and args.scrape_queue:
+        # the streamed scrapes go straight to a pool, so they would be neither leased nor retried
+        parser.error("--scrape-queue cannot be combined with --streaming")
+    started = time.time()
+
+    if args.shard_index is not None and not args.merge_shards:
+        activate_shard(args.shard_index, args.shard_count)
+    # the scrape queue survives the clear, so a data pull that was interrupted resumes its scrapes
+    queue_files = [cnst.directories['scrape_queue'] + suffix for suffix in ['', '-wal', '-shm']]
+    prepare_directory(clear=not args.merge_shards, keep=queue_files if args.scrape_queue else None)
+    if args.metrics or args.metrics_port is not None:
+        enable_metrics()
+    if args.metrics_port is not None:
+        serve_report(args.metrics_port, started=started)
+    if args.profile is not None:
+        enable_profiling(args.profile)
+    store = ArtifactStore(backend=args.storage, prints=True)
+    filters = FilterSpec.from_file(args.filters) if args.filters is not None else FilterSpec()
+
+    if args.merge_shards:
+        merge_shards(args.shard_count, store=store)
+    else:
+        # Pull list of satellite IDs from SATNOGs Database
+        with metrics.timer('satellites', 'stage_seconds'):
+            sat = Satellites(store=store)
+            sat_ids = filters.select_satellites(sat.get_dataframe()).index.values
+        if args.shard_index is not None:
+            sat_ids = select_shard(sat_ids, args.shard_index, args.shard_count)
+            print(f"Shard {args.shard_index} of {args.shard_count} crawls {len(sat_ids)} satellites")
+        # Use satellite IDs to query TM events and find observation IDs
+        tm = Telemetry(prints=True, max_pages=10000000, store=store, filters=filters)
+        tm.clear_archived_events()
+        scraper = ObservationScraper(store=store, filters=filters, raw_metadata=not args.drop_raw_metadata)
+        if args.streaming:
+            # scrape observations as their IDs arrive from the telemetry pages
+            with metrics.timer('telemetry', 'stage_seconds'), metrics.timer('observations', 'stage_seconds'):
+                streaming_pull(sat_ids, tm, scraper)
+            tm_df = tm.get_events_df(save_csv=True)
+        else:
+            with metrics.timer('telemetry', 'stage_seconds'):
+                tm.multiprocess_fetch(sat_ids)
+                tm_df = tm.get_events_df(save_csv=True)
+            # extract observation IDs from the telemetry data frame
+            tm_df['observation_id'] = tm_df['observation_id'].fillna(0)
+            tm_df['observation_id'] = tm_df['observation_id'].astype(int)
+            observations = tm_df[tm_df['observation_id'] > 0]['observation_id'].unique()
+            # start web scraping from the observation IDs
+            with metrics.timer('observations', 'stage_seconds'):
+                if args.scrape_queue:
+                    scraper.queue_scrape_observations(observations)
+                else:
+                    scraper.multiprocess_scrape_observations(observations)
+        obs_df = scraper.get_dataframe(load_from_disk_first=False, save_csv=True)
+
+    # a shard leaves compiling the combined dataset to the merge
+    if args.shard_index is None or args.merge_shards:
+        with metrics.timer('combined', 'stage_seconds'):
+            if args.summary:
+                summarize_dataset(memory_budget_mb=args.memory_budget_mb, store=store)
+            elif args.stream_join:
+                stream_complete_dataset(memory_budget_mb=args.memory_budget_mb, store=store,
+                                        build_index=args.build_index)
+            else:
+                complete_dataset(store=store, build_index=args.build_index)
+
+    if metrics.directory is not None:
+        write_report(started=started)
+        print(f"Wrote the run report to {cnst.directories['metrics_report']}")
+    if args.profile is not None:
+        for name, path in write_profile_report().items():
+            print(f"Wrote the profile {name} to {path}")
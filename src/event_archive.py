@@ -0,0 +1,278 @@
+import argparse
+import gzip
+import json
+from multiprocessing import Pool, cpu_count
+from os import listdir, remove, replace
+from os.path import exists, getsize, isfile
+
+import src.constants as cnst
+
+# The formats a telemetry archive of one satellite is written in, each by the suffix of its file. 'jsonl.gz' holds
+# one event per line, gzip compressed, and can be read one event at a time. 'json' is the plain JSON array archives
+# were first written as, which is still read.
+suffixes = {'jsonl.gz': '.jsonl.gz', 'json': '.json'}
+
+archive_formats = list(suffixes.keys())
+
+
+def archive_path(events_path, sat_id, archive_format=None):
+    """
+    The file the telemetry archive of a satellite is written to
+    :param events_path: The directory of the telemetry archives
+    :param sat_id: The internal SATNOGS database ID for the satellite
+    :param archive_format: 'jsonl.gz' or 'json'. Defaults to cnst.archive_format.
+    :return: The path
+    """
+    archive_format = archive_format if archive_format is not None else cnst.archive_format
+    if archive_format not in suffixes:
+        raise ValueError(f"Unknown archive format {archive_format}, expected one of {archive_formats}")
+    return f'{events_path}{sat_id}{suffixes[archive_format]}'
+
+
+def archive_sat_id(file):
+    """
+    The satellite an archive file belongs to
+    :param file: The name of the file
+    :return: The sat_id, or None if the file is not a telemetry archive
+    """
+    for suffix in suffixes.values():
+        if file.endswith(suffix):
+            return file[:-len(suffix)]
+    return None
+
+
+def list_archives(events_path):
+    """
+    Lists the telemetry archives of a directory. A satellite archived in both formats is read from the compressed
+    archive, which is the newer one.
+    :param events_path: The directory of the telemetry archives
+    :return: List of (sat_id, path) tuples sorted by sat_id
+    """
+    archives = {}
+    for file in sorted(listdir(events_path)):
+        sat_id = archive_sat_id(file)
+        if sat_id is None or not isfile(f'{events_path}{file}'):
+            continue
+        if sat_id not in archives or file.endswith(suffixes['jsonl.gz']):
+            archives[sat_id] = f'{events_path}{file}'
+    return sorted(archives.items())
+
+
+def find_archive(events_path, sat_id):
+    """
+    Finds the telemetry archive of a satellite in either format
+    :param events_path: The directory of the telemetry archives
+    :param sat_id: The internal SATNOGS database ID for the satellite
+    :return: The path, or None if the satellite has no archive
+    """
+    for archive_format in archive_formats:
+        path = archive_path(events_path, sat_id, archive_format)
+        if exists(path):
+            return path
+    return None
+
+
+def write_archive(path, events):
+    """
+    Writes a telemetry archive in the format of its suffix. The archive is written to a temporary file that then
+    replaces it, so a reader never sees a partial archive.
+    :param path: The archive file, see archive_path
+    :param events: List of telemetry events
+    :return: None
+    """
+    temporary = f'{path}.tmp'
+    if path.endswith(suffixes['jsonl.gz']):
+        with gzip.open(temporary, 'wt', encoding='utf-8', compresslevel=6) as out:
+            for event in events:
+                out.write(json.dumps(event))
+                out.write('\n')
+    else:
+        with open(temporary, 'w') as out:
+            json.dump(events, out)
+    replace(temporary, path)
+
+
+def iter_archive(path, block_bytes=1 << 20):
+    """
+    Reads the events of a telemetry archive. A compressed archive is read a block of lines at a time, so only the
+    events of one block are in memory at once. Each block is parsed as one JSON array, which is faster than parsing
+    its lines one by one. A JSON array archive is read whole.
+    :param path: The archive file
+    :param block_bytes: The size of the decompressed block read at a time
+    :return: Generator of telemetry events
+    """
+    if path.endswith(suffixes['jsonl.gz']):
+        with gzip.open(path, 'rb') as file_in:
+            pending = b''
+            while True:
+                block = file_in.read(block_bytes)
+                lines = pending + block
+                if len(block) > 0:
+                    # a block is parsed up to its last whole line, the rest is parsed with the next block
+                    end = lines.rfind(b'\n') + 1
+                    lines, pending = lines[:end], lines[end:]
+                lines = [line for line in lines.split(b'\n') if line.strip()]
+                if len(lines) > 0:
+                    yield from json.loads(b'[' + b','.join(lines) + b']')
+                if len(block) == 0:
+                    break
+    else:
+        with open(path, 'r') as file_in:
+            yield from json.load(file_in)
+
+
+def read_archive(path):
+    """
+    Reads all of the events of a telemetry archive
+    :param path: The archive file
+    :return: List of telemetry events
+    """
+    return list(iter_archive(path))
+
+
+def read_archives(paths):
+    """
+    Reads all of the events of telemetry archives
+    :param paths: List of archive files
+    :return: List of telemetry events
+    """
+    events = []
+    for path in paths:
+        events.extend(iter_archive(path))
+    return events
+
+
+def archives_frame(paths):
+    """
+    Reads telemetry archives into one dataframe with the declared types of the events
+    :param paths: List of archive files
+    :return: pandas dataframe of the events
+    """
+    import pandas as pd
+    from src.schema import apply_schema
+    return apply_schema(pd.DataFrame.from_records(read_archives(paths)), 'events')
+
+
+def group_archives(paths, groups):
+    """
+    Splits archives into runs of consecutive archives of about the same decompressed size
+    :param paths: List of archive files
+    :param groups: The number of runs
+    :return: List of lists of archive files, in the order of paths
+    """
+    sizes = [archive_size(path) for path in paths]
+    target = sum(sizes) / max(groups, 1)
+    runs, run, run_size = [], [], 0
+    for path, size in zip(paths, sizes):
+        run.append(path)
+        run_size += size
+        if run_size >= target:
+            runs.append(run)
+            run, run_size = [], 0
+    if len(run) > 0:
+        runs.append(run)
+    return runs
+
+
+def map_archives(function, paths, processes=None, tasks_per_process=4):
+    """
+    Applies a function to runs of archives in a pool of worker processes, or in this process when there is only one
+    worker. Each worker is given a few runs of about the same size, so the fixed cost of a task is paid a few times
+    per worker rather than once per archive, and a worker that finishes early can take another run.
+    :param function: The function of a list of archive paths, such as archives_frame
+    :param paths: List of archive files
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param tasks_per_process: The number of runs the archives are split into for each worker
+    :return: Generator of the results of each run, in the order of paths
+    """
+    processes = processes if processes is not None else cpu_count()
+    if processes <= 1 or len(paths) <= 1:
+        yield function(paths)
+        return
+    runs = group_archives(paths, processes * tasks_per_process)
+    with Pool(min(processes, len(runs))) as pool:
+        yield from pool.imap(function, runs)
+
+
+def load_events(events_path=None, processes=None):
+    """
+    Reads the events of every archive of a directory, parsing the archives in parallel
+    :param events_path: The directory of the telemetry archives. Defaults to the location in cnst.directories.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :return: List of telemetry events, in the order of list_archives
+    """
+    events_path = events_path if events_path is not None else cnst.directories['tm_events']
+    events = []
+    for run_events in map_archives(read_archives, [path for _, path in list_archives(events_path)], processes):
+        events.extend(run_events)
+    return events
+
+
+def load_events_df(events_path=None, processes=None):
+    """
+    Reads the events of every archive of a directory into a dataframe. Each worker parses and types runs of
+    archives into dataframe fragments, which are concatenated once at the end.
+    :param events_path: The directory of the telemetry archives. Defaults to the location in cnst.directories.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :return: pandas dataframe with the declared types of the events, in the order of list_archives
+    """
+    from src.schema import concat_fragments
+    events_path = events_path if events_path is not None else cnst.directories['tm_events']
+    paths = [path for _, path in list_archives(events_path)]
+    return concat_fragments(list(map_archives(archives_frame, paths, processes)), 'events')
+
+
+def archive_size(path):
+    """
+    The size of the events of an archive once decompressed, for budgeting the memory reading it takes. A gzip file
+    records the size of its contents modulo 2**32 in its last four bytes.
+    :param path: The archive file
+    :return: Bytes
+    """
+    if not path.endswith(suffixes['jsonl.gz']):
+        return getsize(path)
+    with open(path, 'rb') as file_in:
+        file_in.seek(-4, 2)
+        return int.from_bytes(file_in.read(4), 'little')
+
+
+def remove_archives(events_path, sat_id, keep=None):
+    """
+    Removes the archives of a satellite, such as a stale archive in the other format once a new one is written
+    :param events_path: The directory of the telemetry archives
+    :param sat_id: The internal SATNOGS database ID for the satellite
+    :param keep: The archive file to keep
+    :return: None
+    """
+    for archive_format in archive_formats:
+        path = archive_path(events_path, sat_id, archive_format)
+        if path != keep and exists(path):
+            remove(path)
+
+
+def convert_archives(events_path=None, archive_format=None, prints=False):
+    """
+    Rewrites the archives of a directory that are not in a format, removing the originals
+    :param events_path: The directory of the telemetry archives. Defaults to the location in cnst.directories.
+    :param archive_format: The format to convert to. Defaults to cnst.archive_format.
+    :param prints: Boolean for whether print statements should be executed.
+    :return: The number of archives converted
+    """
+    events_path = events_path if events_path is not None else cnst.directories['tm_events']
+    converted = 0
+    for sat_id, path in list_archives(events_path):
+        target = archive_path(events_path, sat_id, archive_format)
+        if path != target:
+            write_archive(target, read_archive(path))
+            converted += 1
+            print(f"Converted {path} to {target}") if prints else None
+        remove_archives(events_path, sat_id, keep=target)
+    return converted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the telemetry archives to another format")
+    parser.add_argument('--format', choices=archive_formats, default=cnst.archive_format)
+    args = parser.parse_args()
+
+    print(f"Converted {convert_archives(archive_format=args.format, prints=True)} archives")
@@ -0,0 +1,152 @@
+import json
+import operator
+
+from src.storage import apply_filters, filter_ops
+
+# The levels of a filter specification and what each one cuts: the satellites whose telemetry is fetched, the events
+# kept and so the observations scraped, and the observations whose waterfall is downloaded
+levels = ['satellites', 'events', 'waterfalls']
+
+record_ops = {
+    '==': operator.eq,
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda value, values: value in values,
+    'not in': lambda value, values: value not in values,
+}
+
+
+def matches(record, filters):
+    """
+    Checks a single record against filters in the pyarrow form, a list of (column, op, value) tuples that must all
+    hold. A value that cannot be compared, such as a missing one, does not match.
+    :param record: Dictionary of column to value, such as a telemetry event or a scraped observation
+    :param filters: List of (column, op, value) tuples or None
+    :return: Boolean
+    """
+    for column, op, value in filters or []:
+        try:
+            if not record_ops[op](record.get(column), value):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+class FilterSpec:
+    def __init__(self, satellites=None, events=None, waterfalls=None):
+        """
+        Limits a crawl to the satellites and observations of interest. Each level is a list of filters in the
+        pyarrow form used by ArtifactStore.read, (column, op, value) tuples that must all hold, and is applied as
+        early as the crawl allows. An empty level keeps everything.
+        :param satellites: Filters on the columns of the satellite catalogue, such as ('status', '==', 'alive') or
+        ('norad_cat_id', 'in', [25544]). Only the telemetry of the satellites that match is fetched.
+        :param events: Filters on the columns of the telemetry events, such as ('station_id', 'in', [1, 2]) or
+        ('timestamp', '>=', '2022-01-01'). Bounds on the timestamp are also sent to the telemetry API, and only the
+        observations of the events that match are scraped.
+        :param waterfalls: Filters on the columns of a scraped observation, such as ('Status', '==', 'Good'). Only
+        the waterfalls of the observations that match are downloaded.
+        """
+        self.satellites = [tuple(f) for f in satellites or []]
+        self.events = [tuple(f) for f in events or []]
+        self.waterfalls = [tuple(f) for f in waterfalls or []]
+        for level in levels:
+            for f in getattr(self, level):
+                if len(f) != 3 or f[1] not in filter_ops:
+                    raise ValueError(f"Invalid {level} filter {f}, expected (column, op, value) with op one of "
+                                     f"{list(filter_ops)}")
+
+    @classmethod
+    def from_dict(cls, spec):
+        """
+        Creates a filter specification from a dictionary of level to a list of [column, op, value] lists
+        :param spec: Dictionary, such as {"satellites": [["status", "==", "alive"]]}
+        :return: FilterSpec
+        """
+        unknown = [level for level in spec if level not in levels]
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown filter levels {unknown}, expected some of {levels}")
+        return cls(**spec)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Reads a filter specification from a JSON file in the form of from_dict
+        :param path: The JSON file
+        :return: FilterSpec
+        """
+        with open(path, 'r') as file_in:
+            return cls.from_dict(json.load(file_in))
+
+    def to_dict(self):
+        """
+        The filter specification in the form of from_dict
+        :return: Dictionary of level to a list of [column, op, value] lists
+        """
+        return {level: [list(f) for f in getattr(self, level)] for level in levels}
+
+    def select_satellites(self, sat_df):
+        """
+        Keeps the satellites that match the satellite filters
+        :param sat_df: pandas dataframe of the satellite catalogue, indexed by sat_id or not
+        :return: The rows of sat_df that match
+        """
+        if len(self.satellites) == 0:
+            return sat_df
+        columns = sat_df.reset_index() if sat_df.index.name is not None else sat_df.reset_index(drop=True)
+        return sat_df.iloc[apply_filters(columns, self.satellites).index]
+
+    def select_catalogue(self, catalogue):
+        """
+        Keeps the satellite records that match the satellite filters
+        :param catalogue: List of satellite records from the satellites JSON
+        :return: List of satellite records
+        """
+        return [satellite for satellite in catalogue if matches(satellite, self.satellites)]
+
+    def select_events(self, events):
+        """
+        Keeps the events that match the event filters
+        :param events: List of telemetry events or a pandas dataframe of them
+        :return: The events that match, of the same type
+        """
+        if len(self.events) == 0:
+            return events
+        if isinstance(events, list):
+            return [event for event in events if matches(event, self.events)]
+        return apply_filters(events, self.events)
+
+    def event_columns(self):
+        """
+        The event columns the event filters read
+        :return: List of column names
+        """
+        return list(dict.fromkeys([column for column, _, _ in self.events]))
+
+    def event_window(self):
+        """
+        The bounds on the timestamp of the event filters, to be sent to the telemetry API. Exclusive bounds are sent
+        as inclusive ones, since the events are filtered exactly once they arrive.
+        :return: The start and the end, each None when unbounded
+        """
+        start, end = None, None
+        for column, op, value in self.events:
+            if column != 'timestamp':
+                continue
+            if op in ['>', '>=', '==', '=']:
+                start = value if start is None else max(start, value)
+            if op in ['<', '<=', '==', '=']:
+                end = value if end is None else min(end, value)
+        return start, end
+
+    def wants_waterfall(self, observation):
+        """
+        Checks whether the waterfall of a scraped observation should be downloaded
+        :param observation: Dictionary of the scraped observation
+        :return: Boolean
+        """
+        return matches(observation, self.waterfalls)
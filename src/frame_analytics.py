@@ -0,0 +1,226 @@
+import argparse
+import binascii
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from src.storage import ArtifactStore
+
+# Whether each byte value is the ASCII code of a hex digit
+hex_digits = np.zeros(256, dtype=bool)
+hex_digits[np.frombuffer(b'0123456789abcdefABCDEF', dtype=np.uint8)] = True
+
+
+def hash_table(max_length):
+    """
+    The random value each byte value adds to the hash of a frame at each position, the same in every run
+    :param max_length: The length of the longest frame
+    :return: uint64 array of max_length rows of 256 values
+    """
+    return np.random.default_rng(0x5A7E0).integers(0, 2 ** 64, size=(max(max_length, 1), 256), dtype=np.uint64,
+                                                    endpoint=False)
+
+
+class FrameBuffer:
+    def __init__(self, buffer, offsets, valid):
+        """
+        A column of frames decoded into one contiguous byte buffer. Frame i is buffer[offsets[i]:offsets[i + 1]].
+        Frames that were missing or were not valid hex are empty and are marked as not valid.
+        :param buffer: uint8 array of the bytes of every frame, one after the other
+        :param offsets: int64 array of the start of each frame, with the end of the buffer appended
+        :param valid: Boolean array, False where the frame was missing or was not valid hex
+        """
+        self.buffer = buffer
+        self.offsets = offsets
+        self.valid = valid
+
+    def __len__(self):
+        return len(self.valid)
+
+    @property
+    def lengths(self):
+        """
+        The length of each frame in bytes
+        """
+        return np.diff(self.offsets)
+
+    def frame(self, i):
+        """
+        The bytes of one frame
+        :param i: The position of the frame
+        :return: bytes
+        """
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def chunks(self, chunk_bytes=1 << 20):
+        """
+        Splits the frames into runs of whole frames of about chunk_bytes each, so the arrays derived from the buffer
+        stay small enough to be cached instead of spanning the whole buffer
+        :param chunk_bytes: The approximate number of bytes of each run
+        :return: Generator of the positions of the first frame and of the frame after the last of each run
+        """
+        bounds = np.unique(np.searchsorted(self.offsets[1:], np.arange(0, len(self.buffer), chunk_bytes), side='right'))
+        bounds = np.append(bounds[bounds < len(self)], len(self))
+        first = 0
+        for last in bounds[bounds > 0]:
+            yield first, int(last)
+            first = int(last)
+
+    def padding_lengths(self, padding=0x00):
+        """
+        Counts the padding bytes at the end of each frame
+        :param padding: The value of a padding byte
+        :return: int64 array of the number of trailing padding bytes of each frame
+        """
+        trailing = np.zeros(len(self), dtype=np.int64)
+        for first, last in self.chunks():
+            start = self.offsets[first]
+            starts, ends = self.offsets[first:last] - start, self.offsets[first + 1:last + 1] - start
+            # the last byte of a frame that is not padding is the last such byte of the chunk before the frame ends
+            content = np.flatnonzero(self.buffer[start:self.offsets[last]] != padding)
+            if len(content) == 0:
+                trailing[first:last] = ends - starts
+                continue
+            before_end = np.searchsorted(content, ends) - 1
+            end_content = np.where(before_end >= 0, content[np.maximum(before_end, 0)], -1)
+            trailing[first:last] = np.where(end_content >= starts, ends - 1 - end_content, ends - starts)
+        return trailing
+
+    def hashes(self):
+        """
+        Hashes the contents of each frame by tabulation: each byte adds the random value of its byte value at its
+        position in the frame. Equal frames have equal hashes, and frames that differ in any byte have different
+        hashes with a chance of a collision of about one in 2**64.
+        :return: uint64 array of the hash of each frame
+        """
+        lengths = self.lengths
+        hashes = lengths.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        if len(lengths) == 0 or lengths.max() == 0:
+            return hashes
+        table = hash_table(int(lengths.max())).ravel()
+        for first, last in self.chunks():
+            start = self.offsets[first]
+            chunk_lengths = lengths[first:last]
+            non_empty = np.flatnonzero(chunk_lengths > 0)
+            if len(non_empty) == 0:
+                continue
+            # the index in the table of each byte, from its position in its frame and its value
+            positions = np.arange(self.offsets[last] - start, dtype=np.int64)
+            positions -= np.repeat(self.offsets[first:last] - start, chunk_lengths)
+            positions *= 256
+            positions += self.buffer[start:self.offsets[last]]
+            # integer sums wrap around at 2**64 rather than losing precision
+            hashes[first + non_empty] += np.add.reduceat(table[positions], self.offsets[first + non_empty] - start)
+        return hashes
+
+
+def to_string_array(frames):
+    """
+    Converts frames to an Arrow string array, whose characters are already one contiguous buffer with offsets
+    :param frames: pandas series, list or other iterable of hex strings. Values that are not strings are missing.
+    :return: pyarrow LargeStringArray
+    """
+    try:
+        array = pa.array(frames, type=pa.large_string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = pa.array([frame if isinstance(frame, str) else None for frame in frames], type=pa.large_string())
+    if isinstance(array, pa.ChunkedArray):
+        chunks = [chunk.cast(pa.large_string()) for chunk in array.chunks]
+        return pa.concat_arrays(chunks) if len(chunks) > 0 else pa.array([], type=pa.large_string())
+    return array.cast(pa.large_string())
+
+
+def characters_of(array):
+    """
+    The characters of an Arrow string array as one buffer
+    :param array: pyarrow LargeStringArray
+    :return: int64 array of the start of each string in the buffer, with the end of the buffer appended, and the
+    uint8 array of the characters
+    """
+    buffers = array.buffers()
+    offsets = np.frombuffer(buffers[1], dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+    characters = np.frombuffer(buffers[2], dtype=np.uint8) if buffers[2] is not None else np.zeros(0, dtype=np.uint8)
+    return offsets - offsets[0], characters[offsets[0]:offsets[-1]]
+
+
+def decode_frames(frames):
+    """
+    Decodes a column of hex frames in one pass over all of their characters
+    :param frames: pandas series, list or other iterable of hex strings, such as the frame column of the events.
+    Missing values are allowed.
+    :return: FrameBuffer
+    """
+    array = to_string_array(frames)
+    hex_offsets, characters = characters_of(array)
+    hex_lengths = np.diff(hex_offsets)
+    valid = array.is_valid().to_numpy(zero_copy_only=False) & (hex_lengths % 2 == 0)
+    try:
+        buffer = binascii.unhexlify(characters if valid.all() else characters_of(array.filter(pa.array(valid)))[1])
+    except binascii.Error:
+        # a frame is valid when it is whole bytes written as hex digits, the others are decoded as empty frames
+        bad = np.concatenate([np.flatnonzero(~hex_digits[characters[start:start + (1 << 22)]]) + start
+                              for start in range(0, len(characters), 1 << 22)])
+        valid[np.searchsorted(hex_offsets, bad, side='right') - 1] = False
+        buffer = binascii.unhexlify(characters_of(array.filter(pa.array(valid)))[1])
+    lengths = np.where(valid, hex_lengths // 2, 0)
+    offsets = np.zeros(len(array) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return FrameBuffer(np.frombuffer(buffer, dtype=np.uint8), offsets, valid)
+
+
+def frame_stats(events_df, column='frame', padding=0x00):
+    """
+    Computes the length, trailing padding and content hash of every frame of the events
+    :param events_df: pandas dataframe of telemetry events
+    :param column: The column of hex frames
+    :param padding: The value of a padding byte
+    :return: pandas dataframe with the index of the events and the frame_length, padding_length, padding_ratio,
+    frame_hash and valid_frame columns
+    """
+    frames = decode_frames(events_df[column])
+    lengths = frames.lengths
+    padding_lengths = frames.padding_lengths(padding)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(lengths > 0, padding_lengths / lengths, np.nan)
+    return pd.DataFrame({'frame_length': lengths, 'padding_length': padding_lengths, 'padding_ratio': ratios,
+                         'frame_hash': frames.hashes(), 'valid_frame': frames.valid}, index=events_df.index)
+
+
+def duplicate_frames(events_df, station_column='station_id', column='frame', min_stations=2, stats=None):
+    """
+    Finds the frames received by several stations
+    :param events_df: pandas dataframe of telemetry events
+    :param station_column: The column identifying the receiving station
+    :param column: The column of hex frames
+    :param min_stations: The least number of distinct stations a frame must be received by
+    :param stats: The frame_stats of the events, computed when they are not given
+    :return: pandas dataframe with one row per duplicated frame: its hash, its length, the number of receptions and
+    the number of distinct stations, sorted by the number of stations
+    """
+    stats = stats if stats is not None else frame_stats(events_df, column)
+    receptions = pd.DataFrame({'frame_hash': stats['frame_hash'], 'frame_length': stats['frame_length'],
+                               'station': events_df[station_column].to_numpy()})
+    receptions = receptions[stats['valid_frame'].to_numpy() & (stats['frame_length'].to_numpy() > 0)]
+    grouped = receptions.groupby('frame_hash', sort=False).agg(frame_length=('frame_length', 'first'),
+                                                               receptions=('station', 'size'),
+                                                               stations=('station', 'nunique'))
+    grouped = grouped[grouped['stations'] >= min_stations].reset_index()
+    return grouped.sort_values(['stations', 'receptions'], ascending=False, ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize the telemetry frames of the events dataset")
+    parser.add_argument('--storage', choices=['csv', 'parquet'], default=None)
+    parser.add_argument('--padding', type=lambda value: int(value, 0), default=0x00,
+                        help="The value of a padding byte, such as 0x00 or 0x55")
+    parser.add_argument('--top', type=int, default=10, help="The number of duplicated frames to list")
+    args = parser.parse_args()
+
+    store = ArtifactStore() if args.storage is None else ArtifactStore(backend=args.storage)
+    events = store.read('events')
+    summary = frame_stats(events, padding=args.padding)
+    print(f"{len(summary)} frames, {int((~summary['valid_frame']).sum())} missing or not valid hex")
+    print(summary['frame_length'].describe())
+    print(f"Mean padding ratio: {summary['padding_ratio'].mean():.3f}")
+    print(duplicate_frames(events, stats=summary).head(args.top))
@@ -1,75 +1,211 @@
 import os
 
 from PIL import Image
-from collections import Counter
 import numpy as np
 
+from src.profiling import traced
 
+
+def non_white_mask(im):
+    """
+    Marks the pixels of a greyscale image that are not white
+    :param im: Greyscale PIL image or two-dimensional uint8 array
+    :return: Boolean array, True where the pixel is not white
+    """
+    return np.asarray(im) != 255
+
+
+def most_common(lengths):
+    """
+    Finds the most common value, breaking ties by the value seen first like Counter.most_common
+    :param lengths: One-dimensional array of non-negative integers
+    :return: The most common value
+    """
+    return int(lengths[np.argmax(np.bincount(lengths)[lengths])])
+
+
+def first_non_white(mask, axis):
+    """
+    Finds the index of the first non-white pixel along an axis
+    :param mask: Boolean array from non_white_mask
+    :param axis: 1 to search each row from the left, 0 to search each column from the top
+    :return: The indexes, for only the rows or columns that contain a non-white pixel
+    """
+    return mask.argmax(axis=axis)[mask.any(axis=axis)]
+
+
+def last_non_white(mask):
+    """
+    Finds the row of the last non-white pixel in each column
+    :param mask: Boolean array from non_white_mask
+    :return: The row indexes and a boolean array of which columns contain a non-white pixel
+    """
+    last = mask.shape[0] - 1 - mask[::-1].argmax(axis=0)
+    return last, mask.any(axis=0)
+
+
+@traced('image_utils.find_left_bound')
 def find_left_bound(im):
-    left_lengths = []
-    x_max, y_max = im.size
-    for y in range(0, y_max):
-        for x in range(0, x_max):
-            if im.getpixel((x, y)) != 255:
-                left_lengths.append(x)
-                break
-    return Counter(left_lengths).most_common(1)[0][0]
+    return most_common(first_non_white(non_white_mask(im), axis=1))
 
 
+@traced('image_utils.find_upper_bound')
 def find_upper_bound(im):
-    upper_lengths = []
-    x_max, y_max = im.size
-    for x in range(0, x_max):
-        for y in range(0, y_max):
-            if im.getpixel((x, y)) != 255:
-                upper_lengths.append(y)
-                break
-    return Counter(upper_lengths).most_common(1)[0][0]
+    return most_common(first_non_white(non_white_mask(im), axis=0))
 
 
+@traced('image_utils.find_bottom_bound')
 def find_bottom_bound(im):
-    bottom_lengths = []
-    x_max, y_max = im.size
-    for x in range(0, x_max):
-        for y in range(y_max - 1, 0, -1):
-            if im.getpixel((x, y)) != 255:
-                bottom_lengths.append(y)
-                break
-    return Counter(bottom_lengths).most_common(1)[0][0]
+    # the top row is never searched, matching a bottom up scan that stops before row 0
+    last, hit = last_non_white(non_white_mask(im)[1:])
+    return most_common(last[hit] + 1)
 
 
+@traced('image_utils.find_right_bound')
 def find_right_bound(im):
-    x_max, y_max = im.size
-    for x in range(x_max // 2, x_max):
-        broke = False
-        for y in range(0, y_max):
-            if im.getpixel((x, y)) != 255:
-                broke = True
-                break
-        if not broke:
-            return x
-
-
-def crop_and_save_psd(input_image, delete_original=True):
+    mask = non_white_mask(im)
+    x_max = mask.shape[1]
+    white_columns = np.flatnonzero(~mask[:, x_max // 2:].any(axis=0))
+    if len(white_columns) > 0:
+        return int(white_columns[0] + x_max // 2)
+
+
+@traced('image_utils.find_crop_box')
+def find_crop_box(im_source, strip_height=256):
+    """
+    Finds the boundaries of the center most PSD while converting only one strip of rows to greyscale at a time.
+    Gives the same bounds as the find_*_bound functions on the fully converted image.
+    :param im_source: The PIL image as it was opened
+    :param strip_height: The number of rows converted to greyscale at once
+    :return: List of the left, upper, right and bottom bounds
+    """
+    x_max, y_max = im_source.size
+    left_lengths = []
+    upper_lengths = np.full(x_max, -1)
+    bottom_lengths = np.full(x_max, -1)
+    non_white_columns = np.zeros(x_max, dtype=bool)
+
+    for top in range(0, y_max, strip_height):
+        strip = non_white_mask(im_source.crop((0, top, x_max, min(top + strip_height, y_max))).convert('L'))
+
+        left_lengths.append(first_non_white(strip, axis=1))
+
+        first = strip.argmax(axis=0)
+        hit = strip.any(axis=0)
+        found = hit & (upper_lengths < 0)
+        upper_lengths[found] = first[found] + top
+
+        # the top row is never searched, matching a bottom up scan that stops before row 0
+        offset = 1 if top == 0 else 0
+        if strip.shape[0] > offset:
+            last, hit_below = last_non_white(strip[offset:])
+            bottom_lengths[hit_below] = last[hit_below] + top + offset
+
+        non_white_columns |= hit
+
+    white_columns = np.flatnonzero(~non_white_columns[x_max // 2:])
+    right_bound = int(white_columns[0] + x_max // 2) if len(white_columns) > 0 else None
+
+    return [most_common(np.concatenate(left_lengths)),
+            most_common(upper_lengths[upper_lengths >= 0]),
+            right_bound,
+            most_common(bottom_lengths[bottom_lengths >= 0])]
+
+
+@traced('image_utils.crop_greyscale')
+def crop_greyscale(im_source, box, strip_height=256):
+    """
+    Converts only the cropped region of an image to greyscale, one strip of rows at a time
+    :param im_source: The PIL image as it was opened
+    :param box: List of the left, upper, right and bottom bounds
+    :param strip_height: The number of rows converted to greyscale at once
+    :return: Two-dimensional uint8 array of the cropped region
+    """
+    left_bound, upper_bound, right_bound, bottom_bound = box
+    psd = np.empty((bottom_bound - upper_bound, right_bound - left_bound), dtype=np.uint8)
+    for top in range(upper_bound, bottom_bound, strip_height):
+        bottom = min(top + strip_height, bottom_bound)
+        psd[top - upper_bound:bottom - upper_bound] = np.asarray(
+            im_source.crop((left_bound, top, right_bound, bottom)).convert('L'))
+    return psd
+
+
+def bin_mean_power(psd):
+    """
+    Mean intensity of each frequency bin (column) of the PSD
+    :param psd: Two-dimensional uint8 array of the cropped PSD
+    :return: List with one mean per column
+    """
+    return np.round(psd.mean(axis=0), 3).tolist()
+
+
+def row_energy(psd):
+    """
+    Summed intensity of each time row of the PSD
+    :param psd: Two-dimensional uint8 array of the cropped PSD
+    :return: List with one total per row
+    """
+    return psd.sum(axis=1, dtype=np.int64).tolist()
+
+
+def noise_floor(psd):
+    """
+    Estimates the noise floor of the PSD as the median pixel intensity
+    :param psd: Two-dimensional uint8 array of the cropped PSD
+    :return: The median intensity
+    """
+    return float(np.median(psd))
+
+
+def peak_column(psd):
+    """
+    Finds the frequency bin (column) holding the strongest signal on average
+    :param psd: Two-dimensional uint8 array of the cropped PSD
+    :return: The column index with the highest mean intensity
+    """
+    return int(psd.mean(axis=0).argmax())
+
+
+psd_features = {
+    'bin_mean_power': bin_mean_power,
+    'row_energy': row_energy,
+    'noise_floor': noise_floor,
+    'peak_column': peak_column,
+}
+
+
+@traced('image_utils.compute_psd_features')
+def compute_psd_features(psd, features=None):
+    """
+    Computes summary features of a cropped PSD while the array is still in memory
+    :param psd: Two-dimensional uint8 array of the cropped PSD
+    :param features: List of feature names from psd_features to compute. None computes all of them.
+    :return: Dictionary of feature name to value
+    """
+    features = psd_features.keys() if features is None else features
+    if psd.size == 0:
+        return {feature: None for feature in features}
+    return {feature: psd_features[feature](psd) for feature in features}
+
+
+@traced('image_utils.crop_and_save_psd')
+def crop_and_save_psd(input_image, delete_original=True, features=(), strip_height=256):
     im_source = Image.open(input_image)
-    im_greyscale = im_source.convert('L')
-    # Find the boundaries of the center most PSD and crop the image.
-    left_bound = find_left_bound(im_greyscale)
-    right_bound = find_right_bound(im_greyscale)
-    upper_bound = find_upper_bound(im_greyscale)
-    bottom_bound = find_bottom_bound(im_greyscale)
-    im_cropped = im_greyscale.crop([left_bound, upper_bound, right_bound, bottom_bound])
-
-    # Convert to greyscale and save as unit8 bytes to disk, using the original file name, minus the file extension
-    numpy_im = np.array(im_cropped)
-
-    # store the shape and write to a file
+    # Find the boundaries of the center most PSD, then convert only that region to greyscale
+    box = find_crop_box(im_source, strip_height)
+    numpy_im = crop_greyscale(im_source, box, strip_height)
+    im_source.close()
+
+    # store the shape and save as unit8 bytes to disk, using the original file name, minus the file extension
     shape = numpy_im.shape
     new_file_name = input_image[:-4]
     numpy_im.tofile(new_file_name)
 
+    # summarise the PSD before the array is released
+    psd_summary = compute_psd_features(numpy_im, features)
+
     # remove the original, larger image
     if delete_original:
         os.remove(input_image)
 
-    return shape, new_file_name
+    return shape, new_file_name, psd_summary
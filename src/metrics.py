@@ -0,0 +1,291 @@
+from contextlib import contextmanager
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import current_process
+from os import environ, getpid, listdir, makedirs, remove, replace
+from os.path import exists
+import json
+import threading
+import time
+
+import src.constants as cnst
+
+# Upper bounds of the histogram buckets, in the unit of the observed values (seconds for durations)
+buckets = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Pool workers inherit the metrics directory through the environment, whichever way their process is started
+directory_variable = 'SATNOGS_METRICS_DIR'
+
+
+def empty_histogram():
+    """
+    Creates a histogram with no observations
+    :return: Dictionary of the count, sum, min, max and bucket counts
+    """
+    return {'count': 0, 'sum': 0.0, 'min': None, 'max': None, 'buckets': [0] * (len(buckets) + 1)}
+
+
+def merge_histograms(left, right):
+    """
+    Combines two histograms
+    :param left: Histogram dictionary
+    :param right: Histogram dictionary
+    :return: The combined histogram
+    """
+    return {
+        'count': left['count'] + right['count'],
+        'sum': left['sum'] + right['sum'],
+        'min': min([value for value in [left['min'], right['min']] if value is not None], default=None),
+        'max': max([value for value in [left['max'], right['max']] if value is not None], default=None),
+        'buckets': [a + b for a, b in zip(left['buckets'], right['buckets'])],
+    }
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Counters and histograms of a run, kept per stage. Each process keeps its own and writes them to a file of
+        its own in the metrics directory, so the workers of a multiprocessing.Pool never share state. run_report
+        combines the files into one report. Nothing is written until the metrics are enabled. The metrics are
+        updated and written under a lock, as serve_report writes them from its own threads while the run updates them.
+        """
+        self.pid = getpid()
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.RLock()
+
+    @property
+    def directory(self):
+        """
+        The directory the per process metrics are written to, None when the metrics are disabled
+        """
+        return environ.get(directory_variable)
+
+    def local(self):
+        """
+        Starts from empty metrics in a forked worker, which would otherwise report its parent's metrics as its own
+        :return: None
+        """
+        if getpid() != self.pid:
+            self.pid = getpid()
+            self.counters = {}
+            self.histograms = {}
+            # the lock may have been held by a thread of the parent, which the worker does not have
+            self.lock = threading.RLock()
+
+    def increment(self, stage, name, value=1):
+        """
+        Adds to a counter
+        :param stage: The stage the counter belongs to, such as 'telemetry'
+        :param name: The name of the counter
+        :param value: The amount to add
+        :return: None
+        """
+        self.local()
+        with self.lock:
+            stage_counters = self.counters.setdefault(stage, {})
+            stage_counters[name] = stage_counters.get(name, 0) + value
+
+    def observe(self, stage, name, value):
+        """
+        Adds an observation, such as a duration in seconds, to a histogram
+        :param stage: The stage the histogram belongs to
+        :param name: The name of the histogram
+        :param value: The observed value
+        :return: None
+        """
+        self.local()
+        bucket = len(buckets)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                bucket = i
+                break
+        with self.lock:
+            histogram = self.histograms.setdefault(stage, {}).setdefault(name, empty_histogram())
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['min'] = value if histogram['min'] is None else min(histogram['min'], value)
+            histogram['max'] = value if histogram['max'] is None else max(histogram['max'], value)
+            histogram['buckets'][bucket] += 1
+
+    @contextmanager
+    def timer(self, stage, name):
+        """
+        Observes the time the body of a with statement takes
+        :param stage: The stage the histogram belongs to
+        :param name: The name of the histogram
+        :return: None
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, name, time.perf_counter() - start)
+
+    def record_response(self, stage, response, seconds):
+        """
+        Records an HTTP response: the request, its status code, the bytes received and its latency
+        :param stage: The stage the request was made by
+        :param response: requests response
+        :param seconds: The time the request took
+        :return: None
+        """
+        self.increment(stage, 'requests')
+        self.increment(stage, f'status_{response.status_code}')
+        self.increment(stage, 'bytes', len(response.content))
+        self.observe(stage, 'latency_seconds', seconds)
+
+    def snapshot(self):
+        """
+        The metrics of this process
+        :return: Dictionary of the process, its counters and its histograms, copied so they do not change while they
+        are written
+        """
+        self.local()
+        with self.lock:
+            return {'pid': self.pid, 'process': current_process().name, 'counters': deepcopy(self.counters),
+                    'histograms': deepcopy(self.histograms)}
+
+    def flush(self):
+        """
+        Writes the metrics of this process to its file in the metrics directory, if the metrics are enabled
+        :return: None
+        """
+        if self.directory is None:
+            return
+        self.local()
+        # a flush of the report's thread and one of the run would otherwise write the same file aside at once
+        with self.lock:
+            snapshot = self.snapshot()
+            file_name = f'{self.directory}{snapshot["pid"]}.json'
+            # written aside and moved into place so the report never reads a half written file
+            with open(f'{file_name}.tmp', 'w') as out:
+                json.dump(snapshot, out)
+            replace(f'{file_name}.tmp', file_name)
+
+
+metrics = Metrics()
+
+
+def timed_get(stage, url, **kwargs):
+    """
+    Makes an HTTP GET request and records it in the metrics of a stage
+    :param stage: The stage making the request
+    :param url: The URL to get
+    :param kwargs: Keyword arguments passed to requests.get
+    :return: requests response
+    """
+    import requests
+    start = time.perf_counter()
+    response = requests.get(url, **kwargs)
+    metrics.record_response(stage, response, time.perf_counter() - start)
+    return response
+
+
+def enable_metrics(directory=None):
+    """
+    Turns on writing the metrics of this process and of the worker processes it starts. The files of an earlier run
+    are removed, as the report would otherwise combine them with this run's, also where a PID is reused.
+    :param directory: The directory the per process metrics are written to. Defaults to the location in
+    cnst.directories.
+    :return: None
+    """
+    directory = directory if directory is not None else cnst.directories['metrics']
+    makedirs(directory, exist_ok=True)
+    for file in listdir(directory):
+        if file.endswith('.json') or file.endswith('.json.tmp'):
+            remove(f'{directory}{file}')
+    environ[directory_variable] = directory
+
+
+def disable_metrics():
+    """
+    Turns off writing the metrics
+    :return: None
+    """
+    environ.pop(directory_variable, None)
+
+
+def run_report(directory=None, started=None):
+    """
+    Combines the metrics every process wrote into one report, with the totals of each stage and the metrics of each
+    worker
+    :param directory: The directory the per process metrics were written to. Defaults to the enabled directory.
+    :param started: The time.time() the run started at, used to compute the rate of each counter
+    :return: Dictionary of the report
+    """
+    metrics.flush()
+    directory = directory if directory is not None else metrics.directory
+    workers = []
+    if directory is not None and exists(directory):
+        for file in sorted(listdir(directory)):
+            if file.endswith('.json'):
+                with open(f'{directory}{file}', 'r') as file_in:
+                    workers.append(json.load(file_in))
+
+    stages = {}
+    for worker in workers:
+        for stage, counters in worker['counters'].items():
+            totals = stages.setdefault(stage, {'counters': {}, 'histograms': {}})['counters']
+            for name, value in counters.items():
+                totals[name] = totals.get(name, 0) + value
+        for stage, histograms in worker['histograms'].items():
+            totals = stages.setdefault(stage, {'counters': {}, 'histograms': {}})['histograms']
+            for name, histogram in histograms.items():
+                totals[name] = merge_histograms(totals.get(name, empty_histogram()), histogram)
+    for stage in stages.values():
+        for histogram in stage['histograms'].values():
+            histogram['mean'] = histogram['sum'] / histogram['count'] if histogram['count'] > 0 else None
+
+    report = {'generated': time.strftime('%Y-%m-%dT%H:%M:%S'), 'buckets': buckets, 'stages': stages,
+              'workers': workers}
+    if started is not None:
+        report['seconds'] = round(time.time() - started, 3)
+    # the rate of each counter over the time its stage ran, or over the whole run for stages that were not timed
+    for stage in stages.values():
+        seconds = stage['histograms']['stage_seconds']['sum'] if 'stage_seconds' in stage['histograms'] \
+            else report.get('seconds')
+        if seconds is not None and seconds > 0:
+            stage['rates'] = {name: value / seconds for name, value in stage['counters'].items()}
+    return report
+
+
+def write_report(report_file=None, directory=None, started=None):
+    """
+    Writes the run report to the disk
+    :param report_file: The JSON file to write. Defaults to the location in cnst.directories.
+    :param directory: The directory the per process metrics were written to. Defaults to the enabled directory.
+    :param started: The time.time() the run started at
+    :return: Dictionary of the report
+    """
+    report_file = report_file if report_file is not None else cnst.directories['metrics_report']
+    report = run_report(directory, started)
+    with open(report_file, 'w') as out:
+        json.dump(report, out, indent=2)
+    return report
+
+
+def serve_report(port, host='127.0.0.1', started=None):
+    """
+    Serves the current run report as JSON over HTTP from a background thread, so a long run can be watched while
+    it is going
+    :param port: The port to listen on
+    :param host: The address to listen on
+    :param started: The time.time() the run started at
+    :return: The ThreadingHTTPServer, call shutdown() on it to stop serving
+    """
+    class ReportHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(run_report(started=started)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ReportHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
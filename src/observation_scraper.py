@@ -1,47 +1,169 @@
 from os.path import exists
-import requests
 import hashlib
 import json
-from multiprocessing import Pool
-
-import pandas as pd
-from bs4 import BeautifulSoup as bs
-import html5lib
+from multiprocessing import Pool, cpu_count
 
 import src.constants as cnst
-import src.image_utils as iu
+from src.filters import FilterSpec
+from src.metrics import metrics, timed_get
+from src.profiling import traced
+from src.schema import apply_schema, metadata_column, metadata_fields
+from src.storage import ArtifactStore
+
+
+def metadata_values(metadata):
+    """
+    Flattens the fields of the Metadata JSON of an observation that are declared in schema.metadata_fields
+    :param metadata: The Metadata JSON string, or the dictionary it was parsed into
+    :return: Dictionary of each Metadata_* column to its value, None where the field is missing or the JSON is not
+    valid. Nested values are kept as JSON strings.
+    """
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            metadata = None
+    values = {}
+    for field in metadata_fields:
+        value = metadata
+        for key in field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        values[metadata_column(field)] = json.dumps(value) if isinstance(value, (list, dict)) else value
+    return values
+
+
+def expand_metadata(df):
+    """
+    Fills in the Metadata_* columns of the observations that have a Metadata string but none of its fields, such as
+    observations scraped before the Metadata was parsed during the scrape. Each distinct Metadata string is parsed once.
+    :param df: pandas dataframe of observations
+    :return: The dataframe, updated in place
+    """
+    if 'Metadata' not in df.columns:
+        return df
+    columns = [metadata_column(field) for field in metadata_fields]
+    for column in columns:
+        if column not in df.columns:
+            df[column] = None
+    unparsed = df['Metadata'].notna() & df[columns].isna().all(axis=1)
+    if not unparsed.any():
+        return df
+    metadata = df.loc[unparsed, 'Metadata'].astype(object)
+    parsed = {value: metadata_values(value) for value in metadata.unique()}
+    for column in columns:
+        df[column] = df[column].astype(object)
+        df.loc[unparsed, column] = metadata.map(lambda value: parsed[value][column])
+    return df
+
+
+def needs_refresh(observation):
+    """
+    Checks whether the status of a scraped observation can still change. An observation is settled once it is
+    vetted, cnst.final_statuses, and its waterfall, if it has one, is vetted, cnst.final_waterfall_statuses.
+    :param observation: Dictionary of the scraped observation
+    :return: Boolean
+    """
+    if observation.get('Status') not in cnst.final_statuses:
+        return True
+    downloads = observation.get('Downloads')
+    if not isinstance(downloads, dict) or downloads.get('waterfall') is None:
+        return False
+    waterfall_status = str(observation.get('Waterfall_Status') or '').lower()
+    return not any([status.lower() in waterfall_status for status in cnst.final_waterfall_statuses])
+
+
+def conditional_headers(validators):
+    """
+    The headers of a conditional GET
+    :param validators: Dictionary of the etag and last_modified of an earlier response, or None
+    :return: Dictionary of the If-None-Match and If-Modified-Since headers that there are validators for
+    """
+    validators = validators if validators is not None else {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def response_validators(response):
+    """
+    The validators a response can be checked again with
+    :param response: requests response
+    :return: Dictionary of the etag and last_modified of the response, either None if it was not sent
+    """
+    return {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
 
 
 class ObservationScraper:
-    def __init__(self, fetch_waterfalls=True, fetch_logging=True, prints=True):
+    def __init__(self, fetch_waterfalls=True, fetch_logging=True, prints=True,
+                 waterfall_features=cnst.waterfall_features, store=None, filters=None, raw_metadata=True):
         """
         Scrapes the webpages for satellite observations. Waterfall fetches are set to false by default due to the
         very large file sizes.
         :param fetch_waterfalls: Boolean on whether to pull the waterfalls from the observations
         :param fetch_logging: Boolean for logging the fetches
         :param prints: Boolean for printing output in operation.
+        :param waterfall_features: List of PSD features (see image_utils.psd_features) computed when a waterfall is
+        cropped and stored as Waterfall_* columns on the observation
+        :param store: The ArtifactStore the observations dataframe is written through. Defaults to the configured
+        backend.
+        :param filters: The FilterSpec whose waterfall filters an observation must match for its waterfall to be
+        fetched. They are checked once the rest of the page has been scraped.
+        :param raw_metadata: Boolean on whether to keep the Metadata JSON string of each observation. Its declared
+        fields are always parsed into Metadata_* columns while scraping, see schema.metadata_fields.
         """
         self.observations_list = []
         self.fetch_waterfalls = fetch_waterfalls
         self.fetch_logging = fetch_logging
         self.json_file_loc = cnst.directories["observation_json"]
         self.dataframe_file_loc = cnst.directories["observation_csv"]
+        self.validators_file_loc = cnst.directories["observation_validators"]
         self.log_file_loc = cnst.directories["log_file"]
         self.waterfall_path = cnst.directories['waterfalls']
         self.prints = prints
+        self.waterfall_features = list(waterfall_features)
+        self.store = store if store is not None else ArtifactStore()
+        self.filters = filters if filters is not None else FilterSpec()
+        self.raw_metadata = raw_metadata
+
+    @staticmethod
+    def feature_column(feature):
+        """
+        Name of the observation column a waterfall feature is stored in
+        :param feature: The name of the feature, e.g. noise_floor
+        :return: The column name, e.g. Waterfall_Noise_Floor
+        """
+        return "Waterfall_" + "_".join([word.capitalize() for word in feature.split("_")])
+
+    def get_template(self):
+        """
+        Creates an empty observation with a column for each configured waterfall feature and each flattened Metadata
+        field
+        :return: Dictionary of the observation template
+        """
+        template = cnst.observation_template.copy()
+        for feature in self.waterfall_features:
+            template[self.feature_column(feature)] = None
+        for field in metadata_fields:
+            template[metadata_column(field)] = None
+        return template
 
     def get_dataframe(self, load_from_disk_first=True, save_csv=True):
         """
         Gets a dataframe from the saved observation on the disk or from the instantiated object's list
         :param load_from_disk_first: Boolean to load from the disk first
-        :param save_csv: Boolean to save the dataframe as a CSV. Does nothing if the dataframe was loaded from a csv
+        :param save_csv: Boolean to save the dataframe through the store. Does nothing if the dataframe was loaded
+        from the store
         :return: pandas dataframe.
         """
+        import pandas as pd
         if load_from_disk_first:
-            print("Trying to read observations CSV") if self.prints else None
-            if exists(self.dataframe_file_loc):
-                df = pd.read_csv(self.dataframe_file_loc)
-                print("Found and Read CSV") if self.prints else None
+            print(f"Trying to read observations from {self.store.location('observations')}") if self.prints else None
+            if self.store.exists('observations'):
+                df = apply_schema(expand_metadata(self.store.read('observations')), 'observations')
+                print("Found and Read Observations") if self.prints else None
                 return df
             print("Trying to read observations JSON") if self.prints else None
             if exists(self.json_file_loc):
@@ -51,11 +173,51 @@ class ObservationScraper:
         else:
             print("Creating Dataframe From Object List") if self.prints else None
             df = pd.DataFrame.from_dict(self.observations_list)
+        expand_metadata(df)
+        apply_schema(df, 'observations')
         if save_csv:
             print("Saved New Dataframe To Disk") if self.prints else None
-            df.to_csv(self.dataframe_file_loc, index=False)
+            self.store.write('observations', df)
         return df
 
+    def read_validators(self):
+        """
+        Reads the validators of the observation pages scraped or checked so far
+        :return: Dictionary of each observation ID to the etag and last_modified of its page
+        """
+        if not exists(self.validators_file_loc):
+            return {}
+        with open(self.validators_file_loc, 'r') as file_in:
+            return json.load(file_in)
+
+    def keep_validators(self, observations_list):
+        """
+        Moves the validators each observation was scraped with into the validators file, so the first refresh of an
+        observation is already a conditional GET. They travel with the observation until then because scrapes run in
+        worker processes and through the scrape queue.
+        :param observations_list: List of scraped observations. Their Validators keys are removed.
+        :return: None
+        """
+        validators = self.read_validators()
+        kept = 0
+        for observation in observations_list:
+            page_validators = observation.pop('Validators', None) if isinstance(observation, dict) else None
+            if page_validators and observation.get('Observation_id') is not None:
+                validators[str(observation['Observation_id'])] = page_validators
+                kept += 1
+        if kept > 0:
+            with open(self.validators_file_loc, 'w') as out:
+                json.dump(validators, out)
+
+    def write_observations(self):
+        """
+        Writes the observations list to the observations JSON
+        :return: None
+        """
+        with open(self.json_file_loc, 'w') as obs_out:
+            json.dump(self.observations_list, obs_out)
+            print("Saved JSON observations to disk.") if self.prints else None
+
     def scrape_observations(self, observations_list, write_disk=True, clear_list=True):
         """
         Takes a list of observations and scrapes the webpages associated with those URLs
@@ -69,10 +231,9 @@ class ObservationScraper:
         for observation in observations_list:
             url = f'{cnst.web_address}{cnst.observations}{observation}/'
             self.observations_list.append(self.scrape_observation(url))
+        self.keep_validators(self.observations_list)
         if write_disk:
-            with open(self.json_file_loc, 'w') as obs_out:
-                json.dump(self.observations_list, obs_out)
-                print("Saved JSON observations to disk.") if self.prints else None
+            self.write_observations()
 
     def multiprocess_scrape_observations(self, observations_list, write_disk=True, clear_list=True):
         """
@@ -87,37 +248,119 @@ class ObservationScraper:
         urls = [f'{cnst.web_address}{cnst.observations}{observation}/' for observation in observations_list]
         pool = Pool()
         self.observations_list = pool.map(self.scrape_observation, urls)
+        self.keep_validators(self.observations_list)
         if write_disk:
-            with open(self.json_file_loc, 'w') as obs_out:
-                json.dump(self.observations_list, obs_out)
-                print("Saved JSON observations to disk.") if self.prints else None
+            self.write_observations()
+
+    def queue_scrape_observations(self, observations_list, queue=None, processes=None, write_disk=True,
+                                  clear_list=True, reset=False, priority=0):
+        """
+        Functions similar to multiprocess_scrape_observations, but works through a persistent WorkQueue. Finished
+        scrapes are kept in the queue, so a run that is interrupted resumes where it stopped, and failed fetches are
+        retried with a backoff instead of being kept as empty observations.
+        :param observations_list: The list of observations to scrape
+        :param queue: The WorkQueue to scrape through. Defaults to a queue in the configured location.
+        :param processes: The number of worker processes. Defaults to the number of CPUs.
+        :param write_disk: Boolean on whether to write for disk
+        :param clear_list: Boolean on whether to clear the list prior to scraping observations
+        :param reset: Boolean on whether to scrape observations again that the queue has already scraped
+        :param priority: Jobs with a higher priority are scraped first
+        :return: None. Updates the instantiated object's observations_list with the scraped observations. The
+        observations that failed for good are left in the queue, see WorkQueue.failures
+        """
+        from src.work_queue import WorkQueue, work
+        queue = queue if queue is not None else WorkQueue(prints=self.prints)
+        if clear_list:
+            self.observations_list = []
+        queue.add(observations_list, priority=priority, reset=reset)
+        processes = processes if processes is not None else cpu_count()
+        with Pool(processes) as pool:
+            pool.starmap(work, [(queue, self)] * processes)
+        self.observations_list += queue.results(observations_list)
+        print(f"Scrape queue: {queue.counts()}") if self.prints else None
+        self.keep_validators(self.observations_list)
+        if write_disk:
+            self.write_observations()
 
     def scrape_observation(self, url):
         """
         Scrapes a webpage for an observation
         :param url: The url to the website to scrape
-        :return: A dictionary of the scraped webpage
+        :return: A dictionary of the scraped webpage, the empty template if the page could not be fetched. A scraped
+        page also has the Validators of its response, see keep_validators.
         """
-        template = cnst.observation_template.copy()
-        r = requests.get(url)
-        observation = url.split("/")[-2]
+        return self.scrape_page(url)[1]
+
+    @traced('observations.scrape_observation')
+    def scrape_page(self, url):
+        """
+        Scrapes a webpage for an observation, along with the status of the response so failed fetches can be told
+        apart from observations
+        :param url: The url to the website to scrape
+        :return: The HTTP status code and a dictionary of the scraped webpage with the Validators of its response,
+        the empty template if the status is not 200
+        """
+        template = self.get_template()
+        r = self.fetch_page(url)
+        if r.status_code != 200:
+            print(f"Non 200 Status for {url}") if self.prints else None
+            metrics.increment('observations', 'failed')
+            metrics.flush()
+            return r.status_code, template
+
+        template = self.parse_page(url, r)
+        downloads = template['Downloads']
+        if downloads is not None:
+            if self.fetch_waterfalls and downloads['waterfall'] is not None and self.filters.wants_waterfall(template):
+                downloads['waterfall_shape'], downloads['waterfall_hash_name'], psd_summary = self.fetch_waterfall(
+                    downloads['waterfall'], downloads['waterfall_hash_name'])
+                # Lift the PSD summary out of the downloads so each feature is its own column
+                if psd_summary is not None:
+                    for feature, value in psd_summary.items():
+                        template[self.feature_column(feature)] = value
+        template['Validators'] = response_validators(r)
+        print(f"Successful scrape for {url}") if self.prints else None
+        metrics.increment('observations', 'scraped')
+        metrics.flush()
+        return r.status_code, template
+
+    def fetch_page(self, url, validators=None):
+        """
+        Gets the webpage of an observation and logs the response
+        :param url: The url to the website to scrape
+        :param validators: Dictionary of the etag and last_modified of an earlier response, sent as a conditional
+        GET, see conditional_headers
+        :return: requests response
+        """
+        r = timed_get('observations', url, headers=conditional_headers(validators))
         if self.fetch_logging:
             with open(self.log_file_loc, 'a') as log:
                 log.writelines(f'URL: {url} \n')
                 log.writelines(f'status: {r.status_code} \n')
                 log.writelines(f'header: {r.headers} \n')
+        return r
 
-        if r.status_code != 200:
-            print(f"Non 200 Status for {url}") if self.prints else None
-            return template
-
-        observation_web_page = bs(r.content, "html5lib")
+    def parse_page(self, url, response):
+        """
+        Reads the fields of an observation from its webpage. The waterfall is not fetched.
+        :param url: The url the page was fetched from
+        :param response: The requests response with the page
+        :return: A dictionary of the scraped webpage
+        """
+        from bs4 import BeautifulSoup as bs
+        template = self.get_template()
+        with metrics.timer('observations', 'parse_seconds'):
+            observation_web_page = bs(response.content, "html5lib")
         front_line_divs = observation_web_page.find_all("div", class_='front-line')
 
         for div in front_line_divs:
             key, value = self.scrape_div(div)
             if key is not None:
                 template[key] = value
+        # the Metadata is parsed here once, so its fields need no parsing downstream
+        template.update(metadata_values(template['Metadata']))
+        if not self.raw_metadata:
+            template['Metadata'] = None
 
         waterfall_status = observation_web_page.find(id="waterfall-status-label")
         if waterfall_status is not None:
@@ -128,10 +371,99 @@ class ObservationScraper:
         if (status is not None) & (status[0] is not None):
             template['Status'] = status[0].text.strip()
             template['Status_Message'] = status[0].attrs['title'].strip()
-        template['Observation_id'] = observation
-        print(f"Successful scrape for {url}") if self.prints else None
+        template['Observation_id'] = url.split("/")[-2]
         return template
 
+    @traced('observations.refresh_observation')
+    def refresh_page(self, url, validators=None):
+        """
+        Checks the webpage of an observation again with a conditional GET
+        :param url: The url to the website to scrape
+        :param validators: Dictionary of the etag and last_modified of the last response for the page
+        :return: The HTTP status code, the dictionary of the scraped webpage or None if the page was not modified or
+        could not be fetched, and the validators of the page to send next time
+        """
+        r = self.fetch_page(url, validators)
+        if r.status_code == 304:
+            metrics.increment('observations', 'not_modified')
+            metrics.flush()
+            return r.status_code, None, validators
+        if r.status_code != 200:
+            print(f"Non 200 Status for {url}") if self.prints else None
+            metrics.increment('observations', 'failed')
+            metrics.flush()
+            return r.status_code, None, validators
+        metrics.increment('observations', 'refreshed')
+        metrics.flush()
+        return r.status_code, self.parse_page(url, r), response_validators(r)
+
+    def refresh_observations(self, observations_list=None, processes=None, write_disk=True):
+        """
+        Checks the observations whose status can still change again, see needs_refresh, and updates the fields that
+        change once an observation is vetted, cnst.refresh_fields. The pages are requested with the ETag and
+        Last-Modified of the last time they were checked, so a page that has not changed is answered with an empty
+        304 and not parsed again. The validators are kept from the scrape, so only pages scraped before they were kept
+        are checked with a plain GET first. The waterfalls are not fetched again.
+        :param observations_list: The list of scraped observations to refresh. Defaults to the observations JSON.
+        :param processes: The number of worker processes. Defaults to the number of CPUs.
+        :param write_disk: Boolean on whether to write the observations JSON and dataframe when an observation
+        changed. Only the rows of the changed observations are written to a stored dataframe, see
+        ArtifactStore.update. The validators are always written.
+        :return: Dictionary of the number of observations checked, not modified, unchanged, changed and failed.
+        Updates the instantiated object's observations_list.
+        """
+        if observations_list is None:
+            observations_list = []
+            if exists(self.json_file_loc):
+                with open(self.json_file_loc, 'r') as file_in:
+                    observations_list = json.load(file_in)
+        self.observations_list = observations_list
+        self.keep_validators(observations_list)
+        validators = self.read_validators()
+
+        pending = [observation for observation in observations_list
+                   if observation.get('Observation_id') is not None and needs_refresh(observation)]
+        ids = [str(observation['Observation_id']) for observation in pending]
+        arguments = [(f'{cnst.web_address}{cnst.observations}{observation_id}/', validators.get(observation_id))
+                     for observation_id in ids]
+        processes = processes if processes is not None else cpu_count()
+        if processes <= 1 or len(arguments) <= 1:
+            results = [self.refresh_page(*argument) for argument in arguments]
+        else:
+            with Pool(min(processes, len(arguments))) as pool:
+                results = pool.starmap(self.refresh_page, arguments)
+
+        counts = {'checked': len(pending), 'not_modified': 0, 'unchanged': 0, 'changed': 0, 'failed': 0}
+        changed = []
+        for observation_id, observation, (status, page, page_validators) in zip(ids, pending, results):
+            if page_validators:
+                validators[observation_id] = page_validators
+            if status == 304:
+                counts['not_modified'] += 1
+            elif page is None:
+                counts['failed'] += 1
+            elif all([observation.get(field) == page[field] for field in cnst.refresh_fields]):
+                counts['unchanged'] += 1
+            else:
+                observation.update({field: page[field] for field in cnst.refresh_fields})
+                changed.append(observation)
+                counts['changed'] += 1
+        print(f"Refreshed observations: {counts}") if self.prints else None
+
+        with open(self.validators_file_loc, 'w') as out:
+            json.dump(validators, out)
+        if write_disk and counts['changed'] > 0:
+            # the JSON is one document the other stages read whole, so it is written again, while only the rows of
+            # the changed observations are written to the dataset
+            self.write_observations()
+            if self.store.exists('observations'):
+                import pandas as pd
+                self.store.update('observations', expand_metadata(pd.DataFrame.from_dict(changed)))
+            else:
+                self.get_dataframe(load_from_disk_first=False, save_csv=True)
+        return counts
+
+    @traced('observations.scrape_div')
     def scrape_div(self, div):
         """
         Processes an HTML div container element and determines which part of the observation the
@@ -167,35 +499,39 @@ class ObservationScraper:
             audio = None
             waterfall = None
             waterfall_hash_name = None
-            waterfall_shape = None
             for a in div.find_all("a", href=True):
                 if str(a).find("Audio") != -1:
                     audio = a.attrs['href']
                 if str(a).find("Waterfall") != -1:
                     waterfall = a.attrs['href']
                     waterfall_hash_name = f'{hashlib.sha256(bytearray(waterfall, encoding="utf-8")).hexdigest()}.png'
-                    if self.fetch_waterfalls:
-                        waterfall_shape, waterfall_hash_name = self.fetch_waterfall(waterfall, waterfall_hash_name)
+            # the waterfall is fetched by scrape_page, once the observation is known to pass the waterfall filters
             return 'Downloads', {'audio': audio, "waterfall": waterfall, "waterfall_hash_name": waterfall_hash_name,
-                                 "waterfall_shape": waterfall_shape}
+                                 "waterfall_shape": None}
         return None, None
 
+    @traced('observations.fetch_waterfall')
     def fetch_waterfall(self, url, file_name):
         """
         Fetches and writes waterfall PNGs to the disk, then crops the image and converts it to grey scale.
         :param url: The URL to the waterfall file to pull
         :param file_name: The name the file should be saved as.
-        :return: The shape of the cropped image and name of the waterfall written to disk as a bytes object.
+        :return: The shape of the cropped image, name of the waterfall written to disk as a bytes object and the
+        dictionary of computed PSD features.
         """
-        res = requests.get(url)
+        import src.image_utils as iu
+        with metrics.timer('waterfalls', 'download_seconds'):
+            res = timed_get('waterfalls', url)
         waterfall_name = self.waterfall_path + file_name
 
         with open(waterfall_name, 'wb') as out:
             out.write(res.content)
 
-        cropped_shape, bytes_name = iu.crop_and_save_psd(waterfall_name)
+        with metrics.timer('waterfalls', 'crop_seconds'):
+            cropped_shape, bytes_name, psd_summary = iu.crop_and_save_psd(waterfall_name,
+                                                                           features=self.waterfall_features)
 
-        return cropped_shape, bytes_name
+        return cropped_shape, bytes_name, psd_summary
 
 
 if __name__ == '__main__':
@@ -0,0 +1,413 @@
+import argparse
+import hashlib
+import json
+from os import listdir, stat
+from os.path import exists, isdir, isfile
+import time
+
+import src.constants as cnst
+from src.data_pull import prepare_directory, complete_dataset, stream_complete_dataset, summarize_dataset
+from src.filters import FilterSpec
+from src.observation_scraper import ObservationScraper
+from src.satellites import Satellites, is_decayed
+from src.storage import ArtifactStore, backends
+from src.telemetry import Telemetry
+
+# The stages of a pipeline run in the order they are run, and the stages each one reads the outputs of
+stages = ['satellites', 'telemetry', 'observations', 'combined']
+
+dependencies = {
+    'satellites': [],
+    'telemetry': ['satellites'],
+    'observations': ['telemetry'],
+    'combined': ['satellites', 'telemetry', 'observations'],
+}
+
+
+def fingerprint(path):
+    """
+    Fingerprints an input of a stage. Files are hashed by their contents. Directories, such as the telemetry
+    archive, are fingerprinted by the name, size and modification time of their files so they are not read in full.
+    :param path: The file or directory
+    :return: Hex digest, or None if the path does not exist
+    """
+    digest = hashlib.sha256()
+    if isfile(path):
+        with open(path, 'rb') as file_in:
+            for block in iter(lambda: file_in.read(1 << 20), b''):
+                digest.update(block)
+    elif isdir(path):
+        for file in sorted(listdir(path)):
+            file_stat = stat(f'{path}{file}')
+            digest.update(f'{file}:{file_stat.st_size}:{file_stat.st_mtime_ns};'.encode('utf-8'))
+    else:
+        return None
+    return digest.hexdigest()
+
+
+def record_fingerprint(record):
+    """
+    Fingerprints a single record, such as one satellite of the catalogue
+    :param record: JSON serializable dictionary
+    :return: Hex digest
+    """
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def telemetry_fingerprint(satellite, event_filters=None):
+    """
+    Fingerprints what the telemetry archive of a satellite was fetched for: its catalogue record and the event
+    filters, which limit the events that are fetched and archived
+    :param satellite: The record of the satellite in the catalogue
+    :param event_filters: List of (column, op, value) event filters the telemetry was fetched with
+    :return: Hex digest
+    """
+    if event_filters is None or len(event_filters) == 0:
+        return record_fingerprint(satellite)
+    return record_fingerprint({'satellite': satellite, 'event_filters': [list(f) for f in event_filters]})
+
+
+class Pipeline:
+    def __init__(self, store=None, manifest_file=None, max_pages=1e10,
+                 stream_join=False, memory_budget_mb=256, prints=True, filters=None, summary=False,
+                 catalogue_max_age_hours=24):
+        """
+        Runs the satellites, telemetry, observations and combined stages of a data pull as a dependency graph.
+        The inputs, parameters and outputs of each stage are recorded in a manifest, and a stage whose inputs have
+        not changed since it last completed is skipped. The telemetry stage only fetches satellites whose catalogue
+        entry changed and the observations stage only scrapes observations it has not scraped before, so a small
+        catalogue change does not cost a full crawl.
+        :param store: The ArtifactStore the tabular artifacts are written through. Defaults to the configured backend.
+        :param manifest_file: The JSON file the stage records are kept in. Defaults to the location in
+        cnst.directories.
+        :param max_pages: The max number of telemetry pages per satellite
+        :param stream_join: Boolean on whether the combined stage uses stream_complete_dataset
+        :param memory_budget_mb: Approximate memory a batch of the streamed join may use
+        :param prints: Boolean on whether to print to the screen
+        :param filters: The FilterSpec limiting the satellites whose telemetry is fetched, the events whose
+        observations are scraped and the waterfalls that are downloaded
+        :param summary: Boolean on whether the combined stage writes one row per observation with summarize_dataset
+        instead of one per frame
+        :param catalogue_max_age_hours: The age after which the satellites stage is no longer current. The stage reads
+        no local files, so it is the only way a change to the remote catalogue is picked up without --refresh. None
+        keeps the catalogue until it is refreshed or forced.
+        """
+        self.store = store if store is not None else ArtifactStore()
+        self.manifest_file = manifest_file if manifest_file is not None else cnst.directories['pipeline_manifest']
+        self.max_pages = max_pages
+        self.stream_join = stream_join
+        self.memory_budget_mb = memory_budget_mb
+        self.prints = prints
+        self.filters = filters if filters is not None else FilterSpec()
+        self.summary = summary
+        self.catalogue_max_age_hours = catalogue_max_age_hours
+        self.manifest = self.load_manifest()
+        self.items = {}
+
+    def load_manifest(self):
+        """
+        Loads the stage records of earlier runs
+        :return: Dictionary of stage name to its record
+        """
+        if exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as file_in:
+                return json.load(file_in)
+        return {}
+
+    def save_manifest(self):
+        """
+        Writes the stage records to the disk
+        :return: None
+        """
+        with open(self.manifest_file, 'w') as out:
+            json.dump(self.manifest, out, indent=2)
+
+    def stage_inputs(self, stage):
+        """
+        Fingerprints the files a stage reads
+        :param stage: The name of the stage
+        :return: Dictionary of path to fingerprint
+        """
+        inputs = {
+            'satellites': [],
+            'telemetry': [cnst.directories['satellites_json']],
+            'observations': [cnst.directories['tm_events']],
+            'combined': [cnst.directories['satellites_json'], cnst.directories['tm_events'],
+                         cnst.directories['observation_json']],
+        }[stage]
+        return {path: fingerprint(path) for path in inputs}
+
+    def stage_outputs(self, stage):
+        """
+        The files a stage writes
+        :param stage: The name of the stage
+        :return: List of paths
+        """
+        return {
+            'satellites': [cnst.directories['satellites_json']],
+            'telemetry': [cnst.directories['tm_events']],
+            'observations': [cnst.directories['observation_json']],
+            'combined': [self.store.location('summary' if self.summary else 'combined')],
+        }[stage]
+
+    def stage_params(self, stage):
+        """
+        The settings that change what a stage writes
+        :param stage: The name of the stage
+        :return: Dictionary of the settings
+        """
+        params = {
+            'satellites': {'storage': self.store.backend},
+            'telemetry': {'storage': self.store.backend, 'max_pages': self.max_pages},
+            'observations': {'storage': self.store.backend},
+            'combined': {'storage': self.store.backend, 'stream_join': self.stream_join},
+        }[stage]
+        filters = self.filters.to_dict()
+        if stage in ['telemetry', 'observations'] and any([len(level) > 0 for level in filters.values()]):
+            params['filters'] = filters
+        if stage == 'combined' and self.summary:
+            params['summary'] = True
+        return params
+
+    def stage_age(self, stage):
+        """
+        The time since a stage last completed
+        :param stage: The name of the stage
+        :return: Hours, or None if the stage has not completed
+        """
+        record = self.manifest.get(stage)
+        if record is None:
+            return None
+        return (time.time() - time.mktime(time.strptime(record['completed'], '%Y-%m-%dT%H:%M:%S'))) / 3600
+
+    def pending_satellites(self, items):
+        """
+        The selected satellites of the catalogue whose telemetry was never fetched completely, or was fetched for
+        another catalogue entry or other event filters
+        :param items: Dictionary of sat_id to the telemetry_fingerprint of its record when its telemetry was last
+        fetched
+        :return: List of sat_ids
+        """
+        if not exists(cnst.directories['satellites_json']):
+            return []
+        with open(cnst.directories['satellites_json'], 'r') as file_in:
+            catalogue = self.filters.select_catalogue(json.load(file_in))
+        return self.satellites_to_fetch(catalogue, items, event_filters=self.filters.events)
+
+    def is_current(self, stage):
+        """
+        Checks whether a stage has completed with the same inputs and settings and its outputs are still on the disk.
+        The satellites stage is also only current for catalogue_max_age_hours after it completed, and the telemetry
+        stage only while no selected satellite is left to fetch, such as one whose fetch failed.
+        :param stage: The name of the stage
+        :return: Boolean
+        """
+        record = self.manifest.get(stage)
+        if record is None:
+            return False
+        if not all([exists(path) for path in self.stage_outputs(stage)]):
+            return False
+        if stage == 'satellites' and self.catalogue_max_age_hours is not None and \
+                self.stage_age(stage) > self.catalogue_max_age_hours:
+            return False
+        if stage == 'telemetry' and len(self.pending_satellites(record.get('items', {}))) > 0:
+            return False
+        return record['inputs'] == self.stage_inputs(stage) and record['params'] == self.stage_params(stage)
+
+    def record(self, stage, seconds):
+        """
+        Records a completed stage in the manifest
+        :param stage: The name of the stage
+        :param seconds: The time the stage took
+        :return: None
+        """
+        self.manifest[stage] = {
+            'inputs': self.stage_inputs(stage),
+            'params': self.stage_params(stage),
+            'outputs': self.stage_outputs(stage),
+            'items': self.items.get(stage, self.manifest.get(stage, {}).get('items', {})),
+            'completed': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seconds': round(seconds, 3),
+        }
+        self.save_manifest()
+
+    def run(self, selected=None, force=False, sat_ids=None, refresh=False):
+        """
+        Runs the selected stages in dependency order, skipping those that are current
+        :param selected: List of stage names to run, None runs all of them
+        :param force: Boolean on whether to run the selected stages even if they are current
+        :param sat_ids: List of sat_ids to re-fetch telemetry for. The stages after telemetry then update for them.
+        :param refresh: Boolean on whether to fetch the catalogue again, the telemetry of every satellite that is
+        still transmitting, see satellites_to_fetch, and the status of every observation that is not vetted yet, see
+        ObservationScraper.refresh_observations. The stages after them then update.
+        :return: List of the stages that ran
+        """
+        selected = stages if selected is None else selected
+        prepare_directory(clear=False)
+        ran = []
+        for stage in stages:
+            if stage not in selected:
+                continue
+            missing = [dependency for dependency in dependencies[stage] if dependency not in self.manifest]
+            if len(missing) > 0:
+                print(f"Cannot run {stage} before {', '.join(missing)}") if self.prints else None
+                break
+            forced = force or (stage == 'telemetry' and sat_ids is not None and len(sat_ids) > 0) or \
+                (refresh and stage in ['satellites', 'telemetry', 'observations'])
+            if not forced and self.is_current(stage):
+                print(f"Skipping {stage}, its inputs have not changed") if self.prints else None
+                continue
+            print(f"Running {stage}") if self.prints else None
+            start = time.time()
+            getattr(self, f'run_{stage}')(force=force, sat_ids=sat_ids, refresh=refresh)
+            self.record(stage, time.time() - start)
+            ran.append(stage)
+        return ran
+
+    def run_satellites(self, force=False, sat_ids=None, refresh=False):
+        """
+        Fetches the satellite catalogue and records what changed since it was last fetched
+        """
+        satellites = Satellites(prints=self.prints, store=self.store)
+        satellites.refresh()
+        satellites.get_dataframe(save_to_disk=True)
+
+    @staticmethod
+    def satellites_to_fetch(catalogue, items, force=False, sat_ids=None, refresh=False, event_filters=None):
+        """
+        Picks the satellites the telemetry stage fetches. Satellites whose telemetry was never fetched come first,
+        then those whose catalogue entry or event filters changed, then, when forced or refreshing, the unchanged ones.
+        An archive fetched with other event filters only holds the events they matched, so it is fetched again.
+        :param catalogue: List of satellite records from the satellites JSON
+        :param items: Dictionary of sat_id to the telemetry_fingerprint of its record when its telemetry was last
+        fetched
+        :param force: Boolean on whether to fetch every satellite
+        :param sat_ids: List of sat_ids to fetch instead of the changed satellites
+        :param refresh: Boolean on whether to also fetch the unchanged satellites that have not decayed, whose
+        telemetry keeps growing
+        :param event_filters: List of the (column, op, value) event filters the telemetry is fetched with
+        :return: List of sat_ids
+        """
+        if sat_ids is not None and len(sat_ids) > 0:
+            return list(sat_ids)
+        fingerprints = {satellite['sat_id']: telemetry_fingerprint(satellite, event_filters) for satellite in catalogue}
+        new = [satellite['sat_id'] for satellite in catalogue if satellite['sat_id'] not in items]
+        changed = [satellite['sat_id'] for satellite in catalogue if satellite['sat_id'] in items and
+                   items[satellite['sat_id']] != fingerprints[satellite['sat_id']]]
+        unchanged = [satellite['sat_id'] for satellite in catalogue if satellite['sat_id'] in items and
+                     items[satellite['sat_id']] == fingerprints[satellite['sat_id']] and
+                     (force or (refresh and not is_decayed(satellite)))]
+        return new + changed + unchanged
+
+    def run_telemetry(self, force=False, sat_ids=None, refresh=False):
+        """
+        Fetches telemetry for the new and changed satellites of the catalogue, and for the satellites fetched with
+        other event filters, then rebuilds the events dataset from the archive
+        """
+        with open(cnst.directories['satellites_json'], 'r') as file_in:
+            catalogue = json.load(file_in)
+        items = dict(self.manifest.get('telemetry', {}).get('items', {}))
+        selected = self.filters.select_catalogue(catalogue)
+        to_fetch = self.satellites_to_fetch(selected, items, force, sat_ids, refresh, self.filters.events)
+        print(f"Fetching telemetry for {len(to_fetch)} of {len(catalogue)} satellites") if self.prints else None
+
+        tm = Telemetry(prints=self.prints, max_pages=self.max_pages, store=self.store, filters=self.filters)
+        fetched = tm.multiprocess_fetch(to_fetch) if len(to_fetch) > 0 else []
+
+        # a satellite whose fetch failed is recorded as never fetched, so the next run fetches it again
+        fingerprints = {satellite['sat_id']: telemetry_fingerprint(satellite, self.filters.events)
+                        for satellite in catalogue}
+        for sat_id in to_fetch:
+            if sat_id in fingerprints and sat_id in fetched:
+                items[sat_id] = fingerprints[sat_id]
+            else:
+                items.pop(sat_id, None)
+        failed = [sat_id for sat_id in to_fetch if sat_id not in fetched]
+        print(f"Failed to fetch the telemetry of {len(failed)} satellites") if self.prints and len(failed) > 0 else None
+        self.items['telemetry'] = {sat_id: value for sat_id, value in items.items() if sat_id in fingerprints}
+        tm.get_events_df(save_csv=True)
+
+    def run_observations(self, force=False, sat_ids=None, refresh=False):
+        """
+        Scrapes the observations referenced by telemetry events that have not been scraped yet. Observations whose
+        scrape failed for good are left out and tried again on the next run. A refresh first checks the observations
+        already scraped that are not vetted yet for a new status. Only the events of the selected
+        satellites that match the event filters are considered, so narrowing the filters needs no new telemetry.
+        """
+        import pandas as pd
+        columns = list(dict.fromkeys(['observation_id', 'sat_id'] + self.filters.event_columns()))
+        if self.store.exists('events'):
+            events = self.store.read('events', columns=columns)
+        else:
+            with open(cnst.directories['tm_compiled_json'], 'r') as file_in:
+                events = pd.DataFrame.from_dict(json.load(file_in))
+        events = self.filters.select_events(events)
+        if len(self.filters.satellites) > 0:
+            with open(cnst.directories['satellites_json'], 'r') as file_in:
+                selected = [satellite['sat_id'] for satellite in self.filters.select_catalogue(json.load(file_in))]
+            events = events[events['sat_id'].isin(selected)]
+        observation_ids = events['observation_id'].fillna(0).astype(int)
+        observation_ids = observation_ids[observation_ids > 0].unique()
+
+        existing = []
+        if exists(cnst.directories['observation_json']) and not force:
+            with open(cnst.directories['observation_json'], 'r') as file_in:
+                # failed scrapes have no Observation_id and are tried again
+                existing = [observation for observation in json.load(file_in)
+                            if observation['Observation_id'] is not None]
+        scraped = set([str(observation['Observation_id']) for observation in existing])
+        to_scrape = [observation_id for observation_id in observation_ids if str(observation_id) not in scraped]
+        print(f"Scraping {len(to_scrape)} new of {len(observation_ids)} observations") if self.prints else None
+
+        # scrapes go through the persistent queue, so a run that is interrupted keeps what it already scraped
+        scraper = ObservationScraper(prints=self.prints, store=self.store, filters=self.filters)
+        if refresh and len(existing) > 0:
+            scraper.refresh_observations(existing, write_disk=False)
+        new = []
+        if len(to_scrape) > 0:
+            scraper.queue_scrape_observations(to_scrape, write_disk=False, reset=force)
+            new = scraper.observations_list
+        scraper.observations_list = existing + new
+        with open(cnst.directories['observation_json'], 'w') as out:
+            json.dump(scraper.observations_list, out)
+        scraper.get_dataframe(load_from_disk_first=False, save_csv=True)
+
+    def run_combined(self, force=False, sat_ids=None, refresh=False):
+        """
+        Combines the satellites, events and observations into the combined dataset, or into the summary with one row
+        per observation
+        """
+        if self.summary:
+            summarize_dataset(memory_budget_mb=self.memory_budget_mb, store=self.store)
+        elif self.stream_join:
+            stream_complete_dataset(memory_budget_mb=self.memory_budget_mb, store=self.store, prints=self.prints)
+        else:
+            complete_dataset(store=self.store, prints=self.prints)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Incrementally compile a dataset from SATNOGS")
+    parser.add_argument('--stage', nargs='+', choices=stages, default=None,
+                        help="Run only these stages. By default every stage whose inputs changed is run.")
+    parser.add_argument('--force', action='store_true', help="Run the selected stages even if they are current")
+    parser.add_argument('--sat-id', nargs='+', default=None, help="Re-fetch the telemetry of these satellites")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Fetch the catalogue again, the telemetry of the satellites that have not decayed and "
+                             "the status of the observations that are not vetted")
+    parser.add_argument('--storage', choices=backends, default=cnst.storage_backend)
+    parser.add_argument('--max-pages', type=int, default=10000000)
+    parser.add_argument('--stream-join', action='store_true')
+    parser.add_argument('--memory-budget-mb', type=int, default=256)
+    parser.add_argument('--summary', action='store_true',
+                        help="Write one row per observation with its frames summarized instead of the combined dataset")
+    parser.add_argument('--filters', default=None,
+                        help="JSON file of the satellite, event and waterfall filters that limit the crawl")
+    parser.add_argument('--catalogue-max-age-hours', type=float, default=24,
+                        help="Fetch the catalogue again once it is older than this, 0 fetches it on every run")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(store=ArtifactStore(backend=args.storage, prints=True), max_pages=args.max_pages,
+                        stream_join=args.stream_join, memory_budget_mb=args.memory_budget_mb,
+                        filters=FilterSpec.from_file(args.filters) if args.filters is not None else None,
+                        summary=args.summary, catalogue_max_age_hours=args.catalogue_max_age_hours)
+    pipeline.run(selected=args.stage, force=args.force, sat_ids=args.sat_id, refresh=args.refresh)
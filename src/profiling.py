@@ -0,0 +1,233 @@
+from contextlib import contextmanager
+import cProfile
+from functools import wraps
+import io
+from os import environ, getpid, listdir, makedirs, remove
+from os.path import exists
+import json
+import pstats
+import threading
+import time
+
+import src.constants as cnst
+
+# Pool workers inherit the profiling settings through the environment, whichever way their process is started
+directory_variable = 'SATNOGS_PROFILE_DIR'
+mode_variable = 'SATNOGS_PROFILE_MODE'
+
+# 'trace' records a span for each traced call, 'cprofile' also runs the deterministic profiler inside the spans
+modes = ['trace', 'cprofile']
+
+
+class Profiler:
+    def __init__(self):
+        """
+        Records trace spans around the hot paths of a run, and optionally profiles them with cProfile. Each process
+        keeps its own spans and profile and writes them to files of its own in the profile directory whenever its
+        outermost span ends, which in a multiprocessing.Pool worker is the end of each task. write_profile_report
+        merges the files of every process. Nothing is recorded until profiling is enabled.
+        """
+        self.pid = getpid()
+        self.events = []
+        self.stacks = {}
+        self.profile = None
+
+    @property
+    def directory(self):
+        """
+        The directory the per process spans and profiles are written to, None when profiling is disabled
+        """
+        return environ.get(directory_variable)
+
+    @property
+    def mode(self):
+        """
+        The profiling mode, one of modes
+        """
+        return environ.get(mode_variable, 'trace')
+
+    def local(self):
+        """
+        Starts from no spans in a forked worker, which would otherwise write its parent's spans as its own
+        :return: None
+        """
+        if getpid() != self.pid:
+            self.pid = getpid()
+            self.events = []
+            self.stacks = {}
+            self.profile = None
+
+    @contextmanager
+    def span(self, name):
+        """
+        Records the time the body of a with statement takes as a span nested in the spans already open on the thread
+        :param name: The name of the span, such as 'telemetry.fetch_telemetry_by_satellite'
+        :return: None
+        """
+        if self.directory is None:
+            yield
+            return
+        self.local()
+        thread = threading.get_ident()
+        stack = self.stacks.setdefault(thread, [])
+        outermost = len(stack) == 0
+        if outermost and self.mode == 'cprofile' and threading.current_thread() is threading.main_thread():
+            self.profile = self.profile if self.profile is not None else cProfile.Profile()
+            self.profile.enable()
+        stack.append(name)
+        start = time.time_ns()
+        try:
+            yield
+        finally:
+            duration = time.time_ns() - start
+            self.events.append({'name': name, 'stack': ';'.join(stack), 'ts': start // 1000, 'dur': duration // 1000,
+                                'pid': self.pid, 'tid': thread})
+            stack.pop()
+            if outermost:
+                if self.profile is not None and threading.current_thread() is threading.main_thread():
+                    self.profile.disable()
+                self.flush()
+
+    def flush(self):
+        """
+        Appends the spans recorded since the last flush to the span file of this process, and writes its profile
+        :return: None
+        """
+        if self.directory is None:
+            return
+        events, self.events = self.events, []
+        with open(f'{self.directory}{self.pid}.spans.jsonl', 'a') as out:
+            out.writelines([json.dumps(event) + '\n' for event in events])
+        if self.profile is not None:
+            self.profile.dump_stats(f'{self.directory}{self.pid}.prof')
+
+
+profiler = Profiler()
+
+
+def traced(name):
+    """
+    Decorates a function so each call is recorded as a span while profiling is enabled
+    :param name: The name of the span
+    :return: The decorator
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if profiler.directory is None:
+                return function(*args, **kwargs)
+            with profiler.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable_profiling(mode='trace', directory=None):
+    """
+    Turns on profiling in this process and the worker processes it starts. The files of an earlier run are removed,
+    as the span files are appended to and a reused PID would otherwise merge the earlier run's spans into this one.
+    :param mode: 'trace' for spans only, 'cprofile' to also profile the code inside the spans
+    :param directory: The directory the per process files are written to. Defaults to the location in
+    cnst.directories.
+    :return: None
+    """
+    if mode not in modes:
+        raise ValueError(f"Unknown profiling mode {mode}, expected one of {modes}")
+    directory = directory if directory is not None else cnst.directories['profiles']
+    makedirs(directory, exist_ok=True)
+    for file in listdir(directory):
+        if file.endswith('.spans.jsonl') or file.endswith('.prof'):
+            remove(f'{directory}{file}')
+    profiler.profile = None
+    environ[directory_variable] = directory
+    environ[mode_variable] = mode
+
+
+def disable_profiling():
+    """
+    Turns off profiling
+    :return: None
+    """
+    environ.pop(directory_variable, None)
+    environ.pop(mode_variable, None)
+
+
+def load_spans(directory):
+    """
+    Reads the spans every process wrote
+    :param directory: The profile directory
+    :return: List of span dictionaries
+    """
+    events = []
+    for file in sorted(listdir(directory)):
+        if file.endswith('.spans.jsonl'):
+            with open(f'{directory}{file}', 'r') as file_in:
+                events.extend([json.loads(line) for line in file_in if line.strip() != ''])
+    return events
+
+
+def chrome_trace(events):
+    """
+    Converts spans to the Chrome trace event format, which chrome://tracing and Perfetto open
+    :param events: List of span dictionaries
+    :return: Dictionary of the trace
+    """
+    return {'traceEvents': [{'name': event['name'], 'cat': 'span', 'ph': 'X', 'ts': event['ts'], 'dur': event['dur'],
+                             'pid': event['pid'], 'tid': event['tid']} for event in events],
+            'displayTimeUnit': 'ms'}
+
+
+def folded_stacks(events):
+    """
+    Folds spans into the stack format flame graph tools read, one 'outer;inner microseconds' line per stack. The
+    time of each stack is its own time, without the time of the spans nested in it.
+    :param events: List of span dictionaries
+    :return: Dictionary of stack to microseconds
+    """
+    totals = {}
+    for event in events:
+        totals[event['stack']] = totals.get(event['stack'], 0) + event['dur']
+    self_time = dict(totals)
+    for stack, duration in totals.items():
+        if ';' in stack:
+            parent = stack.rsplit(';', 1)[0]
+            if parent in self_time:
+                self_time[parent] -= duration
+    return {stack: max(duration, 0) for stack, duration in self_time.items()}
+
+
+def write_profile_report(directory=None, output_directory=None):
+    """
+    Merges the spans and profiles of every process into one report: a Chrome trace, folded stacks for a flame graph
+    and, in cprofile mode, one merged cProfile dump with a text summary
+    :param directory: The profile directory. Defaults to the enabled directory.
+    :param output_directory: The directory to write the report to. Defaults to the location in cnst.directories.
+    :return: Dictionary of the name of each output to its path
+    """
+    profiler.flush()
+    directory = directory if directory is not None else profiler.directory
+    output_directory = output_directory if output_directory is not None else cnst.directories['profile_report']
+    makedirs(output_directory, exist_ok=True)
+    outputs = {}
+    if directory is None or not exists(directory):
+        return outputs
+
+    events = load_spans(directory)
+    outputs['trace'] = f'{output_directory}trace.json'
+    with open(outputs['trace'], 'w') as out:
+        json.dump(chrome_trace(events), out)
+    outputs['folded'] = f'{output_directory}spans.folded'
+    with open(outputs['folded'], 'w') as out:
+        out.writelines([f'{stack} {duration}\n' for stack, duration in sorted(folded_stacks(events).items())])
+
+    profiles = [f'{directory}{file}' for file in sorted(listdir(directory)) if file.endswith('.prof')]
+    if len(profiles) > 0:
+        stats = pstats.Stats(*profiles)
+        outputs['profile'] = f'{output_directory}profile.prof'
+        stats.dump_stats(outputs['profile'])
+        summary = io.StringIO()
+        pstats.Stats(outputs['profile'], stream=summary).sort_stats('cumulative').print_stats(50)
+        outputs['summary'] = f'{output_directory}profile.txt'
+        with open(outputs['summary'], 'w') as out:
+            out.write(summary.getvalue())
+    return outputs
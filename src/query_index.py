@@ -0,0 +1,215 @@
+from contextlib import closing
+from os import remove
+from os.path import exists
+import json
+import sqlite3
+
+import src.constants as cnst
+from src.schema import apply_schema
+
+# Columns of the combined dataset the index can look rows up by
+indexed_columns = ['sat_id', 'norad_cat_id', 'Station', 'Observation_id', 'timestamp']
+
+table = 'combined'
+# Table of the dataframe column each table column holds. SQLite column names ignore case, so columns such as
+# 'Transmitter' of the observations and 'transmitter' of the events are stored under distinct names.
+columns_table = 'columns'
+
+# Timestamps are stored in one ISO 8601 format so they compare as strings in time order
+timestamp_format = '%Y-%m-%dT%H:%M:%S%z'
+
+
+def to_timestamp(value):
+    """
+    Converts a bound of a timestamp filter to the stored format
+    :param value: ISO 8601 string or datetime, taken as UTC when it has no timezone
+    :return: String timestamp
+    """
+    import pandas as pd
+    value = pd.Timestamp(value)
+    value = value.tz_localize('UTC') if value.tz is None else value.tz_convert('UTC')
+    return value.strftime(timestamp_format)
+
+
+class QueryIndex:
+    def __init__(self, db_file=None, prints=False):
+        """
+        An embedded SQLite copy of the combined dataset with indexes on sat_id, norad_cat_id, Station,
+        Observation_id and timestamp, so questions like "every observation of a satellite from one station last
+        month" are answered in milliseconds without loading the whole combined dataset.
+        :param db_file: The SQLite database file. Defaults to the location in cnst.directories.
+        :param prints: Boolean for whether print statements should be executed.
+        """
+        self.db_file = db_file if db_file is not None else cnst.directories['query_index']
+        self.prints = prints
+        self.columns = None
+
+    def exists(self):
+        """
+        Checks whether the index has been built
+        :return: Boolean
+        """
+        return exists(self.db_file)
+
+    def connect(self):
+        """
+        Opens a connection to the database
+        :return: sqlite3 connection
+        """
+        return sqlite3.connect(self.db_file)
+
+    @staticmethod
+    def to_rows(df):
+        """
+        Converts a dataframe to the values stored in SQLite. Nested lists and dictionaries are stored as JSON strings
+        and timestamps as ISO 8601 strings, which sort and compare in time order.
+        :param df: The dataframe to convert
+        :return: The converted dataframe
+        """
+        import pandas as pd
+        df = df.copy()
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                timestamps = df[column].dt.tz_convert('UTC') if df[column].dt.tz is not None else df[column]
+                df[column] = timestamps.dt.strftime(timestamp_format).astype(object).where(timestamps.notna(), None)
+            elif isinstance(df[column].dtype, pd.CategoricalDtype) or df[column].dtype == object:
+                df[column] = df[column].astype(object).map(
+                    lambda value: json.dumps(value) if isinstance(value, (list, dict)) else value)
+        return df
+
+    def clear(self):
+        """
+        Removes the index from the disk
+        :return: None
+        """
+        if self.exists():
+            remove(self.db_file)
+        self.columns = None
+
+    def build(self, df):
+        """
+        Replaces the index with the rows of a combined dataframe
+        :param df: The combined dataframe
+        :return: None
+        """
+        self.clear()
+        self.append(df)
+        self.create_indexes()
+        print(f"Built the query index at {self.db_file}") if self.prints else None
+
+    def load_columns(self, connection):
+        """
+        Loads the table column of each dataframe column of an existing index
+        :param connection: sqlite3 connection
+        :return: Dictionary of dataframe column to table column, or None if the index is empty
+        """
+        if connection.execute("SELECT name FROM sqlite_master WHERE name = ?", (columns_table,)).fetchone() is None:
+            return None
+        return dict(connection.execute(f'SELECT name, stored FROM "{columns_table}" ORDER BY position').fetchall())
+
+    @staticmethod
+    def stored_names(columns, taken=None):
+        """
+        Names the table column of each dataframe column, suffixing names that only differ from an earlier one by case
+        :param columns: List of dataframe columns
+        :param taken: List of the table columns that already exist
+        :return: Dictionary of dataframe column to table column
+        """
+        stored = {}
+        taken = set([name.lower() for name in taken]) if taken is not None else set()
+        for column in columns:
+            name = column
+            while name.lower() in taken:
+                name = f'{name}_'
+            taken.add(name.lower())
+            stored[column] = name
+        return stored
+
+    def append(self, df):
+        """
+        Adds the rows of a combined dataframe to the index, so the batches of the streamed join can be appended one
+        at a time. A column the earlier rows do not have is added to the table, and is empty for those rows. The
+        events and the satellites both have a norad_cat_id, which the join suffixes, so the index adds one
+        norad_cat_id column to look them up by.
+        :param df: The combined dataframe
+        :return: None
+        """
+        import pandas as pd
+        if 'norad_cat_id' not in df.columns and 'norad_cat_id_x' in df.columns:
+            df = df.assign(norad_cat_id=df['norad_cat_id_x'].fillna(df['norad_cat_id_y']))
+        with closing(self.connect()) as connection, connection:
+            if self.columns is None:
+                self.columns = self.load_columns(connection)
+            known = self.columns if self.columns is not None else {}
+            added = self.stored_names([str(column) for column in df.columns if str(column) not in known],
+                                      taken=list(known.values()))
+            if len(added) > 0:
+                if len(known) > 0:
+                    print(f"Adding the columns {list(added.keys())} to the query index") if self.prints else None
+                    for stored in added.values():
+                        connection.execute(f'ALTER TABLE {table} ADD COLUMN "{stored}"')
+                pd.DataFrame({'name': list(added.keys()), 'stored': list(added.values()),
+                              'position': range(len(known), len(known) + len(added))}).to_sql(
+                    columns_table, connection, index=False, if_exists='append')
+                self.columns = {**known, **added}
+            rows = self.to_rows(df.reindex(columns=list(self.columns.keys()))).rename(columns=self.columns)
+            rows.to_sql(table, connection, if_exists='append', index=False)
+
+    def create_indexes(self):
+        """
+        Creates the indexes on the indexed columns of the table
+        :return: None
+        """
+        with closing(self.connect()) as connection, connection:
+            self.columns = self.load_columns(connection) if self.columns is None else self.columns
+            for column in indexed_columns:
+                if self.columns is not None and column in self.columns:
+                    connection.execute(f'CREATE INDEX IF NOT EXISTS "idx_{column}" ON {table} '
+                                       f'("{self.columns[column]}")')
+
+    def query(self, sat_id=None, norad_cat_id=None, station=None, observation_id=None, start=None, end=None,
+              columns=None, limit=None):
+        """
+        Reads the rows of the combined dataset matching all of the given filters
+        :param sat_id: A sat_id or list of them
+        :param norad_cat_id: A NORAD ID or list of them
+        :param station: A Station, such as '1 - Station 1', or list of them
+        :param observation_id: An observation ID or list of them
+        :param start: Earliest timestamp, inclusive, as an ISO 8601 string or datetime
+        :param end: Latest timestamp, exclusive, as an ISO 8601 string or datetime
+        :param columns: List of the columns to read, None reads all of them
+        :param limit: The max number of rows to return
+        :return: pandas dataframe
+        """
+        import pandas as pd
+        # connecting would create an empty database in place of the missing one
+        if not self.exists():
+            raise FileNotFoundError(f"No query index at {self.db_file}, build it with data_pull.py --build-index")
+        with closing(self.connect()) as connection:
+            self.columns = self.load_columns(connection) if self.columns is None else self.columns
+        if self.columns is None:
+            raise ValueError(f"The query index at {self.db_file} has no rows")
+        clauses = []
+        params = []
+        for column, value in [('sat_id', sat_id), ('norad_cat_id', norad_cat_id), ('Station', station),
+                              ('Observation_id', observation_id)]:
+            if value is None:
+                continue
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            clauses.append(f'"{self.columns[column]}" IN ({", ".join(["?"] * len(values))})')
+            params.extend([v.item() if hasattr(v, 'item') else v for v in values])
+        for op, value in [('>=', start), ('<', end)]:
+            if value is not None:
+                clauses.append(f'"{self.columns["timestamp"]}" {op} ?')
+                params.append(to_timestamp(value))
+
+        columns = list(self.columns.keys()) if columns is None else columns
+        select = ', '.join([f'"{self.columns[column]}" AS "{column}"' for column in columns])
+        sql = f'SELECT {select} FROM {table}'
+        if len(clauses) > 0:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        with closing(self.connect()) as connection:
+            df = pd.read_sql_query(sql, connection, params=params)
+        return apply_schema(df, 'combined')
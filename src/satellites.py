@@ -1,27 +1,72 @@
 from os.path import exists
 import json
 
-import pandas as pd
-import requests
-
 import src.constants as cnst
+from src.metrics import timed_get
+from src.schema import apply_schema
+from src.storage import ArtifactStore
+
+# Satellites with these statuses no longer transmit, so their telemetry does not grow
+decayed_statuses = ['re-entered', 'dead']
+
+
+def is_decayed(satellite):
+    """
+    Checks whether a satellite has decayed or stopped transmitting
+    :param satellite: The record of the satellite in the catalogue
+    :return: Boolean
+    """
+    return satellite.get('status') in decayed_statuses or satellite.get('decayed') is not None
+
+
+def catalogue_delta(previous, current):
+    """
+    Compares two versions of the satellite catalogue
+    :param previous: List of satellite records of the stored catalogue
+    :param current: List of satellite records of the fetched catalogue
+    :return: Dictionary of the added, removed and unchanged sat_ids, and of each changed sat_id to the fields that
+    changed with their previous and current values
+    """
+    previous = {satellite['sat_id']: satellite for satellite in previous}
+    current = {satellite['sat_id']: satellite for satellite in current}
+    delta = {'added': [], 'removed': [sat_id for sat_id in previous if sat_id not in current], 'changed': {},
+             'unchanged': []}
+    for sat_id, satellite in current.items():
+        if sat_id not in previous:
+            delta['added'].append(sat_id)
+            continue
+        fields = sorted(set(satellite.keys()) | set(previous[sat_id].keys()))
+        changed = {field: {'previous': previous[sat_id].get(field), 'current': satellite.get(field)}
+                   for field in fields if previous[sat_id].get(field) != satellite.get(field)}
+        if len(changed) > 0:
+            delta['changed'][sat_id] = changed
+        else:
+            delta['unchanged'].append(sat_id)
+    return delta
 
 
 class Satellites:
-    def __init__(self, api=cnst.api, endpoint=cnst.satellites, dataframe_location=cnst.directories['satellites_csv'],
-                 json_location=cnst.directories['satellites_json'], prints=True):
+    def __init__(self, api=None, endpoint=None, dataframe_location=None, json_location=None,
+                 prints=True, store=None):
         """
         The satellites class uses HTTP GET to create a JSON or DATAFRAME of satellites from SATNOGS
-        :param api: The name of the host to pull data from
-        :param endpoint: The endpoint to query from the host
+        :param api: The name of the host to pull data from. Defaults to cnst.api.
+        :param endpoint: The endpoint to query from the host. Defaults to cnst.satellites.
+        :param dataframe_location: The satellites CSV. Defaults to the location in cnst.directories.
+        :param json_location: The satellites JSON. Defaults to the location in cnst.directories.
         :param prints: Boolean for whether print statements should be executed.
+        :param store: The ArtifactStore the dataframe is written through. Defaults to the configured backend, with
+        the CSV written to dataframe_location.
         """
-        self.api = api
-        self.endpoint = endpoint
+        self.api = api if api is not None else cnst.api
+        self.endpoint = endpoint if endpoint is not None else cnst.satellites
         self.response_json = None
+        dataframe_location = dataframe_location if dataframe_location is not None \
+            else cnst.directories['satellites_csv']
         self.dataframe_location = dataframe_location
-        self.json_location = json_location
+        self.json_location = json_location if json_location is not None else cnst.directories['satellites_json']
         self.prints = prints
+        self.store = store if store is not None else ArtifactStore(csv_locations={'satellites': dataframe_location})
 
     def get_dataframe(self, save_to_disk = True):
         """
@@ -29,12 +74,13 @@ class Satellites:
         the data again.
         :return: Returns a pandas dataframe with the index as the satellite's NORAD
         """
+        import pandas as pd
         if self.response_json is None:
             self.get_data()
-        sats_df = pd.DataFrame.from_dict(self.response_json)
+        sats_df = apply_schema(pd.DataFrame.from_dict(self.response_json), 'satellites')
         if save_to_disk:
-            sats_df.to_csv(self.dataframe_location, index=False)
-            print("Saved satellites CSV to disk") if self.prints else None
+            self.store.write('satellites', sats_df)
+            print(f"Saved satellites to {self.store.location('satellites')}") if self.prints else None
         return self.fix_df_index(sats_df)
 
     @staticmethod
@@ -70,7 +116,8 @@ class Satellites:
         :return: None. Updates the response_json
         """
         print(f"Fetching From {self.api + self.endpoint}") if self.prints else None
-        res = requests.get(
+        res = timed_get(
+            'satellites',
             self.api + self.endpoint,
             headers={
                 "accept": "application/json",
@@ -83,6 +130,25 @@ class Satellites:
             with open(self.json_location, 'w') as out:
                 json.dump(self.response_json, out)
 
+    def refresh(self, write_delta=True):
+        """
+        Fetches the catalogue again and compares it with the stored one
+        :param write_delta: Boolean on whether to write the delta to the location in cnst.directories
+        :return: Dictionary of the delta, see catalogue_delta. Updates the response_json.
+        """
+        previous = []
+        if exists(self.json_location):
+            with open(self.json_location, 'r') as file_in:
+                previous = json.load(file_in)
+        self.fetch_json()
+        delta = catalogue_delta(previous, self.response_json)
+        print(f"Catalogue refreshed: {len(delta['added'])} added, {len(delta['removed'])} removed, "
+              f"{len(delta['changed'])} changed") if self.prints else None
+        if write_delta:
+            with open(cnst.directories['satellites_delta'], 'w') as out:
+                json.dump(delta, out, indent=2)
+        return delta
+
 
 if __name__ == '__main__':
     # Demonstrating Use
@@ -0,0 +1,184 @@
+import json
+import warnings
+
+# The declared column types of each tabular artifact. Columns with few distinct values are categoricals, integers
+# are downcast to the smallest type their values need (the nullable types where a value may be missing) and
+# timestamps are UTC datetimes. Columns that are not listed keep the type pandas infers for them.
+events = {
+    'sat_id': 'category',
+    'norad_cat_id': 'Int32',
+    'transmitter': 'category',
+    'app_source': 'category',
+    'schema': 'category',
+    'observer': 'category',
+    'timestamp': 'datetime',
+    'version': 'category',
+    'observation_id': 'Int32',
+    'station_id': 'Int32',
+}
+
+satellites = {
+    'sat_id': 'category',
+    'norad_cat_id': 'Int32',
+    'status': 'category',
+    'decayed': 'datetime',
+    'launched': 'datetime',
+    'deployed': 'datetime',
+    'operator': 'category',
+    'countries': 'category',
+    'updated': 'datetime',
+}
+
+# The fields of the Metadata JSON of an observation that the scraper flattens into their own columns, by their path in
+# the JSON, with the type of each column. See metadata_column for the column names.
+metadata_fields = {
+    'radio.name': 'category',
+    'radio.version': 'category',
+    'radio.parameters.antenna': 'category',
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'elevation': 'float64',
+}
+
+
+def metadata_column(field):
+    """
+    Name of the observation column a Metadata field is flattened into
+    :param field: The path of the field in the Metadata JSON, e.g. radio.name
+    :return: The column name, e.g. Metadata_Radio_Name
+    """
+    return "Metadata_" + "_".join([word.capitalize() for key in field.split(".") for word in key.split("_")])
+
+
+observations = {
+    'Observation_id': 'Int32',
+    'Satellite': 'category',
+    'Station': 'category',
+    'Status': 'category',
+    'Status_Message': 'category',
+    'Transmitter': 'category',
+    'Mode': 'category',
+    'Waterfall_Status': 'category',
+    **{metadata_column(field): dtype for field, dtype in metadata_fields.items()},
+}
+
+combined = {**observations, **events, **satellites, 'Frequency': 'Int64'}
+
+# One row per observation and the satellite its frames are of, with the frames summarized. The frames themselves stay
+# in the events dataset.
+summary = {**observations, **satellites, 'Frequency': 'Int64', 'frame_count': 'Int32', 'station_count': 'Int32',
+           'first_timestamp': 'datetime', 'last_timestamp': 'datetime'}
+
+schemas = {
+    'satellites': satellites,
+    'events': events,
+    'observations': observations,
+    'combined': combined,
+    'summary': summary,
+}
+
+
+def datetime_options():
+    """
+    pandas 2 infers a single format from the first timestamp unless it is told the timestamps are ISO 8601
+    :return: Dictionary of keyword arguments for pandas.to_datetime
+    """
+    import pandas as pd
+    return {'format': 'ISO8601'} if int(pd.__version__.split('.')[0]) >= 2 else {}
+
+
+def cast(series, dtype):
+    """
+    Casts a column to a declared type. Values that cannot be cast are set to NA with a warning, see report_coerced.
+    :param series: pandas series
+    :param dtype: 'category', 'datetime' or a pandas integer or float type
+    :return: pandas series of the declared type
+    """
+    import pandas as pd
+    if dtype == 'datetime':
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return series if getattr(series.dt, 'tz', None) is not None else series.dt.tz_localize('UTC')
+        return report_coerced(series, pd.to_datetime(series, utc=True, errors='coerce', **datetime_options()), dtype)
+    if dtype == 'category':
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series
+        # lists, such as the scraped modes, are stored as JSON strings as the parquet backend writes them
+        return series.astype(object).map(lambda value: json.dumps(value) if isinstance(value, (list, dict))
+                                         else value).astype('category')
+    if series.dtype == dtype:
+        return series
+    return report_coerced(series, pd.to_numeric(series, errors='coerce'), dtype).astype(dtype)
+
+
+def report_coerced(series, cast_series, dtype):
+    """
+    Warns about the values of a column that could not be cast to its declared type and were set to NA
+    :param series: pandas series before the cast
+    :param cast_series: pandas series after the cast
+    :param dtype: The declared type
+    :return: The cast series
+    """
+    coerced = cast_series.isna() & series.notna()
+    if coerced.any():
+        examples = ', '.join([repr(value) for value in series[coerced].unique()[:3]])
+        warnings.warn(f"{int(coerced.sum())} values of {series.name} could not be cast to {dtype} and were set to "
+                      f"NA, such as {examples}")
+    return cast_series
+
+
+def apply_schema(df, name):
+    """
+    Casts the columns of a dataframe to the declared types of its dataset, in place
+    :param df: The dataframe
+    :param name: The name of the dataset in schemas
+    :return: The dataframe
+    """
+    for column, dtype in schemas[name].items():
+        if column in df.columns:
+            df[column] = cast(df[column], dtype)
+    return df
+
+
+def align_categories(left, right, column):
+    """
+    Gives a categorical column of two dataframes the same categories, so merging on it stays categorical instead of
+    falling back to comparing strings
+    :param left: The first dataframe
+    :param right: The second dataframe
+    :param column: The column the dataframes are merged on
+    :return: None. The dataframes are updated in place.
+    """
+    import pandas as pd
+    if not isinstance(left[column].dtype, pd.CategoricalDtype) or \
+            not isinstance(right[column].dtype, pd.CategoricalDtype):
+        return
+    categories = left[column].cat.categories.union(right[column].cat.categories)
+    left[column] = left[column].cat.set_categories(categories)
+    right[column] = right[column].cat.set_categories(categories)
+
+
+def concat_fragments(frames, name):
+    """
+    Concatenates dataframes of a dataset that were typed separately, such as the fragments of a parallel load, in a
+    single concat. Each categorical column is given the union of the categories of the fragments first, so it stays
+    categorical instead of falling back to object.
+    :param frames: List of dataframes with the declared types of the dataset
+    :param name: The name of the dataset in schemas
+    :return: The concatenated dataframe
+    """
+    import pandas as pd
+    frames = [frame for frame in frames if len(frame) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame()
+    for column, dtype in schemas[name].items():
+        if dtype != 'category':
+            continue
+        typed = [frame for frame in frames if column in frame.columns]
+        for frame in typed:
+            frame[column] = cast(frame[column], dtype)
+        categories = pd.Index(list(dict.fromkeys([category for frame in typed
+                                                  for category in frame[column].cat.categories])))
+        for frame in typed:
+            frame[column] = frame[column].cat.set_categories(categories)
+    # a column that some fragments lack is cast again once the concat has filled it in
+    return apply_schema(pd.concat(frames, ignore_index=True), name)
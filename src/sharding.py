@@ -0,0 +1,143 @@
+from os import listdir, makedirs
+from os.path import exists, isfile
+import json
+import shutil
+import zlib
+
+import src.constants as cnst
+from src.observation_scraper import ObservationScraper
+from src.telemetry import Telemetry
+
+
+def shard_of(key, shard_count):
+    """
+    Assigns a key, such as a sat_id, to a shard. The assignment only depends on the key and the number of shards,
+    so every node of a crawl agrees on it without coordinating.
+    :param key: The key to assign
+    :param shard_count: The number of shards
+    :return: The index of the shard, from 0 to shard_count - 1
+    """
+    return zlib.crc32(str(key).encode('utf-8')) % shard_count
+
+
+def select_shard(keys, shard_index, shard_count):
+    """
+    Picks the keys belonging to one shard
+    :param keys: Iterable of keys
+    :param shard_index: The index of the shard
+    :param shard_count: The number of shards
+    :return: List of the keys of the shard, in their original order
+    """
+    return [key for key in keys if shard_of(key, shard_count) == shard_index]
+
+
+def shard_root(shard_index, shard_count):
+    """
+    The data directory of one shard
+    :param shard_index: The index of the shard
+    :param shard_count: The number of shards
+    :return: Path of the directory
+    """
+    return f"{cnst.directories['shards']}{shard_index}-of-{shard_count}"
+
+
+def shard_directories(shard_index, shard_count, directories=None):
+    """
+    Maps the data directories to the directories of one shard, so the nodes of a crawl can write to shared storage
+    without overwriting each other
+    :param shard_index: The index of the shard
+    :param shard_count: The number of shards
+    :param directories: The directories to map. Defaults to cnst.directories.
+    :return: Dictionary of the same keys with every path under the data directory moved under the shard
+    """
+    directories = directories if directories is not None else cnst.directories
+    data_root = directories['data']
+    root = shard_root(shard_index, shard_count)
+    return {key: path if key == 'shards' or not path.startswith(data_root) else root + path[len(data_root):]
+            for key, path in directories.items()}
+
+
+def activate_shard(shard_index, shard_count):
+    """
+    Points cnst.directories at the directories of one shard for the rest of the run
+    :param shard_index: The index of the shard
+    :param shard_count: The number of shards
+    :return: Dictionary of the directories before the shard was activated
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} is not in the range of {shard_count} shards")
+    previous = dict(cnst.directories)
+    cnst.directories.update(shard_directories(shard_index, shard_count, previous))
+    return previous
+
+
+def copy_files(source, destination):
+    """
+    Copies the files of one directory into another
+    :param source: The directory to copy from
+    :param destination: The directory to copy to
+    :return: The number of files copied
+    """
+    if not exists(source):
+        return 0
+    makedirs(destination, exist_ok=True)
+    files = [file for file in listdir(source) if isfile(f'{source}{file}')]
+    for file in files:
+        shutil.copy2(f'{source}{file}', f'{destination}{file}')
+    return len(files)
+
+
+def merge_shards(shard_count, store=None, prints=True):
+    """
+    Combines the outputs of the shards of a crawl into the satellites, events and observations of the data
+    directory, as if one node had crawled everything. The telemetry archives and waterfalls are copied, the
+    scraped observations and the validators of their pages are concatenated without duplicates and the events and
+    observations datasets are rebuilt.
+    :param shard_count: The number of shards
+    :param store: The ArtifactStore the merged datasets are written through. Defaults to the configured backend.
+    :param prints: Boolean on whether to print to the screen
+    :return: The number of shards that were found and merged
+    """
+    merged = 0
+    observations = {}
+    failed = []
+    validators = {}
+    satellites_copied = False
+    tm = Telemetry(prints=prints, store=store)
+    tm.clear_archived_events()
+    for shard_index in range(shard_count):
+        directories = shard_directories(shard_index, shard_count)
+        if not exists(directories['data']):
+            print(f"No output for shard {shard_index} at {directories['data']}") if prints else None
+            continue
+        merged += 1
+        # every shard fetches the whole catalogue, so the first one found is kept
+        if not satellites_copied and exists(directories['satellites_json']):
+            copy_files(directories['satellites'], cnst.directories['satellites'])
+            satellites_copied = True
+        archives = copy_files(directories['tm_events'], cnst.directories['tm_events'])
+        waterfalls = copy_files(directories['waterfalls'], cnst.directories['waterfalls'])
+        if exists(directories['observation_json']):
+            with open(directories['observation_json'], 'r') as file_in:
+                for observation in json.load(file_in):
+                    # failed scrapes have no Observation_id and are all kept, as a single node keeps them
+                    if observation['Observation_id'] is None:
+                        failed.append(observation)
+                    else:
+                        observations.setdefault(str(observation['Observation_id']), observation)
+        if exists(directories['observation_validators']):
+            with open(directories['observation_validators'], 'r') as file_in:
+                for observation_id, page_validators in json.load(file_in).items():
+                    validators.setdefault(observation_id, page_validators)
+        print(f"Merged shard {shard_index}: {archives} telemetry archives, {waterfalls} waterfalls") \
+            if prints else None
+
+    tm.get_events_df(save_csv=True)
+    scraper = ObservationScraper(prints=prints, store=store)
+    scraper.observations_list = list(observations.values()) + failed
+    with open(scraper.json_file_loc, 'w') as out:
+        json.dump(scraper.observations_list, out)
+    with open(scraper.validators_file_loc, 'w') as out:
+        json.dump(validators, out)
+    scraper.get_dataframe(load_from_disk_first=False, save_csv=True)
+    return merged
@@ -0,0 +1,296 @@
+from os import remove, replace
+from os.path import exists
+import json
+import shutil
+import time
+import uuid
+
+import src.constants as cnst
+from src.schema import apply_schema
+
+# The tabular artifacts of the pipeline, where the csv backend writes them and how the parquet backend partitions
+# them. 'month' is derived from the timestamp column when the dataset is written. The rows of a dataset with a key
+# can be replaced with ArtifactStore.update.
+datasets = {
+    'satellites': {'csv': 'satellites_csv', 'partition_cols': []},
+    'events': {'csv': 'tm_compiled_csv', 'partition_cols': ['sat_id', 'month']},
+    'observations': {'csv': 'observation_csv', 'partition_cols': [], 'key': 'Observation_id'},
+    'combined': {'csv': 'combined_csv', 'partition_cols': ['sat_id', 'month']},
+    'summary': {'csv': 'summary_csv', 'partition_cols': ['sat_id']},
+}
+
+backends = ['csv', 'parquet']
+
+# The file of a parquet dataset holding the schema of all of its parts. Files starting with an underscore are not
+# read as parts.
+metadata_file = '_common_metadata'
+
+filter_ops = {
+    '==': lambda column, value: column == value,
+    '=': lambda column, value: column == value,
+    '!=': lambda column, value: column != value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+    'in': lambda column, value: column.isin(value),
+    'not in': lambda column, value: ~column.isin(value),
+}
+
+
+def month_of(timestamps):
+    """
+    Derives the month partition of each timestamp
+    :param timestamps: pandas series of datetimes or ISO 8601 strings
+    :return: pandas series of 'YYYY-MM' strings
+    """
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        return timestamps.dt.strftime('%Y-%m')
+    return timestamps.astype(object).str[:7]
+
+
+def apply_filters(df, filters):
+    """
+    Applies filters in the pyarrow form, a list of (column, op, value) tuples that must all hold, to a dataframe
+    :param df: The dataframe to filter
+    :param filters: List of (column, op, value) tuples or None
+    :return: The filtered dataframe
+    """
+    import pandas as pd
+    if filters is None:
+        return df
+    keep = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        keep &= filter_ops[op](df[column], value)
+    return df[keep]
+
+
+class ArtifactStore:
+    def __init__(self, backend=cnst.storage_backend, root=None, csv_locations=None,
+                 prints=False):
+        """
+        Reads and writes the tabular artifacts of the pipeline, the satellites, events, observations and combined
+        datasets. The csv backend writes the CSV files the pipeline has always written. The parquet backend writes a
+        typed, zstd compressed parquet dataset for each artifact, partitioned by sat_id and month where the dataset
+        has them, and can read back only the columns and partitions that are asked for. Both backends cast the
+        columns to the types declared in src.schema when a dataset is written and when it is read.
+        :param backend: 'csv' or 'parquet'
+        :param root: The directory holding a parquet dataset for each artifact. Defaults to the location in
+        cnst.directories.
+        :param csv_locations: Dictionary of dataset name to CSV file, overriding the locations in cnst.directories
+        :param prints: Boolean for whether print statements should be executed.
+        """
+        if backend not in backends:
+            raise ValueError(f"Unknown storage backend {backend}, expected one of {backends}")
+        self.backend = backend
+        self.root = root if root is not None else cnst.directories['columnar']
+        self.csv_locations = {name: cnst.directories[dataset['csv']] for name, dataset in datasets.items()}
+        self.csv_locations.update(csv_locations if csv_locations is not None else {})
+        self.schemas = {}
+        self.prints = prints
+
+    def location(self, name):
+        """
+        The file or directory a dataset is stored in
+        :param name: The name of the dataset
+        :return: Path to the CSV file or the parquet dataset directory
+        """
+        if self.backend == 'csv':
+            return self.csv_locations[name]
+        return f'{self.root}{name}/'
+
+    def exists(self, name):
+        """
+        Checks whether a dataset has been written
+        :param name: The name of the dataset
+        :return: Boolean
+        """
+        return exists(self.location(name))
+
+    def delete(self, name):
+        """
+        Removes a dataset from the disk
+        :param name: The name of the dataset
+        :return: Boolean on whether there was a dataset to remove
+        """
+        if not self.exists(name):
+            return False
+        if self.backend == 'csv':
+            remove(self.location(name))
+        else:
+            shutil.rmtree(self.location(name))
+        self.schemas.pop(name, None)
+        return True
+
+    def write(self, name, df, index=False):
+        """
+        Writes a dataset, replacing what was stored before
+        :param name: The name of the dataset
+        :param df: The dataframe to write
+        :param index: Boolean on whether the csv backend writes the index
+        :return: None
+        """
+        df = apply_schema(df.copy(), name)
+        if self.backend == 'csv':
+            df.to_csv(self.location(name), index=index)
+        else:
+            self.delete(name)
+            self.append(name, df)
+        print(f"Wrote {name} to {self.location(name)}") if self.prints else None
+
+    def append(self, name, df):
+        """
+        Adds rows to a dataset. The parquet backend writes them as new parts, cast to the schema of the parts
+        before them, so every part has the same column types. A column the earlier rows do not have is added to
+        the dataset, and is empty for those rows.
+        :param name: The name of the dataset
+        :param df: The dataframe of rows to add
+        :return: None
+        """
+        df = apply_schema(df.copy(), name)
+        if self.backend == 'csv':
+            self.append_csv(name, df)
+            return
+        import pyarrow.parquet as pq
+        table = self.to_table(name, df)
+        pq.write_to_dataset(table, self.location(name), partition_cols=datasets[name]['partition_cols'],
+                            basename_template=f'part-{time.time_ns():020d}-{uuid.uuid4().hex}-{{i}}.parquet',
+                            compression='zstd')
+        # the schema of every part together, which the parts written before a column was added do not have
+        pq.write_metadata(self.schemas[name], f'{self.location(name)}{metadata_file}')
+
+    def append_csv(self, name, df):
+        """
+        Adds rows to a CSV dataset in the order of its header. When the rows have columns the header does not, the
+        file is first rewritten in chunks with the new columns empty.
+        :param name: The name of the dataset
+        :param df: The dataframe of rows to add
+        :return: None
+        """
+        import pandas as pd
+        location = self.location(name)
+        if not exists(location):
+            df.to_csv(location, index=False)
+            return
+        header = list(pd.read_csv(location, nrows=0).columns)
+        added = [column for column in df.columns if column not in header]
+        if len(added) > 0:
+            print(f"Adding the columns {added} to {location}") if self.prints else None
+            with open(f'{location}.tmp', 'w', newline='') as out:
+                pd.DataFrame(columns=header + added).to_csv(out, index=False)
+                for chunk in pd.read_csv(location, dtype=str, keep_default_na=False, chunksize=100000):
+                    chunk.reindex(columns=header + added).to_csv(out, header=False, index=False)
+            replace(f'{location}.tmp', location)
+            header += added
+        df.reindex(columns=header).to_csv(location, mode='a', header=False, index=False)
+
+    def to_table(self, name, df):
+        """
+        Converts a dataframe to a pyarrow table for a parquet dataset. Nested lists and dictionaries from the scrapes
+        are stored as JSON strings, categoricals are stored as their values so parts with different categories share
+        a schema, and the month partition is derived from the timestamp.
+        :param name: The name of the dataset
+        :param df: The dataframe to convert
+        :return: pyarrow table
+        """
+        import pandas as pd
+        import pyarrow as pa
+        df = df.copy()
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(object)
+            if df[column].dtype == object:
+                df[column] = df[column].map(lambda value: json.dumps(value) if isinstance(value, (list, dict))
+                                            else value)
+        if 'month' in datasets[name]['partition_cols']:
+            df['month'] = month_of(df['timestamp']) if 'timestamp' in df.columns else None
+
+        schema = self.schemas.get(name)
+        schema = schema if schema is not None else self.stored_schema(name)
+        part_schema = pa.Schema.from_pandas(df, preserve_index=False)
+        # columns that are empty in the part that adds them are typed by the parts that follow as strings
+        part_schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                 for field in part_schema]).remove_metadata()
+        if schema is None:
+            schema = part_schema
+        else:
+            added = [field for field in part_schema if field.name not in schema.names]
+            if len(added) > 0:
+                print(f"Adding the columns {[field.name for field in added]} to {name}") if self.prints else None
+                schema = pa.schema(list(schema) + added)
+        self.schemas[name] = schema
+        return pa.Table.from_pandas(df.reindex(columns=schema.names), schema=schema, preserve_index=False)
+
+    def stored_schema(self, name):
+        """
+        Reads the schema of every part of a parquet dataset written by an earlier store
+        :param name: The name of the dataset
+        :return: pyarrow schema, or None if the dataset was not written with one
+        """
+        import pyarrow.parquet as pq
+        if not exists(f'{self.location(name)}{metadata_file}'):
+            return None
+        return pq.read_schema(f'{self.location(name)}{metadata_file}')
+
+    def update(self, name, df):
+        """
+        Replaces the rows of a dataset that have the key of a row of a dataframe, such as the observations with an
+        Observation_id, without rewriting the rows that did not change. The rows are appended, and reading keeps the
+        last row of each key. Writing the dataset again drops the rows that were replaced.
+        :param name: The name of the dataset
+        :param df: The dataframe of the rows to replace
+        :return: None
+        """
+        if datasets[name].get('key') is None:
+            raise ValueError(f"The {name} dataset has no key to replace its rows by")
+        self.append(name, df)
+        print(f"Updated {df.shape[0]} rows of {name} at {self.location(name)}") if self.prints else None
+
+    def read(self, name, columns=None, filters=None):
+        """
+        Reads a dataset. Of the rows of a dataset with a key, only the last row of each key is read, see update.
+        :param name: The name of the dataset
+        :param columns: List of the columns to read, None reads all of them
+        :param filters: List of (column, op, value) tuples the rows must all satisfy
+        :return: pandas dataframe
+        """
+        key = datasets[name].get('key')
+        if key is None:
+            return self.read_rows(name, columns, filters)
+        df = self.read_rows(name, columns if columns is None or key in columns else [key] + columns, filters)
+        # parts are read in the order they were written, so the last row of a key is its latest
+        df = df[df[key].isna() | ~df.duplicated(key, keep='last')].reset_index(drop=True)
+        return df if columns is None else df[columns]
+
+    def read_rows(self, name, columns=None, filters=None):
+        """
+        Reads every row of a dataset
+        :param name: The name of the dataset
+        :param columns: List of the columns to read, None reads all of them
+        :param filters: List of (column, op, value) tuples the rows must all satisfy, such as
+        [('sat_id', '==', 'XSKZ-5603-1870-9019-3066'), ('month', '>=', '2022-01')]. The parquet backend only reads
+        the partitions that can match.
+        :return: pandas dataframe
+        """
+        import pandas as pd
+        if self.backend == 'csv':
+            df = apply_schema(pd.read_csv(self.location(name), usecols=columns if filters is None else None), name)
+            if filters is not None:
+                if 'month' in datasets[name]['partition_cols'] and 'timestamp' in df.columns:
+                    df['month'] = month_of(df['timestamp'])
+                df = apply_filters(df, filters)
+                df = df.drop(columns=['month'], errors='ignore') if columns is None else df[columns]
+            return df
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+        partition_cols = datasets[name]['partition_cols']
+        partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in partition_cols]), flavor='hive')
+        # the parts written before a column was added read it as empty
+        df = apply_schema(pq.read_table(self.location(name), columns=columns, filters=filters,
+                                        partitioning=partitioning, schema=self.stored_schema(name)).to_pandas(), name)
+        # the derived month partition is only returned when it is asked for
+        if columns is None and 'month' in datasets[name]['partition_cols']:
+            df = df.drop(columns=['month'])
+        return df
@@ -1,22 +1,35 @@
 from os import listdir, remove
 from os.path import exists, isfile
+from urllib.parse import quote
 import json
 from multiprocessing import Pool
 import time
 
-import pandas as pd
-import requests
-
 import src.constants as cnst
+from src.event_archive import archive_path, find_archive, iter_archive, list_archives, load_events, load_events_df, \
+    remove_archives, write_archive
+from src.filters import FilterSpec
+from src.metrics import metrics, timed_get
+from src.profiling import traced
+from src.schema import apply_schema
+from src.storage import ArtifactStore
 
 
 class Telemetry:
     def __init__(self, prints=True,
-                 max_pages=1e10):
+                 max_pages=1e10, store=None, observation_queue=None, filters=None, archive_format=None):
         """
         Queries the telemetry endpoint for satellite observation events.
         :param prints: Boolean on whether to print to the screen
         :param max_pages: The max number of pages per satellites. There are typically 25 events per page.
+        :param store: The ArtifactStore the events dataframe is written through. Defaults to the configured backend.
+        :param observation_queue: Queue the observation IDs of each fetched page are put on as soon as the page
+        arrives, so they can be scraped while telemetry is still being fetched. Use a multiprocessing.Manager queue
+        when fetching with multiple processes.
+        :param filters: The FilterSpec whose event filters the fetched events must match. Its bounds on the timestamp
+        are sent with each request, so the API only returns events within them.
+        :param archive_format: The format the telemetry archive of each satellite is written in, 'jsonl.gz' or
+        'json'. Defaults to cnst.archive_format. Archives in either format are read.
         """
         self.telemetry_events = []
         self.events_path = cnst.directories['tm_events']
@@ -24,20 +37,56 @@ class Telemetry:
         self.completed_df = cnst.directories['tm_compiled_csv']
         self.prints = prints
         self.max_pages = max_pages
+        self.store = store if store is not None else ArtifactStore()
+        self.observation_queue = observation_queue
+        self.filters = filters if filters is not None else FilterSpec()
+        self.archive_format = archive_format if archive_format is not None else cnst.archive_format
+
+    def publish_observations(self, events):
+        """
+        Puts the observation IDs of a page of events on the observation queue, if there is one
+        :param events: List of telemetry events
+        :return: None
+        """
+        if self.observation_queue is None:
+            return
+        observation_ids = []
+        for event in events:
+            if event.get('observation_id') and event['observation_id'] not in observation_ids:
+                observation_ids.append(event['observation_id'])
+        for observation_id in observation_ids:
+            self.observation_queue.put(observation_id)
+
+    def select_events(self, events):
+        """
+        Keeps the events of a page that match the event filters
+        :param events: List of telemetry events
+        :return: List of telemetry events
+        """
+        selected = self.filters.select_events(events)
+        if len(selected) < len(events):
+            metrics.increment('telemetry', 'filtered_events', len(events) - len(selected))
+        return selected
 
     @staticmethod
-    def get_url_endpoint(sat_id, page=None, tm_endpoint=cnst.telemetry, site=cnst.api):
+    def get_url_endpoint(sat_id, page=None, tm_endpoint=None, site=None, start=None, end=None):
         """
         Create the url to query for the satellite
         :param sat_id: TThe internal SATNOGS database ID for the satellite
         :param page: The page number to pull
-        :param tm_endpoint: The endpoint to pull from
-        :param site: The site or api to reach
+        :param tm_endpoint: The endpoint to pull from. Defaults to cnst.telemetry.
+        :param site: The site or api to reach. Defaults to cnst.api.
+        :param start: Only query the events from this timestamp on
+        :param end: Only query the events up to this timestamp
         :return: The query string to get the telemetry observations
         """
+        tm_endpoint = tm_endpoint if tm_endpoint is not None else cnst.telemetry
+        site = site if site is not None else cnst.api
         rtn_str = site + tm_endpoint
         rtn_str += ("page=" + str(page) + "&") if (page is not None) else ""
         rtn_str += "sat_id=" + str(sat_id)
+        rtn_str += ("&start=" + quote(str(start))) if (start is not None) else ""
+        rtn_str += ("&end=" + quote(str(end))) if (end is not None) else ""
         return rtn_str
 
     def fetch_telemetry_by_satellite(self, sat_id, write_events=True):
@@ -47,62 +96,89 @@ class Telemetry:
         :param write_events: Boolean on whether to write the observation events to the disk
         :return: list of observation json events
         """
+        return self.fetch_telemetry_pages(sat_id, write_events)[0]
+
+    @traced('telemetry.fetch_telemetry_by_satellite')
+    def fetch_telemetry_pages(self, sat_id, write_events=True):
+        """
+        Fetch telemetry observation events for a satellite, along with whether every page was fetched so a failed
+        fetch can be told apart from a satellite without events
+        :param sat_id: The internal SATNOGS database ID for the satellite
+        :param write_events: Boolean on whether to write the observation events to the disk. The events of a fetch
+        that stopped at a failed page are written as well.
+        :return: list of observation json events and a Boolean on whether every page returned HTTP 200
+        """
         headers_dict = {"accept": "application/json", "Authorization": f"token {cnst.keys['api']}"}
         return_jsons = []
-        r = requests.get(
-            self.get_url_endpoint(sat_id),
-            headers=headers_dict)
+        start, end = self.filters.event_window()
+        r = timed_get('telemetry', self.get_url_endpoint(sat_id, start=start, end=end), headers=headers_dict)
 
         # Keep lopping while waiting on the time-outs.
         while r.status_code == 429:
             # Typical wait messages have the form "Request was throttled. Expected available in 53 seconds."
             wait_time = int(r.json()['detail'].split(" ")[-2])
             print(f"Waiting {wait_time} seconds.")
-            time.sleep(wait_time + 1)
-            r = requests.get(
-                self.get_url_endpoint(sat_id),
-                headers=headers_dict)
+            metrics.increment('telemetry', 'throttled')
+            with metrics.timer('telemetry', 'throttle_wait_seconds'):
+                time.sleep(wait_time + 1)
+            r = timed_get('telemetry', self.get_url_endpoint(sat_id, start=start, end=end), headers=headers_dict)
 
         if r.status_code != 200:
             print(f'HTTP status {r.status_code} received for {sat_id} with message: {r.content}') if self.prints else None
-            return []
+            metrics.increment('telemetry', 'failed_satellites')
+            metrics.flush()
+            return [], False
 
-        return_jsons = return_jsons + r.json()
+        events = self.select_events(r.json())
+        return_jsons = return_jsons + events
+        self.publish_observations(events)
+        metrics.increment('telemetry', 'pages')
         page_count = 1
+        complete = True
         print(f'found {len(r.json())} events for {sat_id}') if self.prints else None
         if 'link' in r.headers.keys():
             while r.headers['link'].find('rel="next"') != -1:
-                if self.max_pages < page_count:
+                if self.max_pages <= page_count:
                     print(f"Page count exceeded for {sat_id}") if self.prints else None
                     break
-                r = requests.get(
-                    self.get_url_endpoint(sat_id, page=page_count),
-                    headers=headers_dict)
+                # the first page was fetched without a page number, so the next one is page 2
+                page_count += 1
+                r = timed_get('telemetry', self.get_url_endpoint(sat_id, page=page_count, start=start, end=end),
+                              headers=headers_dict)
 
                 # Keep lopping while waiting on the time-outs.
                 while r.status_code == 429:
                     # Typical wait messages have the form "Request was throttled. Expected available in 53 seconds."
                     wait_time = int(r.json()['detail'].split(" ")[-2])
                     print(f"Waiting {wait_time} seconds.")
-                    time.sleep(wait_time + 1)
-                    r = requests.get(
-                        self.get_url_endpoint(sat_id),
-                        headers=headers_dict)
+                    metrics.increment('telemetry', 'throttled')
+                    with metrics.timer('telemetry', 'throttle_wait_seconds'):
+                        time.sleep(wait_time + 1)
+                    r = timed_get('telemetry', self.get_url_endpoint(sat_id, page=page_count, start=start, end=end),
+                                  headers=headers_dict)
 
                 if r.status_code != 200:
                     print(f"HTTP status {r.status_code} received for {sat_id}") if self.prints else None
                     print(f"{len(return_jsons)} observations were collected for {sat_id}") if self.prints else None
+                    metrics.increment('telemetry', 'failed_satellites')
+                    complete = False
                     break
-                return_jsons = return_jsons + r.json()
+                events = self.select_events(r.json())
+                return_jsons = return_jsons + events
+                self.publish_observations(events)
+                metrics.increment('telemetry', 'pages')
                 if page_count % 100 == 0 & self.prints:
                     print(f"page {page_count} for {sat_id}")
-                page_count += 1
 
         print(f"Finished {sat_id} with {len(return_jsons)} events") if self.prints else None
         if write_events & (len(return_jsons) > 0):
-            with open(f"{self.events_path}{sat_id}.json", 'w') as out:
-                json.dump(return_jsons, out)
-        return return_jsons
+            path = archive_path(self.events_path, sat_id, self.archive_format)
+            write_archive(path, return_jsons)
+            remove_archives(self.events_path, sat_id, keep=path)
+        metrics.increment('telemetry', 'satellites')
+        metrics.increment('telemetry', 'events', len(return_jsons))
+        metrics.flush()
+        return return_jsons, complete
 
     def get_events_by_sat_id(self, sat_ids, check_disk=True, empty_list=True, fetch=True, save_events=True):
         """
@@ -117,10 +193,10 @@ class Telemetry:
         if empty_list:
             self.telemetry_events = []
         for sat_id in sat_ids:
-            if check_disk & exists(f"{self.events_path}{sat_id}.json"):
+            archive = find_archive(self.events_path, sat_id) if check_disk else None
+            if archive is not None:
                 print(f'reading sat_id {sat_id} from disk') if self.prints else None
-                with open(f"{self.events_path}{sat_id}.json", 'r') as file_in:
-                    self.telemetry_events = self.telemetry_events + json.load(file_in)
+                self.telemetry_events.extend(iter_archive(archive))
             elif fetch:
                 print(f'fetching sat_id {sat_id} from {cnst.api}') if self.prints else None
                 fetch = self.fetch_telemetry_by_satellite(sat_id)
@@ -138,27 +214,33 @@ class Telemetry:
          get_archived_satellites_events
         :param sat_ids: The list of sat_ids to pull for
         :param update_tm_events: boolean on whether to update the instantiated object's telemetry events list
-        :return: None
+        :return: List of the sat_ids whose pages were all fetched
         """
-        pool = Pool()
-        pool.map(self.fetch_telemetry_by_satellite, sat_ids)
+        with Pool() as pool:
+            fetches = pool.map(self.fetch_telemetry_pages, sat_ids)
         if update_tm_events:
             self.get_events_by_sat_id(sat_ids, fetch=False)
+        return [sat_id for sat_id, (_, complete) in zip(sat_ids, fetches) if complete]
 
-    def get_archived_satellites_events(self, empty_list=True, save_events=True):
+    def iter_archived_events(self):
         """
-        Read in the archived telemetry events
+        Streams the archived telemetry events one satellite archive after another, in either archive format
+        :return: Generator of telemetry events
+        """
+        for _, path in list_archives(self.events_path):
+            yield from iter_archive(path)
+
+    def get_archived_satellites_events(self, empty_list=True, save_events=True, processes=None):
+        """
+        Read in the archived telemetry events, parsing the archives in parallel
         :param empty_list: Boolean on whether to empty the telemetry events list
         :param save_events: Boolean on whether to save the telmetry events list to the disk
+        :param processes: The number of worker processes. Defaults to the number of CPUs.
         :return: None
         """
         if empty_list:
             self.telemetry_events = []
-        for file in listdir(self.events_path):
-            file_name = f'{self.events_path}{file}'
-            if isfile(file_name):
-                with open(file_name, 'r') as file_in:
-                    self.telemetry_events = self.telemetry_events + json.load(file_in)
+        self.telemetry_events.extend(load_events(self.events_path, processes))
         if save_events:
             with open(f'{self.completed_json}', 'w') as out:
                 json.dump(self.telemetry_events, out)
@@ -177,31 +259,45 @@ class Telemetry:
         if exists(self.completed_json):
             remove(self.completed_json)
             print(f"Removed {self.completed_json}") if self.prints else None
-        if exists(self.completed_df):
-            remove(self.completed_df)
-            print(f"Removed {self.completed_df}") if self.prints else None
+        if self.store.delete('events'):
+            print(f"Removed {self.store.location('events')}") if self.prints else None
 
-    def get_events_df(self, load_from_disk=True, save_csv=True):
+    def get_events_df(self, load_from_disk=True, save_csv=True, save_events=False, processes=None):
         """
         Get a dataframe from the observations events.
-        :param load_from_disk: Boolean on whether to load from disk or use the list in memory
-        :param save_csv: save the created dataframe as a CSV to the disk
+        :param load_from_disk: Boolean on whether to load from disk or use the list in memory. The archives are
+        loaded in parallel into typed dataframe fragments, without going through the events list.
+        :param save_csv: save the created dataframe to the disk through the store
+        :param save_events: Boolean on whether to also write the archived events to the combined events JSON
+        :param processes: The number of worker processes loading the archives. Defaults to the number of CPUs.
         :return: pandas dataframe
         """
+        import pandas as pd
         if load_from_disk:
-            self.get_archived_satellites_events()
-            df = pd.DataFrame.from_dict(self.telemetry_events)
+            df = load_events_df(self.events_path, processes)
+            if save_events:
+                self.get_archived_satellites_events(processes=processes)
         elif len(self.telemetry_events) > 0:
             df = pd.DataFrame.from_dict(self.telemetry_events)
             print("Loading Telemetry Events From Memory") if self.prints else None
         else:
             print("Event Data Needs to be fetched")
             return None
+        apply_schema(df, 'events')
         if save_csv:
-            print("Saving Dataframe as CSV") if self.prints else None
-            df.to_csv(self.completed_df, index=False)
+            print(f"Saving Dataframe to {self.store.location('events')}") if self.prints else None
+            self.store.write('events', df)
         return df
 
+    def read_events_df(self, columns=None, filters=None):
+        """
+        Reads the events dataframe written by get_events_df
+        :param columns: List of the columns to read, None reads all of them
+        :param filters: List of (column, op, value) tuples the events must all satisfy, see ArtifactStore.read
+        :return: pandas dataframe
+        """
+        return self.store.read('events', columns=columns, filters=filters)
+
 
 if __name__ == '__main__':
     # Demonstrating Use
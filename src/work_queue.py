@@ -0,0 +1,286 @@
+import argparse
+from contextlib import closing
+from os import getpid
+from socket import gethostname
+import json
+import sqlite3
+import time
+
+import src.constants as cnst
+from src.metrics import metrics
+
+# A job is pending until a worker leases it, then done once it succeeds. A job that fails goes back to pending
+# after a backoff, and is failed for good once it has been attempted max_attempts times.
+states = ['pending', 'leased', 'done', 'failed']
+
+table = 'jobs'
+
+
+class WorkQueue:
+    def __init__(self, db_file=None, lease_seconds=300, max_attempts=5, backoff_seconds=30, max_backoff_seconds=3600,
+                 poll_seconds=1, prints=False):
+        """
+        A durable queue of observation IDs to scrape, kept in SQLite so it survives the processes working on it.
+        Each job records its state, priority, attempts, the worker leasing it and the status of its last attempt,
+        and the scraped observation once it is done. Workers lease jobs for a limited time, so the jobs of a worker
+        that dies are leased again once its lease expires. Several processes can share the queue, and several hosts
+        can share it on a filesystem with working locks.
+        :param db_file: The SQLite database file. Defaults to the location in cnst.directories.
+        :param lease_seconds: How long a worker holds a job before another worker may lease it
+        :param max_attempts: The number of attempts after which a failing job is failed for good
+        :param backoff_seconds: The wait before a failed job is retried, doubled after each further failure
+        :param max_backoff_seconds: The longest wait before a failed job is retried
+        :param poll_seconds: The longest a worker waits before looking for jobs again while other jobs are leased or
+        backing off
+        :param prints: Boolean for whether print statements should be executed.
+        """
+        self.db_file = db_file if db_file is not None else cnst.directories['scrape_queue']
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.poll_seconds = poll_seconds
+        self.prints = prints
+        self.create()
+
+    def connect(self):
+        """
+        Opens a connection to the queue. Statements commit on their own unless a transaction is begun.
+        :return: sqlite3 connection
+        """
+        connection = sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def create(self):
+        """
+        Creates the table of jobs if it does not exist yet
+        :return: None
+        """
+        with closing(self.connect()) as connection:
+            connection.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                observation_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_status INTEGER,
+                last_error TEXT,
+                updated REAL,
+                result TEXT)''')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_ready ON {table} (state, priority, available_at)')
+
+    def add(self, observation_ids, priority=0, reset=False):
+        """
+        Adds jobs to the queue. Jobs that are already queued keep their state, except that failed jobs are given
+        their attempts again, and pending jobs take the higher of their priorities.
+        :param observation_ids: Iterable of observation IDs
+        :param priority: Jobs with a higher priority are leased first
+        :param reset: Boolean on whether to scrape the jobs again even if they are done
+        :return: None
+        """
+        now = time.time()
+        rows = [(int(observation_id), priority, now) for observation_id in observation_ids]
+        revived = "'pending', 'done'" if reset else "'pending'"
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(f'''
+                INSERT INTO {table} (observation_id, state, priority, updated) VALUES (?, 'pending', ?, ?)
+                ON CONFLICT (observation_id) DO UPDATE SET
+                    priority = MAX(priority, excluded.priority),
+                    state = CASE WHEN state IN ('failed', {revived}) THEN 'pending' ELSE state END,
+                    attempts = CASE WHEN state IN ('failed', {revived}) THEN 0 ELSE attempts END,
+                    available_at = CASE WHEN state IN ('failed', {revived}) THEN 0 ELSE available_at END,
+                    updated = excluded.updated''', rows)
+            connection.execute('COMMIT')
+
+    def lease(self, owner, count=1):
+        """
+        Leases the ready jobs of the highest priority: pending jobs past their backoff and jobs whose lease expired.
+        A job whose lease expired after its last attempt, such as one that crashes or hangs its worker every time, is
+        failed for good instead.
+        :param owner: The name of the worker leasing the jobs
+        :param count: The largest number of jobs to lease
+        :return: List of the leased observation IDs
+        """
+        now = time.time()
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            abandoned = connection.execute(f'''
+                UPDATE {table} SET state = 'failed', last_error = 'Lease expired', lease_owner = NULL,
+                    lease_expires = NULL, updated = ?
+                WHERE state = 'leased' AND lease_expires <= ? AND attempts >= ?''',
+                                           (now, now, self.max_attempts)).rowcount
+            leased = [row[0] for row in connection.execute(f'''
+                SELECT observation_id FROM {table}
+                WHERE (state = 'pending' AND available_at <= ?) OR (state = 'leased' AND lease_expires <= ?)
+                ORDER BY priority DESC, available_at, observation_id LIMIT ?''', (now, now, count)).fetchall()]
+            connection.executemany(f'''
+                UPDATE {table} SET state = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1,
+                    updated = ? WHERE observation_id = ?''',
+                                   [(owner, now + self.lease_seconds, now, observation_id) for observation_id in leased])
+            connection.execute('COMMIT')
+        if abandoned > 0:
+            metrics.increment('observations', 'abandoned', abandoned)
+        return leased
+
+    def complete(self, observation_id, owner, result):
+        """
+        Marks a leased job as done with its result
+        :param observation_id: The observation ID of the job
+        :param owner: The name of the worker that leased the job
+        :param result: The scraped observation
+        :return: Boolean on whether the worker still held the lease
+        """
+        with closing(self.connect()) as connection:
+            updated = connection.execute(f'''
+                UPDATE {table} SET state = 'done', result = ?, last_status = 200, last_error = NULL,
+                    lease_owner = NULL, lease_expires = NULL, updated = ?
+                WHERE observation_id = ? AND state = 'leased' AND lease_owner = ?''',
+                                         (json.dumps(result), time.time(), int(observation_id), owner)).rowcount
+        return updated > 0
+
+    def backoff(self, attempts):
+        """
+        The wait before a job that has failed a number of times is retried
+        :param attempts: The number of attempts the job has failed
+        :return: Seconds
+        """
+        return min(self.backoff_seconds * 2 ** (attempts - 1), self.max_backoff_seconds)
+
+    def fail(self, observation_id, owner, status=None, error=None):
+        """
+        Records a failed attempt of a leased job. The job is retried after a backoff until it has been attempted
+        max_attempts times, then it is failed for good.
+        :param observation_id: The observation ID of the job
+        :param owner: The name of the worker that leased the job
+        :param status: The HTTP status code of the attempt, if a response was received
+        :param error: A description of the error, if the attempt raised one
+        :return: The state the job is left in, or None if the worker no longer held the lease
+        """
+        now = time.time()
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(f'''SELECT attempts FROM {table}
+                WHERE observation_id = ? AND state = 'leased' AND lease_owner = ?''',
+                                     (int(observation_id), owner)).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            state = 'failed' if row[0] >= self.max_attempts else 'pending'
+            connection.execute(f'''
+                UPDATE {table} SET state = ?, available_at = ?, last_status = ?, last_error = ?, lease_owner = NULL,
+                    lease_expires = NULL, updated = ? WHERE observation_id = ?''',
+                               (state, now + self.backoff(row[0]), status, error, now, int(observation_id)))
+            connection.execute('COMMIT')
+        metrics.increment('observations', 'retried' if state == 'pending' else 'abandoned')
+        return state
+
+    def next_ready(self):
+        """
+        The time the next job becomes ready, when a backoff or a lease ends
+        :return: time.time() of the next ready job, or None if no job is pending or leased
+        """
+        with closing(self.connect()) as connection:
+            return connection.execute(f'''
+                SELECT MIN(CASE WHEN state = 'pending' THEN available_at ELSE lease_expires END) FROM {table}
+                WHERE state IN ('pending', 'leased')''').fetchone()[0]
+
+    def counts(self):
+        """
+        The number of jobs in each state
+        :return: Dictionary of state to count
+        """
+        with closing(self.connect()) as connection:
+            counts = dict(connection.execute(f'SELECT state, COUNT(*) FROM {table} GROUP BY state').fetchall())
+        return {state: counts.get(state, 0) for state in states}
+
+    def failures(self):
+        """
+        The jobs that failed for good
+        :return: List of dictionaries of the observation ID, attempts, last status and last error of each job
+        """
+        with closing(self.connect()) as connection:
+            rows = connection.execute(f'''SELECT observation_id, attempts, last_status, last_error FROM {table}
+                WHERE state = 'failed' ORDER BY observation_id''').fetchall()
+        return [{'observation_id': row[0], 'attempts': row[1], 'last_status': row[2], 'last_error': row[3]}
+                for row in rows]
+
+    def results(self, observation_ids=None):
+        """
+        The scraped observations of the jobs that are done
+        :param observation_ids: Iterable of the observation IDs to return the results of, None returns all of them
+        :return: List of observation dictionaries, in the order of observation_ids
+        """
+        with closing(self.connect()) as connection:
+            rows = dict(connection.execute(f"SELECT observation_id, result FROM {table} WHERE state = 'done'"))
+        observation_ids = sorted(rows.keys()) if observation_ids is None else [int(i) for i in observation_ids]
+        return [json.loads(rows[observation_id]) for observation_id in observation_ids if observation_id in rows]
+
+    def retry_failed(self):
+        """
+        Gives the jobs that failed for good their attempts again
+        :return: The number of jobs that will be retried
+        """
+        with closing(self.connect()) as connection:
+            return connection.execute(f'''UPDATE {table} SET state = 'pending', attempts = 0, available_at = 0,
+                updated = ? WHERE state = 'failed' ''', (time.time(),)).rowcount
+
+
+def worker_name():
+    """
+    Names the worker of this process, unique across the hosts sharing a queue
+    :return: String of the host name and process ID
+    """
+    return f'{gethostname()}:{getpid()}'
+
+
+def work(queue, scraper, owner=None, wait=True):
+    """
+    Scrapes the jobs of a queue until none is left. A job succeeds when its page returns HTTP 200, any other
+    status or an error raised while scraping fails the attempt.
+    :param queue: The WorkQueue to lease jobs from
+    :param scraper: The ObservationScraper to scrape with
+    :param owner: The name of the worker. Defaults to the host name and process ID.
+    :param wait: Boolean on whether to wait for jobs that are backing off or leased by other workers. Without
+    waiting the worker returns once no job is ready.
+    :return: The number of attempts made
+    """
+    owner = owner if owner is not None else worker_name()
+    attempts = 0
+    while True:
+        leased = queue.lease(owner)
+        if len(leased) == 0:
+            next_ready = queue.next_ready()
+            if next_ready is None or not wait:
+                return attempts
+            time.sleep(min(max(next_ready - time.time(), 0.05), queue.poll_seconds))
+            continue
+        for observation_id in leased:
+            attempts += 1
+            url = f'{cnst.web_address}{cnst.observations}{observation_id}/'
+            try:
+                status, observation = scraper.scrape_page(url)
+            except Exception as error:
+                queue.fail(observation_id, owner, error=repr(error))
+                continue
+            if status == 200:
+                queue.complete(observation_id, owner, observation)
+            else:
+                queue.fail(observation_id, owner, status=status)
+        metrics.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect the observation scrape queue")
+    parser.add_argument('--retry-failed', action='store_true', help="Retry the jobs that failed for good")
+    args = parser.parse_args()
+
+    work_queue = WorkQueue()
+    if args.retry_failed:
+        print(f"Retrying {work_queue.retry_failed()} failed jobs")
+    print(work_queue.counts())
+    for failure in work_queue.failures():
+        print(failure)
@@ -0,0 +1,65 @@
+"""
+Writes small, deterministic stand-ins for the satellites, telemetry archives and observations of a pipeline run, so
+the dataset compilation can be tested without reaching SATNOGS.
+"""
+import json
+import random
+
+import pandas as pd
+
+import src.constants as cnst
+
+
+def write_sample_data(num_sats=5, num_observations=40, events_per_sat=50, seed=0):
+    """
+    Writes the satellites CSV and JSON, one telemetry archive per satellite and the observations JSON
+    :param num_sats: The number of satellites
+    :param num_observations: The number of scraped observations
+    :param events_per_sat: The number of telemetry events archived for each satellite
+    :param seed: Seed for the random choices
+    :return: None
+    """
+    rng = random.Random(seed)
+    sat_ids = [f'SAMP-{i:04d}-0000-0000-0000' for i in range(num_sats)]
+    satellites = [{'sat_id': sat_id, 'norad_cat_id': 90000 + i, 'name': f'SAMPLE-{i}', 'names': '',
+                   'status': 'alive' if i % 4 else 're-entered', 'decayed': None if i % 4 else '2021-01-01T00:00:00Z',
+                   'launched': '2020-01-01T00:00:00Z', 'countries': 'US', 'telemetries': [{'decoder': 'ax25'}]}
+                  for i, sat_id in enumerate(sat_ids)]
+    with open(cnst.directories['satellites_json'], 'w') as out:
+        json.dump(satellites, out)
+    pd.DataFrame.from_dict(satellites).to_csv(cnst.directories['satellites_csv'], index=False)
+
+    for i, sat_id in enumerate(sat_ids):
+        events = []
+        for e in range(events_per_sat):
+            observation_id = rng.randint(1, num_observations) if rng.random() < 0.8 else None
+            events.append({'sat_id': sat_id, 'norad_cat_id': 90000 + i, 'transmitter': '', 'app_source': 'network',
+                           'schema': '', 'decoded': '', 'frame': 'A5' * rng.randint(4, 30) + '55' * rng.randint(0, 8),
+                           'observer': f'Station {rng.randint(1, 4)}-JN97ml',
+                           'timestamp': f'2021-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T02:03:{e % 60:02d}Z',
+                           'version': '', 'observation_id': observation_id, 'station_id': rng.randint(1, 4),
+                           'associated_satellites': []})
+        with open(f"{cnst.directories['tm_events']}{sat_id}.json", 'w') as out:
+            json.dump(events, out)
+
+    observations = []
+    for observation_id in range(1, num_observations + 1):
+        observation = cnst.observation_template.copy()
+        observation.update({
+            'Observation_id': str(observation_id),
+            'Satellite': f'{90000 + observation_id % num_sats} - SAMPLE-{observation_id % num_sats}',
+            'Station': f'{observation_id % 4} - Station {observation_id % 4}',
+            'Status': 'Good' if observation_id % 3 else 'Unknown',
+            'Status_Message': 'Vetted',
+            'Transmitter': 'Mode AFSK 1k2 - Downlink',
+            'Frequency': '145,900,000 Hz' if observation_id % 7 else None,
+            'Mode': ['AFSK'],
+            'Metadata': json.dumps({'radio': {'name': 'gr-satnogs', 'version': 'v2.3'}, 'latitude': 47.5,
+                                    'longitude': 19.0, 'elevation': 120}),
+            'Downloads': {'audio': None, 'waterfall': f'https://example.org/{observation_id}.png',
+                          'waterfall_hash_name': None, 'waterfall_shape': None},
+            'Waterfall_Status': 'With Signal',
+        })
+        observations.append(observation)
+    with open(cnst.directories['observation_json'], 'w') as out:
+        json.dump(observations, out)
@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+
+import src.constants as cnst
+
+
+class TestConstants:
+
+    def test_keys_from_file_and_environment(self, tmp_path, monkeypatch):
+        """
+        Test that the credentials are read from the configured file, with the environment taking precedence
+        """
+        keys_file = tmp_path / 'keys.txt'
+        keys_file.write_text('file-api\nfile-cookie\n')
+        monkeypatch.setenv(cnst.keys_file_variable, str(keys_file))
+        monkeypatch.setenv(cnst.key_variables['cookie'], 'environment-cookie')
+        monkeypatch.delenv(cnst.key_variables['api'], raising=False)
+        monkeypatch.delenv(cnst.key_variables['token'], raising=False)
+        assert cnst.load_keys() == {'api': 'file-api', 'cookie': 'environment-cookie', 'token': ''}
+
+    def test_data_directories(self):
+        """
+        Test that every location is placed under the data directory
+        """
+        directories = cnst.data_directories('/srv/satnogs')
+        assert directories.keys() == cnst.directories.keys()
+        assert all(path.startswith('/srv/satnogs') for path in directories.values())
+
+    def test_cold_import(self, tmp_path):
+        """
+        Test that the package imports from a directory without keys.txt and without loading its heavy dependencies
+        """
+        script = ('import sys, json, src.data_pull, src.pipeline, src.constants as cnst; '
+                  'print(json.dumps([[name for name in ["pandas", "numpy", "pyarrow", "PIL", "bs4", "requests"] '
+                  'if name in sys.modules], cnst.keys["api"], cnst.directories["data"]]))')
+        environment = {name: value for name, value in os.environ.items() if not name.startswith('SATNOGS_')}
+        environment.update(PYTHONPATH=os.getcwd(), SATNOGS_DATA_DIR=str(tmp_path / 'data'))
+        output = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=environment, check=True,
+                                capture_output=True, text=True).stdout
+        assert json.loads(output.strip().splitlines()[-1]) == [[], '', str(tmp_path / 'data')]
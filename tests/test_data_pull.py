@@ -0,0 +1,91 @@
+import json
+import os
+
+import pandas as pd
+
+from src.data_pull import prepare_directory, fix_freqs, fix_freqs_series, complete_dataset, stream_complete_dataset, \
+    summarize_dataset
+from src.storage import ArtifactStore
+from src.telemetry import Telemetry
+from src.work_queue import WorkQueue
+import src.constants as cnst
+from tests.sample_data import write_sample_data
+
+
+class TestDataPull:
+
+    def test_fix_freqs_series(self):
+        """
+        Test the vectorized frequency cleanup against fix_freqs
+        """
+        freqs = ['145,900,000 Hz', None, '437,525,000 Hz', '2,400,100,000 Hz']
+        expected = [int(fix_freqs(freq)) for freq in freqs]
+
+        assert list(fix_freqs_series(pd.Series(freqs, dtype=object))) == expected
+        assert list(fix_freqs_series(pd.Series(freqs))) == expected
+
+    def test_prepare_directory_keeps_queue(self):
+        """
+        Test that clearing the data directory keeps the files asked for, such as the scrape queue, and nothing else
+        """
+        prepare_directory()
+        write_sample_data()
+        WorkQueue().add([1, 2])
+        prepare_directory(keep=[cnst.directories['scrape_queue']])
+        assert WorkQueue().counts()['pending'] == 2
+        assert not os.path.exists(cnst.directories['observation_json'])
+        assert os.listdir(cnst.directories['tm_events']) == []
+        prepare_directory()
+        assert not os.path.exists(cnst.directories['scrape_queue'])
+
+    def test_stream_complete_dataset(self):
+        """
+        Test that the batched join writes the same rows as the in memory join
+        """
+        prepare_directory()
+        write_sample_data()
+        Telemetry(prints=False).get_archived_satellites_events()
+
+        combined_df = complete_dataset()
+        # a tiny budget puts each satellite archive in its own batch
+        store = ArtifactStore(backend='parquet')
+        rows = stream_complete_dataset(memory_budget_mb=0.001, store=store, prints=False)
+        streamed_df = store.read('combined')
+
+        assert rows == combined_df.shape[0] == streamed_df.shape[0]
+        assert sorted(streamed_df.columns) == sorted(combined_df.columns)
+
+        columns = ['Observation_id', 'sat_id', 'frame', 'timestamp', 'Frequency', 'name']
+        assert combined_df[columns].astype(str).value_counts().sort_index().equals(
+            streamed_df[columns].astype(str).value_counts().sort_index())
+
+    def test_summarize_dataset(self):
+        """
+        Test that the summary has one row per observation and satellite, with the frames of the combined dataset
+        counted, and keeps the observations without frames
+        """
+        prepare_directory()
+        write_sample_data(events_per_sat=200)
+        with open(cnst.directories['observation_json'], 'r') as file_in:
+            observations = json.load(file_in)
+        observations.append({**observations[0], 'Observation_id': '999'})
+        with open(cnst.directories['observation_json'], 'w') as out:
+            json.dump(observations, out)
+        Telemetry(prints=False).get_archived_satellites_events()
+
+        combined_df = complete_dataset()
+        store = ArtifactStore(backend='parquet')
+        summary_df = summarize_dataset(memory_budget_mb=0.001, store=store)
+        assert summary_df.shape[0] < combined_df.shape[0]
+        assert store.read('summary').shape[0] == summary_df.shape[0]
+
+        framed = combined_df[combined_df['frame'].notna()]
+        expected = framed.groupby([framed['Observation_id'].astype(int), framed['sat_id'].astype(str)]).agg(
+            frame_count=('frame', 'size'), first_timestamp=('timestamp', 'min'), last_timestamp=('timestamp', 'max'))
+        summarized = summary_df[summary_df['frame_count'] > 0]
+        summarized = summarized.set_index([summarized['Observation_id'].astype(int), summarized['sat_id'].astype(str)])
+        assert summarized.index.is_unique
+        pd.testing.assert_frame_equal(summarized[expected.columns].sort_index(), expected.sort_index(),
+                                      check_dtype=False, check_names=False)
+
+        assert summary_df.loc[summary_df['frame_count'] == 0, 'Observation_id'].tolist() == [999]
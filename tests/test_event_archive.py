@@ -0,0 +1,127 @@
+import gzip
+import json
+import os
+
+import pandas as pd
+
+from src.data_pull import iter_event_batches, prepare_directory
+from src.event_archive import archive_path, archive_size, convert_archives, find_archive, group_archives, \
+    iter_archive, list_archives, load_events, load_events_df, write_archive
+from src.schema import apply_schema
+from src.telemetry import Telemetry
+import src.constants as cnst
+from tests.sample_data import write_sample_data
+
+
+class TestEventArchive:
+
+    def test_round_trip(self, tmp_path):
+        """
+        Test that a compressed archive reads back the events it was written with, across blocks, with blank lines
+        and without a newline at the end
+        """
+        events_path = f'{tmp_path}/'
+        events = [{'observation_id': i, 'frame': 'A5' * (i % 50), 'timestamp': f'2022-01-01T00:00:{i % 60:02d}Z'}
+                  for i in range(500)]
+        path = archive_path(events_path, 'SAT', 'jsonl.gz')
+        write_archive(path, events)
+        assert path.endswith('SAT.jsonl.gz')
+        assert list(iter_archive(path, block_bytes=100)) == events
+        assert archive_size(path) == sum([len(json.dumps(event)) + 1 for event in events])
+        assert not os.path.exists(f'{path}.tmp')
+
+        with gzip.open(f'{events_path}NO-NEWLINE.jsonl.gz', 'wt') as out:
+            out.write(json.dumps(events[0]) + '\n\n' + json.dumps(events[1]) + '\n' + json.dumps(events[2]))
+        assert list(iter_archive(f'{events_path}NO-NEWLINE.jsonl.gz', block_bytes=7)) == events[:3]
+
+    def test_legacy_archives(self, tmp_path):
+        """
+        Test that JSON array archives are still read, that a newer compressed archive of the same satellite is
+        preferred and that the archives convert to the compressed format
+        """
+        events_path = f'{tmp_path}/'
+        with open(f'{events_path}OLD.json', 'w') as out:
+            json.dump([{'observation_id': 1}], out)
+        with open(f'{events_path}BOTH.json', 'w') as out:
+            json.dump([{'observation_id': 2}], out)
+        write_archive(archive_path(events_path, 'BOTH', 'jsonl.gz'), [{'observation_id': 3}])
+        with open(f'{events_path}notes.txt', 'w') as out:
+            out.write('not an archive')
+
+        assert [sat_id for sat_id, _ in list_archives(events_path)] == ['BOTH', 'OLD']
+        assert [event for _, path in list_archives(events_path) for event in iter_archive(path)] == \
+            [{'observation_id': 3}, {'observation_id': 1}]
+        assert find_archive(events_path, 'OLD') == f'{events_path}OLD.json'
+        assert find_archive(events_path, 'NONE') is None
+
+        assert convert_archives(events_path, 'jsonl.gz') == 1
+        assert sorted(os.listdir(events_path)) == ['BOTH.jsonl.gz', 'OLD.jsonl.gz', 'notes.txt']
+        assert list(iter_archive(f'{events_path}OLD.jsonl.gz')) == [{'observation_id': 1}]
+
+    def test_mixed_archive_reads(self):
+        """
+        Test that the events dataset and its batches are the same whether the archive is compressed or not
+        """
+        prepare_directory()
+        write_sample_data()
+        tm = Telemetry(prints=False)
+        tm.get_archived_satellites_events(save_events=False)
+        legacy = tm.telemetry_events
+        legacy_batches = sum([len(batch) for batch in iter_event_batches(memory_budget_mb=1)])
+
+        half = list_archives(cnst.directories['tm_events'])[::2]
+        for sat_id, path in half:
+            write_archive(archive_path(cnst.directories['tm_events'], sat_id, 'jsonl.gz'), list(iter_archive(path)))
+            os.remove(path)
+        tm.get_archived_satellites_events(save_events=False)
+        assert tm.telemetry_events == legacy
+        assert sum([len(batch) for batch in iter_event_batches(memory_budget_mb=1)]) == legacy_batches == len(legacy)
+
+        tm.get_events_by_sat_id([sat_id for sat_id, _ in half], fetch=False, save_events=False)
+        assert len(tm.telemetry_events) == sum([len(list(iter_archive(path)))
+                                                for _, path in list_archives(cnst.directories['tm_events'])
+                                                if path.endswith('.jsonl.gz')])
+
+    def test_oversized_archive_batches(self):
+        """
+        Test that an archive larger than the batch budget is split into batches by observation, with every event read
+        once and no observation in two batches
+        """
+        prepare_directory()
+        events = [{'observation_id': str(1000 + i % 40), 'sat_id': 'AAAA-0000-0000-0000-0000', 'frame': 'ab' * 500,
+                   'timestamp': '2023-01-01T00:00:00Z'} for i in range(2000)]
+        write_archive(archive_path(cnst.directories['tm_events'], 'AAAA-0000-0000-0000-0000', 'jsonl.gz'), events)
+        batches = list(iter_event_batches(memory_budget_mb=1))
+        assert len(batches) > 1
+        assert sum([len(batch) for batch in batches]) == len(events)
+        ids = [set(batch['observation_id'].astype(str)) for batch in batches]
+        assert sum([len(batch_ids) for batch_ids in ids]) == len(set.union(*ids)) == 40
+
+    def test_parallel_load(self):
+        """
+        Test that the archives load into the same events and dataframe in a pool of workers as in one process, and
+        that the combined events JSON is only written when asked for
+        """
+        prepare_directory()
+        write_sample_data()
+        for sat_id, path in list_archives(cnst.directories['tm_events'])[::2]:
+            write_archive(archive_path(cnst.directories['tm_events'], sat_id, 'jsonl.gz'), list(iter_archive(path)))
+            os.remove(path)
+        events = [event for _, path in list_archives(cnst.directories['tm_events']) for event in iter_archive(path)]
+        expected = apply_schema(pd.DataFrame.from_dict(events), 'events')
+        paths = [path for _, path in list_archives(cnst.directories['tm_events'])]
+        runs = group_archives(paths, 3)
+        assert [path for run in runs for path in run] == paths and len(runs) <= 4
+
+        assert load_events(processes=2) == load_events(processes=1) == events
+        for processes in [1, 3]:
+            df = load_events_df(processes=processes)
+            pd.testing.assert_frame_equal(df, expected, check_categorical=False)
+            assert isinstance(df['sat_id'].dtype, pd.CategoricalDtype)
+
+        tm = Telemetry(prints=False)
+        tm.get_events_df(save_csv=False, processes=2)
+        assert not os.path.exists(cnst.directories['tm_compiled_json'])
+        tm.get_events_df(save_csv=False, save_events=True, processes=2)
+        with open(cnst.directories['tm_compiled_json'], 'r') as file_in:
+            assert json.load(file_in) == events
@@ -0,0 +1,110 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from benchmarks.standin import Recording, make_server
+from src.data_pull import prepare_directory
+from src.filters import FilterSpec, matches
+from src.observation_scraper import ObservationScraper
+from src.telemetry import Telemetry
+import src.constants as cnst
+
+
+class TestFilters:
+
+    def serve(self, recording, **options):
+        """
+        Starts a stand-in in a thread and points the pipeline at it
+        """
+        server = make_server(recording, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        site = f'http://{server.server_address[0]}:{server.server_address[1]}/'
+        self.previous = cnst.api, cnst.web_address
+        cnst.api, cnst.web_address = f'{site}api/', site
+        return server
+
+    def stop(self, server):
+        cnst.api, cnst.web_address = self.previous
+        server.shutdown()
+        server.server_close()
+
+    def test_spec(self):
+        """
+        Test that a specification round trips through its dictionary form and rejects what it cannot apply
+        """
+        spec = FilterSpec.from_dict({'satellites': [['status', '==', 'alive']],
+                                     'events': [['timestamp', '>=', '2022-03-01'], ['timestamp', '<', '2022-06-01'],
+                                                ['station_id', 'in', [1, 2]]]})
+        assert FilterSpec.from_dict(spec.to_dict()).to_dict() == spec.to_dict()
+        assert spec.event_window() == ('2022-03-01', '2022-06-01')
+        assert spec.event_columns() == ['timestamp', 'station_id']
+        assert FilterSpec().event_window() == (None, None)
+        with pytest.raises(ValueError):
+            FilterSpec(events=[('timestamp', '~', '2022')])
+        with pytest.raises(ValueError):
+            FilterSpec.from_dict({'stations': []})
+
+    def test_select(self):
+        """
+        Test that records and dataframes are selected alike, and that values that cannot be compared do not match
+        """
+        spec = FilterSpec(satellites=[('status', '==', 'alive'), ('norad_cat_id', 'in', [1, 3])],
+                          events=[('timestamp', '>=', '2022-02-01')])
+        catalogue = [{'sat_id': 'A', 'norad_cat_id': 1, 'status': 'alive'},
+                     {'sat_id': 'B', 'norad_cat_id': 2, 'status': 'alive'},
+                     {'sat_id': 'C', 'norad_cat_id': 3, 'status': 'dead'},
+                     {'sat_id': 'D', 'norad_cat_id': 3, 'status': 'alive'}]
+        assert [satellite['sat_id'] for satellite in spec.select_catalogue(catalogue)] == ['A', 'D']
+        sat_df = pd.DataFrame(catalogue).set_index('sat_id')
+        assert list(spec.select_satellites(sat_df).index) == ['A', 'D']
+
+        events = [{'timestamp': '2022-01-31T23:59:00Z'}, {'timestamp': '2022-02-01T00:00:00Z'}, {'timestamp': None}]
+        assert spec.select_events(events) == [events[1]]
+        assert not matches({}, [('timestamp', '>=', '2022')])
+        assert matches({}, [])
+
+    def test_telemetry_window(self):
+        """
+        Test that only the events within the filters are fetched, with the time window applied by the API
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=1, events_per_sat=80, observations_per_sat=2)
+        sat_id = recording.satellites[0]['sat_id']
+        spec = FilterSpec(events=[('timestamp', '>=', '2022-07-01'), ('station_id', '<=', 10)])
+        server = self.serve(recording, page_size=10)
+        try:
+            events = Telemetry(prints=False, filters=spec).fetch_telemetry_by_satellite(sat_id, write_events=False)
+        finally:
+            self.stop(server)
+
+        expected = [event for event in recording.events[sat_id]
+                    if event['timestamp'] >= '2022-07-01' and event['station_id'] <= 10]
+        assert events == expected
+        within = [event for event in recording.events[sat_id] if event['timestamp'] >= '2022-07-01']
+        assert server.api_requests == (len(within) + 9) // 10 < 8
+        assert Telemetry.get_url_endpoint('X', page=2, site='', tm_endpoint='t?', start='2022-07-01T00:00:00+00:00') \
+            == 't?page=2&sat_id=X&start=2022-07-01T00%3A00%3A00%2B00%3A00'
+
+    def test_waterfall_filter(self):
+        """
+        Test that only the waterfalls of the observations that match the waterfall filters are downloaded
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=1, events_per_sat=1, observations_per_sat=2)
+        good, bad = list(recording.observations)
+        recording.observations[bad]['Status'] = 'Bad'
+        server = self.serve(recording)
+        try:
+            scraper = ObservationScraper(prints=False, fetch_logging=False,
+                                         filters=FilterSpec(waterfalls=[('Status', '==', 'Good')]))
+            scraper.scrape_observations([good, bad], write_disk=False)
+        finally:
+            self.stop(server)
+
+        scraped = {observation['Observation_id']: observation for observation in scraper.observations_list}
+        assert scraped[good]['Downloads']['waterfall_shape'] is not None
+        assert scraped[good]['Waterfall_Noise_Floor'] is not None
+        assert scraped[bad]['Downloads']['waterfall'] is not None
+        assert scraped[bad]['Downloads']['waterfall_shape'] is None
+        assert scraped[bad]['Waterfall_Noise_Floor'] is None
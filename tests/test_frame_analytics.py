@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from src.frame_analytics import decode_frames, duplicate_frames, frame_stats
+
+
+class TestFrameAnalytics:
+
+    def test_decode(self):
+        """
+        Test that frames are decoded into one buffer, with missing and malformed frames decoded as empty
+        """
+        frames = decode_frames(['A5ff00', None, 'ABC', 'zz', '', '0100'])
+        assert frames.buffer.tobytes() == bytes.fromhex('A5ff00') + bytes.fromhex('0100')
+        assert list(frames.offsets) == [0, 3, 3, 3, 3, 3, 5]
+        assert list(frames.valid) == [True, False, False, False, True, True]
+        assert frames.frame(5) == b'\x01\x00'
+
+    def test_padding_and_hashes(self):
+        """
+        Test the trailing padding of each frame, and that only equal frames have equal hashes
+        """
+        frames = decode_frames(['0102000000', '000000', '0001', '', '0102000000', '01020000'])
+        assert list(frames.padding_lengths()) == [3, 3, 0, 0, 3, 2]
+        assert list(frames.padding_lengths(0x01)) == [0, 0, 1, 0, 0, 0]
+        hashes = frames.hashes()
+        assert hashes[0] == hashes[4]
+        assert len(set(hashes.tolist())) == 5
+
+    def test_matches_row_by_row_decoding(self):
+        """
+        Test that the vectorized statistics agree with decoding each frame on its own
+        """
+        rng = np.random.default_rng(0)
+        payloads = [rng.integers(0, 256, rng.integers(1, 40), dtype=np.uint8).tobytes() + b'\x00' * (i % 4)
+                    for i in range(500)]
+        events = pd.DataFrame({'frame': [payload.hex() for payload in payloads]})
+        stats = frame_stats(events)
+        assert list(stats['frame_length']) == [len(payload) for payload in payloads]
+        assert list(stats['padding_length']) == [len(payload) - len(payload.rstrip(b'\x00')) for payload in payloads]
+        assert stats['frame_hash'].nunique() == len(set(payloads))
+
+    def test_duplicate_frames(self):
+        """
+        Test that a frame received by several stations is reported once with its stations counted
+        """
+        events = pd.DataFrame({'frame': ['A5A5', 'a5a5', 'A5A5', 'B6', 'B6', None, None],
+                               'station_id': [1, 2, 2, 3, 3, 4, 5]})
+        duplicates = duplicate_frames(events)
+        assert len(duplicates) == 1
+        assert duplicates.loc[0, 'frame_length'] == 2
+        assert duplicates.loc[0, 'receptions'] == 3
+        assert duplicates.loc[0, 'stations'] == 2
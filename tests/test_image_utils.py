@@ -0,0 +1,82 @@
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+import benchmarks.reference as reference
+from benchmarks.synthetic import write_waterfall
+import src.image_utils as iu
+
+
+class TestImageUtils:
+
+    def test_psd_features(self):
+        """
+        Test the summary features computed from a cropped PSD
+        """
+        psd = np.full((4, 5), 10, dtype=np.uint8)
+        psd[:, 3] = 200
+        psd[2, :] = 50
+        psd[2, 3] = 200
+
+        features = iu.compute_psd_features(psd)
+
+        assert sorted(features.keys()) == sorted(iu.psd_features.keys())
+        assert len(features['bin_mean_power']) == psd.shape[1]
+        assert len(features['row_energy']) == psd.shape[0]
+        assert features['row_energy'][0] == 4 * 10 + 200
+        assert features['row_energy'][2] == 4 * 50 + 200
+        assert features['noise_floor'] == 10.0
+        assert features['peak_column'] == 3
+
+    def test_selected_psd_features(self):
+        """
+        Test that only the requested features are computed
+        """
+        psd = np.zeros((3, 3), dtype=np.uint8)
+
+        assert iu.compute_psd_features(psd, ['noise_floor']) == {'noise_floor': 0.0}
+        assert iu.compute_psd_features(psd, []) == {}
+
+    def test_bound_parity(self, tmp_path):
+        """
+        Test that the vectorized bounds match the original getpixel scans
+        """
+        for seed, (width, height) in enumerate([(320, 480), (500, 300), (257, 911)]):
+            image_path = str(tmp_path / f'{seed}.png')
+            write_waterfall(image_path, width, height, seed=seed)
+            im_greyscale = Image.open(image_path).convert('L')
+
+            expected = [reference.find_left_bound(im_greyscale), reference.find_upper_bound(im_greyscale),
+                        reference.find_right_bound(im_greyscale), reference.find_bottom_bound(im_greyscale)]
+
+            assert [iu.find_left_bound(im_greyscale), iu.find_upper_bound(im_greyscale),
+                    iu.find_right_bound(im_greyscale), iu.find_bottom_bound(im_greyscale)] == expected
+            for strip_height in [1, 7, 64, height]:
+                assert iu.find_crop_box(Image.open(image_path), strip_height) == expected
+
+    def test_crop_parity(self, tmp_path):
+        """
+        Test that the strip wise decode path writes the same bytes as the original crop
+        """
+        for mode in ['RGBA', 'RGB', 'P', 'L']:
+            reference_path = str(tmp_path / f'reference_{mode}.png')
+            image_path = str(tmp_path / f'{mode}.png')
+            write_waterfall(reference_path, 320, 480, mode=mode)
+            shutil.copy(reference_path, image_path)
+
+            expected_shape, expected_name = reference.crop_and_save_psd(reference_path)
+            shape, new_file_name, _ = iu.crop_and_save_psd(image_path, strip_height=50)
+
+            assert shape == expected_shape
+            assert not os.path.isfile(image_path)
+            with open(expected_name, 'rb') as expected, open(new_file_name, 'rb') as cropped:
+                assert expected.read() == cropped.read()
+
+    def test_ties_follow_first_seen(self):
+        """
+        Test that ties between bounds are broken the same way as Counter.most_common
+        """
+        assert iu.most_common(np.array([5, 3, 3, 5])) == 5
+        assert iu.most_common(np.array([3, 5, 5, 3, 1])) == 3
@@ -0,0 +1,134 @@
+import json
+from multiprocessing import Pool
+import threading
+import urllib.request
+
+from src.data_pull import prepare_directory
+from src.metrics import disable_metrics, enable_metrics, metrics, run_report, serve_report, write_report
+import src.constants as cnst
+
+
+def work(value):
+    """
+    Records metrics in a pool worker
+    """
+    metrics.increment('test', 'items')
+    metrics.observe('test', 'seconds', value)
+    metrics.flush()
+    return value
+
+
+class TestMetrics:
+
+    def test_histogram(self):
+        """
+        Test that observations land in the right buckets and update the summary
+        """
+        prepare_directory()
+        enable_metrics()
+        try:
+            metrics.observe('histogram', 'seconds', 0.002)
+            metrics.observe('histogram', 'seconds', 100)
+            histogram = run_report()['stages']['histogram']['histograms']['seconds']
+        finally:
+            disable_metrics()
+
+        assert histogram['count'] == 2
+        assert histogram['min'] == 0.002
+        assert histogram['max'] == 100
+        assert histogram['buckets'][1] == 1
+        assert histogram['buckets'][-1] == 1
+        assert histogram['mean'] == (0.002 + 100) / 2
+
+    def test_pool_aggregation(self):
+        """
+        Test that the metrics of every pool worker are combined, without the workers repeating the parent's
+        """
+        prepare_directory()
+        enable_metrics()
+        try:
+            metrics.increment('test', 'items', 100)
+            with Pool(3) as pool:
+                pool.map(work, [0.01] * 12, chunksize=1)
+            with metrics.timer('test', 'stage_seconds'):
+                pass
+            report = write_report(started=0)
+        finally:
+            disable_metrics()
+
+        assert report['stages']['test']['counters']['items'] == 112
+        assert report['stages']['test']['histograms']['seconds']['count'] == 12
+        assert 'items' in report['stages']['test']['rates']
+        assert len(report['workers']) >= 2
+        with open(cnst.directories['metrics_report'], 'r') as file_in:
+            assert json.load(file_in)['stages']['test']['counters']['items'] == 112
+
+    def test_earlier_run(self):
+        """
+        Test that the files an earlier run left in the metrics directory are not combined into the report
+        """
+        prepare_directory()
+        enable_metrics()
+        with open(f"{cnst.directories['metrics']}99999999.json", 'w') as out:
+            json.dump({'pid': 99999999, 'process': 'MainProcess', 'counters': {'earlier': {'items': 1}},
+                       'histograms': {}}, out)
+        disable_metrics()
+        enable_metrics()
+        try:
+            metrics.increment('later', 'items')
+            metrics.flush()
+            report = run_report()
+        finally:
+            disable_metrics()
+
+        assert 'earlier' not in report['stages']
+        assert report['stages']['later']['counters']['items'] >= 1
+
+    def test_live_endpoint(self):
+        """
+        Test that the live endpoint serves the current report
+        """
+        prepare_directory()
+        enable_metrics()
+        server = serve_report(0)
+        try:
+            metrics.increment('live', 'requests', 3)
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/') as response:
+                report = json.load(response)
+        finally:
+            server.shutdown()
+            disable_metrics()
+
+        assert report['stages']['live']['counters']['requests'] >= 3
+
+    def test_live_endpoint_while_updating(self):
+        """
+        Test that the report is served while the run keeps adding counters and histograms
+        """
+        prepare_directory()
+        enable_metrics()
+        server = serve_report(0)
+        stop = threading.Event()
+
+        def update():
+            i = 0
+            while not stop.is_set():
+                metrics.increment('busy', f'counter_{i}')
+                metrics.observe('busy', f'histogram_{i % 50}', 0.01)
+                i += 1
+
+        updater = threading.Thread(target=update)
+        updater.start()
+        try:
+            for _ in range(5):
+                with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/') as response:
+                    assert response.status == 200
+                    json.load(response)
+        finally:
+            stop.set()
+            updater.join()
+            server.shutdown()
+            report = run_report()
+            disable_metrics()
+
+        assert len(report['stages']['busy']['counters']) > 0
@@ -4,7 +4,8 @@ import os
 import pandas
 
 from src.data_pull import prepare_directory
-from src.observation_scraper import ObservationScraper
+from src.observation_scraper import ObservationScraper, conditional_headers, expand_metadata, metadata_values, \
+    needs_refresh
 import src.constants as cnst
 
 
@@ -199,7 +200,45 @@ class TestObservationScraperClass:
         assert observation1_id in obs_df['Observation_id'].values
         assert observation2_id in obs_df['Observation_id'].values
 
-
-
-
-
+    def test_needs_refresh(self):
+        """
+        Test that observations are refreshed until they and their waterfall are vetted, and the conditional headers
+        """
+        waterfall = {'waterfall': 'https://network.satnogs.org/media/waterfall.png'}
+        assert needs_refresh({'Status': 'Unknown', 'Downloads': None})
+        assert needs_refresh({'Status': None})
+        assert needs_refresh({'Status': 'Good', 'Downloads': waterfall, 'Waterfall_Status': 'Unknown'})
+        assert not needs_refresh({'Status': 'Good', 'Downloads': waterfall, 'Waterfall_Status': 'Without Signal'})
+        assert not needs_refresh({'Status': 'Failed', 'Downloads': {'waterfall': None}, 'Waterfall_Status': None})
+
+        assert conditional_headers(None) == {}
+        assert conditional_headers({'etag': '"abc"', 'last_modified': None}) == {'If-None-Match': '"abc"'}
+        assert conditional_headers({'etag': None, 'last_modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}) == \
+            {'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+
+    def test_metadata_values(self):
+        """
+        Test that the declared Metadata fields are flattened into typed columns, parsing each Metadata string once
+        """
+        metadata = json.dumps({'radio': {'name': 'gr-satnogs', 'version': 'v2.3', 'parameters': {'antenna': 'RX'}},
+                               'latitude': 47.5, 'longitude': 19.0, 'elevation': 120})
+        assert metadata_values(metadata) == {
+            'Metadata_Radio_Name': 'gr-satnogs', 'Metadata_Radio_Version': 'v2.3',
+            'Metadata_Radio_Parameters_Antenna': 'RX', 'Metadata_Latitude': 47.5, 'Metadata_Longitude': 19.0,
+            'Metadata_Elevation': 120}
+        assert set(metadata_values('not json').values()) == {None}
+        assert metadata_values({'radio': 'gr-satnogs'})['Metadata_Radio_Name'] is None
+
+        scraper = ObservationScraper(prints=False)
+        scraped = {**scraper.get_template(), 'Observation_id': '2', 'Metadata': metadata}
+        scraped.update(metadata_values(metadata))
+        earlier = {**cnst.observation_template, 'Observation_id': '1', 'Metadata': metadata}
+        df = expand_metadata(pandas.DataFrame.from_dict([earlier, scraped, {**earlier, 'Metadata': None}]))
+        assert df['Metadata_Radio_Name'].tolist()[:2] == ['gr-satnogs', 'gr-satnogs']
+        assert df.loc[2, [column for column in df.columns if column.startswith('Metadata')]].isna().all()
+        assert df['Metadata_Elevation'].tolist()[:2] == [120, 120]
+
+        scraper.observations_list = [earlier, scraped]
+        df = scraper.get_dataframe(load_from_disk_first=False, save_csv=False)
+        assert isinstance(df['Metadata_Radio_Version'].dtype, pandas.CategoricalDtype)
+        assert df['Metadata_Latitude'].dtype == 'float64'
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+
+from benchmarks.standin import Recording, make_server
+from src.data_pull import prepare_directory
+from src.event_archive import iter_archive, list_archives
+from src.filters import FilterSpec
+from src.pipeline import Pipeline, record_fingerprint, telemetry_fingerprint
+from src.telemetry import Telemetry
+import src.constants as cnst
+from tests.sample_data import write_sample_data
+
+
+class TestPipelineClass:
+
+    def test_satellites_to_fetch(self):
+        """
+        Test that only new and changed satellites are picked for a telemetry fetch, the new ones first, and that a
+        refresh adds the unchanged satellites that have not decayed
+        """
+        unchanged = {'sat_id': 'A', 'status': 'alive'}
+        changed = {'sat_id': 'B', 'status': 're-entered'}
+        new = {'sat_id': 'C', 'status': 'alive'}
+        decayed = {'sat_id': 'D', 'status': 're-entered', 'decayed': '2021-01-01T00:00:00Z'}
+        items = {'A': record_fingerprint(unchanged), 'B': record_fingerprint({'sat_id': 'B', 'status': 'alive'}),
+                 'D': record_fingerprint(decayed)}
+        catalogue = [unchanged, changed, new, decayed]
+
+        assert Pipeline.satellites_to_fetch(catalogue, items) == ['C', 'B']
+        assert Pipeline.satellites_to_fetch(catalogue, items, refresh=True) == ['C', 'B', 'A']
+        assert Pipeline.satellites_to_fetch(catalogue, items, force=True) == ['C', 'B', 'A', 'D']
+        assert Pipeline.satellites_to_fetch(catalogue, items, sat_ids=['A']) == ['A']
+
+        # an archive fetched with other event filters is fetched again
+        window = [('timestamp', '>=', '2022-07-01')]
+        items = {sat_id: telemetry_fingerprint(satellite, window)
+                 for sat_id, satellite in [('A', unchanged), ('D', decayed)]}
+        assert Pipeline.satellites_to_fetch([unchanged, decayed], items, event_filters=window) == []
+        assert Pipeline.satellites_to_fetch([unchanged, decayed], items) == ['A', 'D']
+        assert Pipeline.satellites_to_fetch([unchanged, decayed], items,
+                                            event_filters=[('timestamp', '>=', '2022-01-01')]) == ['A', 'D']
+
+    def test_widened_event_window(self):
+        """
+        Test that widening the event filters fetches the telemetry the narrower window left out of the archives
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=2, events_per_sat=40, observations_per_sat=2)
+        server = make_server(recording, page_size=10)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        site = f'http://{server.server_address[0]}:{server.server_address[1]}/'
+        previous = cnst.api, cnst.web_address
+        cnst.api, cnst.web_address = f'{site}api/', site
+        try:
+            narrow = FilterSpec(events=[('timestamp', '>=', '2022-07-01')])
+            assert Pipeline(prints=False, filters=narrow).run(['satellites', 'telemetry']) == \
+                ['satellites', 'telemetry']
+            archived = {(event['timestamp'], event['frame']) for _, path in list_archives(cnst.directories['tm_events'])
+                        for event in iter_archive(path)}
+            assert all([timestamp >= '2022-07-01' for timestamp, _ in archived])
+
+            assert Pipeline(prints=False).run(['telemetry']) == ['telemetry']
+        finally:
+            cnst.api, cnst.web_address = previous
+            server.shutdown()
+            server.server_close()
+
+        archives = [path for _, path in list_archives(cnst.directories['tm_events'])]
+        archived = sorted([(event['timestamp'], event['frame']) for path in archives for event in iter_archive(path)])
+        assert archived == sorted([(event['timestamp'], event['frame']) for events in recording.events.values()
+                                   for event in events])
+
+    def test_failed_fetch_retried(self):
+        """
+        Test that a satellite whose telemetry fetch failed is not recorded as fetched, and is fetched again on the
+        next run
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=2, events_per_sat=30, observations_per_sat=2)
+        failing, fetched = [satellite['sat_id'] for satellite in recording.satellites]
+        server = make_server(recording, page_size=10, failures={(failing, 2): 1})
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        site = f'http://{server.server_address[0]}:{server.server_address[1]}/'
+        previous = cnst.api, cnst.web_address
+        cnst.api, cnst.web_address = f'{site}api/', site
+        try:
+            pipeline = Pipeline(prints=False)
+            assert pipeline.run(['satellites', 'telemetry']) == ['satellites', 'telemetry']
+            assert list(pipeline.manifest['telemetry']['items'].keys()) == [fetched]
+
+            pipeline = Pipeline(prints=False)
+            assert pipeline.run(['telemetry']) == ['telemetry']
+            assert sorted(pipeline.manifest['telemetry']['items'].keys()) == sorted([failing, fetched])
+            assert Pipeline(prints=False).run(['telemetry']) == []
+        finally:
+            cnst.api, cnst.web_address = previous
+            server.shutdown()
+            server.server_close()
+
+        archives = [path for _, path in list_archives(cnst.directories['tm_events'])]
+        archived = sorted([(event['timestamp'], event['frame']) for path in archives for event in iter_archive(path)])
+        assert archived == sorted([(event['timestamp'], event['frame']) for events in recording.events.values()
+                                   for event in events])
+
+    def test_combined_stage_caching(self):
+        """
+        Test that the combined stage is skipped until one of its inputs changes
+        """
+        prepare_directory()
+        write_sample_data()
+        Telemetry(prints=False).get_archived_satellites_events()
+
+        # record the earlier stages as if they had run
+        pipeline = Pipeline(prints=False)
+        for stage in ['satellites', 'telemetry', 'observations']:
+            pipeline.record(stage, 0)
+        assert pipeline.run(['combined']) == ['combined']
+        assert pipeline.run(['combined']) == []
+
+        # a new pipeline reads the records of the last run from the manifest
+        assert Pipeline(prints=False).run(['combined']) == []
+        assert Pipeline(prints=False).run(['combined'], force=True) == ['combined']
+
+        with open(cnst.directories['observation_json'], 'r') as file_in:
+            observations = json.load(file_in)
+        with open(cnst.directories['observation_json'], 'w') as out:
+            json.dump(observations[:-1], out)
+        assert Pipeline(prints=False).run(['combined']) == ['combined']
+
+        # the summary is a different output of the stage, so asking for it runs the stage again
+        assert Pipeline(prints=False, summary=True).run(['combined']) == ['combined']
+        assert os.path.exists(cnst.directories['summary_csv'])
+        assert Pipeline(prints=False, summary=True).run(['combined']) == []
+
+    def test_catalogue_max_age(self):
+        """
+        Test that the satellites stage stops being current once the catalogue is older than its max age
+        """
+        prepare_directory()
+        write_sample_data()
+        pipeline = Pipeline(prints=False)
+        pipeline.record('satellites', 0)
+        assert pipeline.is_current('satellites')
+
+        pipeline.manifest['satellites']['completed'] = time.strftime('%Y-%m-%dT%H:%M:%S',
+                                                                     time.localtime(time.time() - 25 * 3600))
+        pipeline.save_manifest()
+        assert not Pipeline(prints=False).is_current('satellites')
+        assert Pipeline(prints=False, catalogue_max_age_hours=48).is_current('satellites')
+        assert Pipeline(prints=False, catalogue_max_age_hours=None).is_current('satellites')
+
+    def test_missing_dependency(self):
+        """
+        Test that a stage is not run before the stages it reads from
+        """
+        prepare_directory()
+        assert Pipeline(prints=False).run(['observations']) == []
+
+    def test_observations_stage_scrapes_only_new(self):
+        """
+        Test that observations that were already scraped are not scraped again
+        """
+        prepare_directory()
+        write_sample_data()
+        Telemetry(prints=False).get_events_df(save_csv=True)
+
+        pipeline = Pipeline(prints=False)
+        for stage in ['satellites', 'telemetry']:
+            pipeline.record(stage, 0)
+        # every observation the events reference is in the sample observations, so nothing is fetched
+        assert pipeline.run(['observations', 'combined']) == ['observations', 'combined']
+        assert pipeline.run(['observations', 'combined']) == []
@@ -0,0 +1,77 @@
+import json
+from multiprocessing import Pool
+
+from src.data_pull import prepare_directory
+from src.profiling import disable_profiling, enable_profiling, folded_stacks, profiler, traced, write_profile_report
+
+
+@traced('test.inner')
+def inner(n):
+    return sum(range(n))
+
+
+@traced('test.outer')
+def outer(n):
+    return inner(n) + inner(n)
+
+
+class TestProfiling:
+
+    def test_disabled(self):
+        """
+        Test that traced functions record nothing while profiling is off
+        """
+        disable_profiling()
+        assert outer(10) == 90
+        assert profiler.events == []
+
+    def test_folded_stacks(self):
+        """
+        Test that each stack is folded with its own time, excluding nested spans
+        """
+        events = [{'stack': 'a', 'dur': 100}, {'stack': 'a;b', 'dur': 30}, {'stack': 'a;b', 'dur': 20},
+                  {'stack': 'a;b;c', 'dur': 5}]
+        assert folded_stacks(events) == {'a': 50, 'a;b': 45, 'a;b;c': 5}
+
+    def test_pool_report(self):
+        """
+        Test that the spans and profiles of pool workers are merged into one trace and profile
+        """
+        prepare_directory()
+        enable_profiling('cprofile')
+        try:
+            with Pool(2) as pool:
+                pool.map(outer, [10000] * 6, chunksize=1)
+            outputs = write_profile_report()
+        finally:
+            disable_profiling()
+
+        with open(outputs['trace'], 'r') as file_in:
+            trace = json.load(file_in)['traceEvents']
+        assert len([event for event in trace if event['name'] == 'test.outer']) == 6
+        assert len([event for event in trace if event['name'] == 'test.inner']) == 12
+        assert len(set([event['pid'] for event in trace])) >= 1
+        with open(outputs['folded'], 'r') as file_in:
+            stacks = [line.rsplit(' ', 1)[0] for line in file_in]
+        assert sorted(stacks) == ['test.outer', 'test.outer;test.inner']
+        with open(outputs['summary'], 'r') as file_in:
+            assert 'outer' in file_in.read()
+
+    def test_earlier_run(self):
+        """
+        Test that the spans an earlier run left under a reused PID are not merged into the report
+        """
+        prepare_directory()
+        enable_profiling()
+        outer(10)
+        disable_profiling()
+        enable_profiling()
+        try:
+            inner(10)
+            outputs = write_profile_report()
+        finally:
+            disable_profiling()
+
+        with open(outputs['trace'], 'r') as file_in:
+            trace = json.load(file_in)['traceEvents']
+        assert [event['name'] for event in trace] == ['test.inner']
@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+
+from src.data_pull import prepare_directory, complete_dataset, stream_complete_dataset
+from src.query_index import QueryIndex
+from src.storage import ArtifactStore
+from src.telemetry import Telemetry
+from tests.sample_data import write_sample_data
+
+
+class TestQueryIndex:
+
+    def test_query(self):
+        """
+        Test that the indexed queries return the same rows as filtering the combined dataframe
+        """
+        prepare_directory()
+        write_sample_data()
+        Telemetry(prints=False).get_archived_satellites_events()
+        combined_df = complete_dataset(build_index=True)
+        index = QueryIndex()
+        sat_id = 'SAMP-0001-0000-0000-0000'
+
+        assert index.query().shape[0] == combined_df.shape[0]
+
+        df = index.query(sat_id=sat_id, station='1 - Station 1', start='2021-03-01', end='2021-04-01')
+        expected = combined_df[(combined_df['sat_id'] == sat_id) & (combined_df['Station'] == '1 - Station 1') &
+                               (combined_df['timestamp'] >= pd.Timestamp('2021-03-01', tz='UTC')) &
+                               (combined_df['timestamp'] < pd.Timestamp('2021-04-01', tz='UTC'))]
+        assert df.shape[0] == expected.shape[0] > 0
+        assert sorted(df['frame']) == sorted(expected['frame'])
+        assert df['timestamp'].dtype == combined_df['timestamp'].dtype
+
+        df = index.query(observation_id=[3, 4], columns=['Observation_id', 'frame'], limit=2)
+        assert list(df.columns) == ['Observation_id', 'frame']
+        assert df.shape[0] == 2
+        assert set(df['Observation_id']) <= {3, 4}
+
+    def test_streamed_index(self):
+        """
+        Test that the streamed join builds the same index as the in memory join
+        """
+        prepare_directory()
+        write_sample_data()
+        Telemetry(prints=False).get_archived_satellites_events()
+        expected = QueryIndex()
+        complete_dataset(build_index=True)
+        expected_rows = expected.query(norad_cat_id=90002).shape[0]
+
+        stream_complete_dataset(memory_budget_mb=0.001, store=ArtifactStore(backend='parquet'), build_index=True)
+        assert QueryIndex().query(norad_cat_id=90002).shape[0] == expected_rows > 0
+
+    def test_missing_index(self):
+        """
+        Test that querying an index that was not built raises a clear error and leaves no database behind
+        """
+        prepare_directory()
+        index = QueryIndex()
+        with pytest.raises(FileNotFoundError):
+            index.query()
+        assert not index.exists()
+
+    def test_batches_with_different_columns(self):
+        """
+        Test that a column that only later batches have is added to the index instead of dropped
+        """
+        prepare_directory()
+        index = QueryIndex()
+        index.clear()
+        index.append(pd.DataFrame({'sat_id': ['A', 'A'], 'Observation_id': [1, 2], 'frame': ['AB', 'CD']}))
+        index.append(pd.DataFrame({'sat_id': ['B'], 'Observation_id': [3], 'frame': ['EF'], 'Frame': ['X'],
+                                   'extra': [7]}))
+        index.create_indexes()
+
+        df = QueryIndex().query().sort_values('Observation_id')
+        assert list(df.columns) == ['sat_id', 'Observation_id', 'frame', 'Frame', 'extra']
+        assert df['frame'].tolist() == ['AB', 'CD', 'EF']
+        assert df['Frame'].isna().tolist() == [True, True, False]
+        assert df['extra'].tolist()[2] == 7
+        assert QueryIndex().query(sat_id='B')['Frame'].tolist() == ['X']
@@ -2,7 +2,11 @@ import pandas as pd
 import pytest
 import os
 import shutil
-from src.satellites import Satellites
+import json
+import threading
+from benchmarks.standin import Recording, make_server
+from src.data_pull import prepare_directory
+from src.satellites import Satellites, catalogue_delta, is_decayed
 import src.constants as cnst
 
 
@@ -59,4 +63,48 @@ class TestSatellitesClass:
         sats.get_dataframe(save_to_disk=True)
         assert os.path.isfile(cnst.directories['satellites_csv'])
 
+    def test_catalogue_delta(self):
+        """
+        Test that added, removed and changed satellites are found, with the fields that changed
+        """
+        previous = [{'sat_id': 'A', 'status': 'alive', 'decayed': None}, {'sat_id': 'B', 'status': 'alive'},
+                    {'sat_id': 'C', 'status': 'alive'}]
+        current = [{'sat_id': 'A', 'status': 'alive', 'decayed': None},
+                   {'sat_id': 'B', 'status': 're-entered', 'decayed': '2022-05-01T00:00:00Z'},
+                   {'sat_id': 'D', 'status': 'alive'}]
+        delta = catalogue_delta(previous, current)
+        assert delta['added'] == ['D']
+        assert delta['removed'] == ['C']
+        assert delta['unchanged'] == ['A']
+        assert delta['changed'] == {'B': {'decayed': {'previous': None, 'current': '2022-05-01T00:00:00Z'},
+                                          'status': {'previous': 'alive', 'current': 're-entered'}}}
+        assert is_decayed(current[1]) and not is_decayed(current[0])
 
+    def test_refresh(self):
+        """
+        Test that a refresh compares the fetched catalogue with the stored one and writes the delta
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=3, events_per_sat=1, observations_per_sat=1)
+        stored = [dict(satellite) for satellite in recording.satellites[:2]]
+        stored[1]['status'] = 'future'
+        with open(cnst.directories['satellites_json'], 'w') as out:
+            json.dump(stored, out)
+
+        server = make_server(recording)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            sats = Satellites(api=f'http://{server.server_address[0]}:{server.server_address[1]}/api/', prints=False)
+            delta = sats.refresh()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert delta['added'] == [recording.satellites[2]['sat_id']]
+        assert delta['unchanged'] == [recording.satellites[0]['sat_id']]
+        assert delta['changed'][recording.satellites[1]['sat_id']] == {'status': {'previous': 'future',
+                                                                                  'current': 'alive'}}
+        with open(cnst.directories['satellites_delta'], 'r') as file_in:
+            assert json.load(file_in) == delta
+        with open(cnst.directories['satellites_json'], 'r') as file_in:
+            assert json.load(file_in) == recording.satellites
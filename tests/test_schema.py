@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+
+from src.data_pull import prepare_directory
+from src.schema import align_categories, apply_schema, concat_fragments, schemas
+from src.storage import ArtifactStore
+from tests.test_storage import sample_events
+
+
+class TestSchema:
+
+    def test_apply_schema(self):
+        """
+        Test that the declared types are applied and that applying them again changes nothing
+        """
+        df = apply_schema(sample_events(), 'events')
+
+        assert isinstance(df['sat_id'].dtype, pd.CategoricalDtype)
+        assert isinstance(df['observer'].dtype, pd.CategoricalDtype)
+        assert df['norad_cat_id'].dtype == 'Int32'
+        assert df['observation_id'].dtype == 'Int32'
+        assert df['observation_id'].isna().sum() == 1
+        assert str(df['timestamp'].dt.tz) == 'UTC'
+        # columns that are not declared keep their inferred type
+        assert df['frame'].dtype == sample_events()['frame'].dtype
+
+        assert apply_schema(df.copy(), 'events').dtypes.equals(df.dtypes)
+
+    def test_list_categories(self):
+        """
+        Test that lists in a categorical column are stored as JSON strings
+        """
+        df = apply_schema(pd.DataFrame({'Mode': [['AFSK'], ['AFSK'], ['FM', 'CW']]}), 'observations')
+
+        assert list(df['Mode'].cat.categories) == ['["AFSK"]', '["FM", "CW"]']
+
+    def test_coerced_values(self):
+        """
+        Test that values that cannot be cast are set to NA with a warning that counts them
+        """
+        df = pd.DataFrame({'norad_cat_id': ['25544', 'unknown', None],
+                           'timestamp': ['2022-01-01T00:00:00Z', 'x', None]})
+        with pytest.warns(UserWarning) as record:
+            apply_schema(df, 'events')
+
+        assert df['norad_cat_id'].tolist()[0] == 25544 and df['norad_cat_id'].isna().sum() == 2
+        messages = [str(warning.message) for warning in record]
+        assert any(['1 values of norad_cat_id' in message and "'unknown'" in message for message in messages])
+        assert any(['1 values of timestamp' in message for message in messages])
+
+    def test_types_match_across_backends(self):
+        """
+        Test that the csv and parquet backends read back the same declared types
+        """
+        prepare_directory()
+        dtypes = []
+        for backend in ['csv', 'parquet']:
+            store = ArtifactStore(backend=backend)
+            store.write('events', sample_events())
+            df = store.read('events')
+            dtypes.append({column: str(df[column].dtype) for column in schemas['events'] if column in df.columns})
+
+        assert dtypes[0] == dtypes[1]
+
+    def test_align_categories(self):
+        """
+        Test that merging on aligned categoricals keeps the categorical type
+        """
+        left = apply_schema(pd.DataFrame({'sat_id': ['A', 'B', 'C']}), 'events')
+        right = apply_schema(pd.DataFrame({'sat_id': ['C', 'D'], 'name': ['c', 'd']}), 'satellites')
+        align_categories(left, right, 'sat_id')
+        merged = left.merge(right, on='sat_id', how='left')
+
+        assert isinstance(merged['sat_id'].dtype, pd.CategoricalDtype)
+        assert list(merged['name'].fillna('')) == ['', '', 'c']
+
+    def test_concat_fragments(self):
+        """
+        Test that fragments typed separately concatenate with their categoricals and other types kept
+        """
+        first = apply_schema(pd.DataFrame({'sat_id': ['A', 'B'], 'station_id': [1, 2],
+                                           'timestamp': ['2022-01-01T00:00:00Z', '2022-01-02T00:00:00Z']}), 'events')
+        second = apply_schema(pd.DataFrame({'sat_id': ['C'], 'station_id': [3], 'observer': ['x']}), 'events')
+        combined = concat_fragments([first, apply_schema(pd.DataFrame(), 'events'), second], 'events')
+
+        assert list(combined['sat_id']) == ['A', 'B', 'C']
+        assert isinstance(combined['sat_id'].dtype, pd.CategoricalDtype)
+        assert isinstance(combined['observer'].dtype, pd.CategoricalDtype)
+        assert str(combined['station_id'].dtype) == 'Int32'
+        assert combined['timestamp'].isna().tolist() == [False, False, True]
+        assert concat_fragments([], 'events').empty
@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+
+import src.constants as cnst
+from src.data_pull import prepare_directory, complete_dataset
+from src.sharding import activate_shard, merge_shards, select_shard, shard_directories, shard_of
+from src.telemetry import Telemetry
+from tests.sample_data import write_sample_data
+
+
+class TestSharding:
+
+    def test_shard_of(self):
+        """
+        Test that every key lands in exactly one shard, the same one every time
+        """
+        sat_ids = [f'SAMP-{i:04d}-0000-0000-0000' for i in range(100)]
+        shards = [select_shard(sat_ids, shard_index, 4) for shard_index in range(4)]
+
+        assert sorted(sum(shards, [])) == sat_ids
+        assert all([len(shard) > 0 for shard in shards])
+        assert [shard_of(sat_id, 4) for sat_id in sat_ids] == [shard_of(sat_id, 4) for sat_id in sat_ids]
+
+    def test_shard_directories(self):
+        """
+        Test that the data directories of a shard are moved under the shard's own directory
+        """
+        directories = shard_directories(1, 3)
+
+        assert directories['data'] == './data/shards/1-of-3'
+        assert directories['tm_events'] == './data/shards/1-of-3/telemetry_events/'
+        assert directories['shards'] == cnst.directories['shards']
+
+    def test_prepare_directory_keeps_shards(self):
+        """
+        Test that clearing the data directory for a run keeps the shard outputs a later merge reads
+        """
+        prepare_directory()
+        write_sample_data()
+        previous = activate_shard(0, 2)
+        try:
+            prepare_directory()
+            with open(cnst.directories['satellites_json'], 'w') as out:
+                json.dump([], out)
+            shard_satellites = cnst.directories['satellites_json']
+        finally:
+            cnst.directories.update(previous)
+
+        try:
+            prepare_directory()
+            assert os.path.exists(shard_satellites)
+            assert not os.path.exists(cnst.directories['observation_json'])
+        finally:
+            shutil.rmtree(cnst.directories['shards'])
+
+    def test_merge_shards(self):
+        """
+        Test that merging the shards gives the same dataset as one node crawling everything
+        """
+        prepare_directory()
+        write_sample_data(num_sats=6)
+        Telemetry(prints=False).get_archived_satellites_events()
+        expected = complete_dataset()
+        with open(cnst.directories['satellites_json'], 'r') as file_in:
+            sat_ids = [satellite['sat_id'] for satellite in json.load(file_in)]
+        with open(cnst.directories['observation_json'], 'r') as file_in:
+            observations = json.load(file_in)
+
+        for shard_index in range(2):
+            previous = activate_shard(shard_index, 2)
+            try:
+                prepare_directory()
+                shutil.copytree(previous['satellites'], cnst.directories['satellites'], dirs_exist_ok=True)
+                shard_observations = []
+                for sat_id in select_shard(sat_ids, shard_index, 2):
+                    shutil.copy(f"{previous['tm_events']}{sat_id}.json", cnst.directories['tm_events'])
+                    with open(f"{previous['tm_events']}{sat_id}.json", 'r') as file_in:
+                        ids = set([str(event['observation_id']) for event in json.load(file_in)])
+                    shard_observations += [observation for observation in observations
+                                           if observation['Observation_id'] in ids]
+                # an observation referenced by two shards is scraped by both
+                shard_observations += observations[:2]
+                with open(cnst.directories['observation_json'], 'w') as out:
+                    json.dump(shard_observations, out)
+                with open(cnst.directories['observation_validators'], 'w') as out:
+                    json.dump({observation['Observation_id']: {'etag': f'"{shard_index}"', 'last_modified': None}
+                               for observation in shard_observations}, out)
+            finally:
+                cnst.directories.update(previous)
+
+        shutil.rmtree(cnst.directories['tm_events'])
+        prepare_directory(clear=False)
+        assert merge_shards(2, prints=False) == 2
+        merged = complete_dataset()
+        with open(cnst.directories['observation_validators'], 'r') as file_in:
+            validators = json.load(file_in)
+        assert set(validators.keys()) == set([observation['Observation_id'] for observation in observations])
+
+        assert merged.shape == expected.shape
+        assert sorted(merged['frame'].dropna()) == sorted(expected['frame'].dropna())
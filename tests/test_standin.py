@@ -0,0 +1,137 @@
+import json
+import threading
+
+from benchmarks.standin import Recording, make_server
+from src.data_pull import prepare_directory, streaming_pull
+from src.observation_scraper import ObservationScraper
+from src.telemetry import Telemetry
+import src.constants as cnst
+
+
+class TestStandin:
+
+    def serve(self, recording, **options):
+        """
+        Starts a stand-in in a thread and points the pipeline at it
+        """
+        server = make_server(recording, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        site = f'http://{server.server_address[0]}:{server.server_address[1]}/'
+        self.previous = cnst.api, cnst.web_address
+        cnst.api, cnst.web_address = f'{site}api/', site
+        return server
+
+    def stop(self, server):
+        cnst.api, cnst.web_address = self.previous
+        server.shutdown()
+        server.server_close()
+
+    def test_paginated_telemetry(self):
+        """
+        Test that every recorded event of a satellite is fetched across its pages, through a throttled response
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=1, events_per_sat=60, observations_per_sat=2)
+        sat_id = recording.satellites[0]['sat_id']
+        server = self.serve(recording, page_size=25, throttle_every=3)
+        try:
+            events = Telemetry(prints=False).fetch_telemetry_by_satellite(sat_id, write_events=False)
+        finally:
+            self.stop(server)
+
+        assert events == recording.events[sat_id]
+        # three pages, each once, and the throttled request
+        assert server.api_requests == 4
+
+    def test_observation_page(self):
+        """
+        Test that the observation pages of the stand-in are scraped like the pages of the network
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=1, events_per_sat=1, observations_per_sat=1)
+        observation_id, observation = next(iter(recording.observations.items()))
+        server = self.serve(recording)
+        try:
+            scraper = ObservationScraper(prints=False, fetch_logging=False)
+            scraped = scraper.scrape_observation(f'{cnst.web_address}{cnst.observations}{observation_id}/')
+        finally:
+            self.stop(server)
+
+        assert scraped['Observation_id'] == observation_id
+        for key in ['Satellite', 'Station', 'Frequency', 'Mode', 'Status', 'Status_Message', 'Waterfall_Status']:
+            assert scraped[key] == observation[key]
+        assert scraped['Metadata_Radio_Name'] == 'gr-satnogs' and scraped['Metadata_Latitude'] == 47.5
+        assert scraped['Downloads']['waterfall_shape'] is not None
+
+    def test_streaming_pull(self):
+        """
+        Test that a streaming pull scrapes every observation of the fetched events once, while telemetry is fetched
+        by several processes
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=3, events_per_sat=30, observations_per_sat=4)
+        sat_ids = [satellite['sat_id'] for satellite in recording.satellites]
+        server = self.serve(recording, page_size=10)
+        try:
+            scraper = ObservationScraper(prints=False, fetch_logging=False, fetch_waterfalls=False)
+            telemetry = Telemetry(prints=False)
+            scraped = streaming_pull(sat_ids, telemetry, scraper, telemetry_processes=2, scrape_processes=2)
+        finally:
+            self.stop(server)
+
+        recorded = {str(event['observation_id']) for events in recording.events.values() for event in events}
+        observation_ids = [observation['Observation_id'] for observation in scraper.observations_list]
+        assert scraped == len(recorded) == len(observation_ids)
+        assert set(observation_ids) == recorded
+        assert telemetry.observation_queue is None
+        with open(scraper.json_file_loc, 'r') as file_in:
+            assert len(json.load(file_in)) == scraped
+
+    def test_refresh_observations(self):
+        """
+        Test that a refresh only checks the observations that are not vetted, with conditional GETs from the
+        validators kept when they were scraped, and only updates the observations that changed
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=1, events_per_sat=1, observations_per_sat=4)
+        ids = list(recording.observations.keys())
+        for observation_id in ids[:2]:
+            recording.observations[observation_id].update({'Status': 'Unknown', 'Status_Message': 'Not vetted'})
+        server = self.serve(recording)
+        try:
+            scraper = ObservationScraper(prints=False, fetch_logging=False, fetch_waterfalls=False)
+            scraper.scrape_observations(ids)
+            settled = scraper.observations_list[2]
+
+            requests = server.observation_requests
+            assert scraper.refresh_observations(processes=1) == \
+                {'checked': 2, 'not_modified': 2, 'unchanged': 0, 'changed': 0, 'failed': 0}
+            assert server.observation_requests == requests + 2
+
+            recording.observations[ids[0]].update({'Status': 'Good', 'Status_Message': 'Vetted as good'})
+            assert scraper.refresh_observations(processes=1) == \
+                {'checked': 2, 'not_modified': 1, 'unchanged': 0, 'changed': 1, 'failed': 0}
+            assert scraper.refresh_observations(processes=1) == \
+                {'checked': 1, 'not_modified': 1, 'unchanged': 0, 'changed': 0, 'failed': 0}
+        finally:
+            self.stop(server)
+
+        with open(cnst.directories['observation_json'], 'r') as file_in:
+            stored = {observation['Observation_id']: observation for observation in json.load(file_in)}
+        assert stored[ids[0]]['Status'] == 'Good' and stored[ids[0]]['Status_Message'] == 'Vetted as good'
+        assert stored[ids[1]]['Status'] == 'Unknown'
+        assert stored[ids[2]] == settled
+        assert all(['Validators' not in observation for observation in stored.values()])
+        assert scraper.get_dataframe()['Status'].astype(str).tolist().count('Good') == 3
+
+        # once the dataset is stored, a refresh only writes the rows of the observations that changed
+        recording.observations[ids[1]].update({'Status': 'Bad', 'Status_Message': 'Vetted as bad'})
+        server = self.serve(recording)
+        try:
+            assert scraper.refresh_observations(processes=1)['changed'] == 1
+        finally:
+            self.stop(server)
+        df = scraper.store.read('observations')
+        assert df.shape[0] == 4
+        assert df['Status'].astype(str).tolist().count('Good') == 3 and 'Bad' in df['Status'].astype(str).tolist()
+        assert scraper.store.read_rows('observations').shape[0] == 5
@@ -0,0 +1,113 @@
+import os
+
+import pandas as pd
+
+from src.data_pull import prepare_directory
+from src.storage import ArtifactStore
+import src.constants as cnst
+
+
+def sample_events():
+    return pd.DataFrame({
+        'sat_id': ['SAT-A', 'SAT-A', 'SAT-B', 'SAT-B'],
+        'norad_cat_id': [1, 1, 2, 2],
+        'frame': ['AB', 'ABCD', 'EF', None],
+        'observer': ['Station 1', 'Station 2', 'Station 1', 'Station 1'],
+        'timestamp': ['2021-03-28T02:03:00Z', '2021-04-01T00:00:00Z', '2021-03-02T10:00:00Z',
+                      '2021-03-03T10:00:00Z'],
+        'observation_id': [10, 11, None, 12],
+        'associated_satellites': [[], [], ['SAT-A'], []],
+    })
+
+
+class TestArtifactStoreClass:
+
+    def test_csv_round_trip(self):
+        """
+        Test that the csv backend writes the CSV the pipeline has always written
+        """
+        prepare_directory()
+        store = ArtifactStore(backend='csv')
+        store.write('events', sample_events())
+
+        assert os.path.isfile(cnst.directories['tm_compiled_csv'])
+        df = store.read('events', columns=['sat_id', 'frame'], filters=[('month', '==', '2021-03')])
+        assert list(df.columns) == ['sat_id', 'frame']
+        assert df.shape[0] == 3
+
+    def test_parquet_round_trip(self):
+        """
+        Test writing a partitioned parquet dataset and reading back projected columns and filtered partitions
+        """
+        prepare_directory()
+        store = ArtifactStore(backend='parquet')
+        store.write('events', sample_events())
+
+        assert os.path.isdir(store.location('events') + 'sat_id=SAT-A/month=2021-04')
+        df = store.read('events')
+        assert sorted(df.columns) == sorted(sample_events().columns)
+        assert df.shape[0] == 4
+        assert df['norad_cat_id'].dtype == 'Int32'
+
+        df = store.read('events', columns=['frame'], filters=[('sat_id', '==', 'SAT-A'), ('month', '==', '2021-03')])
+        assert list(df.columns) == ['frame']
+        assert list(df['frame']) == ['AB']
+
+    def test_parquet_append(self):
+        """
+        Test that appended parts keep the types of the first part, and that a column a later part adds is kept
+        """
+        prepare_directory()
+        store = ArtifactStore(backend='parquet')
+        events = sample_events()
+        store.write('events', events.iloc[:2])
+        # the second part has a column the first does not and a column that is entirely empty
+        later = events.iloc[2:].assign(extra=1, frame=None)
+        store.append('events', later)
+
+        df = store.read('events').sort_values('timestamp')
+        assert df.shape[0] == 4
+        assert df['extra'].tolist()[:2] == [1, 1] and df['extra'].isna().sum() == 2
+        assert df['frame'].isna().sum() == 2
+
+        # a later store appends to the columns the dataset was written with
+        ArtifactStore(backend='parquet').append('events', events.iloc[:1].drop(columns=['frame']))
+        df = store.read('events')
+        assert df.shape[0] == 5 and 'extra' in df.columns and 'frame' in df.columns
+
+        store.delete('events')
+        assert not store.exists('events')
+
+    def test_csv_append(self):
+        """
+        Test that appended rows are written in the order of the header, and that a column later rows add is kept
+        """
+        prepare_directory()
+        store = ArtifactStore(backend='csv')
+        events = sample_events()
+        store.append('events', events.iloc[:2])
+        store.append('events', events.iloc[2:][list(reversed(events.columns))].assign(extra='x'))
+
+        df = store.read('events')
+        assert list(df.columns) == list(events.columns) + ['extra']
+        assert df['sat_id'].astype(str).tolist() == events['sat_id'].tolist()
+        assert df['extra'].isna().tolist() == [True, True, False, False]
+
+    def test_update(self):
+        """
+        Test that updated rows replace the rows with their key, and that failed scrapes without a key are all kept
+        """
+        prepare_directory()
+        observations = pd.DataFrame({'Observation_id': [1, 2, 3, None, None],
+                                     'Status': ['Unknown', 'Unknown', 'Good', None, None]})
+        for backend in ['csv', 'parquet']:
+            store = ArtifactStore(backend=backend)
+            store.write('observations', observations)
+            store.update('observations', pd.DataFrame({'Observation_id': [2], 'Status': ['Bad']}))
+            store.update('observations', pd.DataFrame({'Observation_id': [1, 2], 'Status': ['Good', 'Failed']}))
+
+            df = store.read('observations')
+            assert df.shape[0] == 5
+            statuses = dict(zip(df['Observation_id'].dropna().astype(int), df['Status'].dropna().astype(str)))
+            assert statuses == {1: 'Good', 2: 'Failed', 3: 'Good'}
+            assert store.read('observations', columns=['Status'])['Status'].isna().sum() == 2
@@ -1,6 +1,8 @@
 import pandas as pd
 import os
+import queue
 from src.data_pull import prepare_directory
+from src.event_archive import archive_path
 from src.telemetry import Telemetry
 import src.constants as cnst
 
@@ -28,6 +30,19 @@ class TestTelemetryClass:
         tm = Telemetry(max_pages=10)
         assert expected_url == tm.get_url_endpoint(iss_id)
 
+    def test_publish_observations(self):
+        """
+        Tests that the observation IDs of a page are put on the queue once each, skipping events without one
+        """
+        observation_queue = queue.Queue()
+        tm = Telemetry(prints=False, observation_queue=observation_queue)
+        tm.publish_observations([{'observation_id': 5}, {'observation_id': None}, {'observation_id': 5},
+                                 {'observation_id': 7}, {}])
+
+        assert [observation_queue.get_nowait() for _ in range(observation_queue.qsize())] == [5, 7]
+        # without a queue nothing is published
+        Telemetry(prints=False).publish_observations([{'observation_id': 5}])
+
     def test_telemetry_fetch(self):
         """
         Tests querying the telemetry endpoint of the satnogs DB when provided with a satellite ID.
@@ -37,7 +52,7 @@ class TestTelemetryClass:
 
         # clear the data directory then add the required subdirectories
         prepare_directory()
-        assert not os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
 
         tm = Telemetry(max_pages=1)
         tm_events = tm.fetch_telemetry_by_satellite(sat_id=iss_id)
@@ -52,7 +67,7 @@ class TestTelemetryClass:
         assert first_event['norad_cat_id'] == iss_norad
 
         # verify the tm events for the ISS were written to the disk
-        assert os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
+        assert os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
 
     def test_multiple_fetch(self):
         """
@@ -70,16 +85,16 @@ class TestTelemetryClass:
         # clear the data directory
         prepare_directory()
         # ensure the events are not saved to the disk
-        assert not os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
-        assert not os.path.isfile(cnst.directories['tm_events'] + humsat_d_id + ".json")
-        assert not os.path.isfile(cnst.directories['tm_events'] + cube_bel_1_id + ".json")
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], humsat_d_id))
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], cube_bel_1_id))
 
         tm = Telemetry(max_pages=1)
         tm.get_events_by_sat_id(sat_ids=[iss_id, humsat_d_id, cube_bel_1_id])
         # Verify the events were written to the disk
-        assert os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
-        assert os.path.isfile(cnst.directories['tm_events'] + humsat_d_id + ".json")
-        assert os.path.isfile(cnst.directories['tm_events'] + cube_bel_1_id + ".json")
+        assert os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
+        assert os.path.isfile(archive_path(cnst.directories['tm_events'], humsat_d_id))
+        assert os.path.isfile(archive_path(cnst.directories['tm_events'], cube_bel_1_id))
 
         # iterate through the returned events and verify entries for each satellite
         found_iss = False
@@ -117,16 +132,16 @@ class TestTelemetryClass:
         # clear the data directory
         prepare_directory()
         # ensure the events are not saved to the disk
-        assert not os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
-        assert not os.path.isfile(cnst.directories['tm_events'] + humsat_d_id + ".json")
-        assert not os.path.isfile(cnst.directories['tm_events'] + cube_bel_1_id + ".json")
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], humsat_d_id))
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], cube_bel_1_id))
 
         tm = Telemetry(max_pages=1)
         tm.multiprocess_fetch(sat_ids=[iss_id, humsat_d_id, cube_bel_1_id])
         # Verify the events were written to the disk
-        assert os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
-        assert os.path.isfile(cnst.directories['tm_events'] + humsat_d_id + ".json")
-        assert os.path.isfile(cnst.directories['tm_events'] + cube_bel_1_id + ".json")
+        assert os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
+        assert os.path.isfile(archive_path(cnst.directories['tm_events'], humsat_d_id))
+        assert os.path.isfile(archive_path(cnst.directories['tm_events'], cube_bel_1_id))
 
         tm.get_archived_satellites_events()
 
@@ -158,16 +173,16 @@ class TestTelemetryClass:
         prepare_directory()
         iss_id = "XSKZ-5603-1870-9019-3066"
 
-        assert not os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
 
         tm = Telemetry(max_pages=1)
         tm.fetch_telemetry_by_satellite(sat_id=iss_id)
 
-        assert os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
+        assert os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
 
         tm.clear_archived_events()
 
-        assert not os.path.isfile(cnst.directories['tm_events'] + iss_id + ".json")
+        assert not os.path.isfile(archive_path(cnst.directories['tm_events'], iss_id))
 
     def test_get_events_df(self):
         """
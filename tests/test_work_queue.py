@@ -0,0 +1,116 @@
+import threading
+import time
+
+from benchmarks.standin import Recording, make_server
+from src.data_pull import prepare_directory
+from src.observation_scraper import ObservationScraper
+from src.work_queue import WorkQueue, work
+import src.constants as cnst
+
+
+class TestWorkQueue:
+
+    def test_lease_by_priority(self, tmp_path):
+        """
+        Test that jobs are leased once, highest priority first, and that done jobs keep their results
+        """
+        queue = WorkQueue(db_file=str(tmp_path / 'queue.sqlite'))
+        queue.add([3, 1, 2])
+        queue.add([2], priority=5)
+        assert queue.lease('a', count=2) == [2, 1]
+        assert queue.lease('b', count=5) == [3]
+        assert queue.lease('b') == []
+
+        assert queue.complete(2, 'a', {'Observation_id': '2'})
+        assert not queue.complete(3, 'a', {'Observation_id': '3'})
+        assert queue.counts() == {'pending': 0, 'leased': 2, 'done': 1, 'failed': 0}
+        assert queue.results([1, 2, 3]) == [{'Observation_id': '2'}]
+
+        # adding again leaves done jobs alone unless they are reset
+        queue.add([2])
+        assert queue.counts()['done'] == 1
+        queue.add([2], reset=True)
+        assert queue.counts()['pending'] == 1
+
+    def test_expired_lease(self, tmp_path):
+        """
+        Test that the jobs of a worker whose lease expired are leased by another worker
+        """
+        queue = WorkQueue(db_file=str(tmp_path / 'queue.sqlite'), lease_seconds=0.05)
+        queue.add([1])
+        assert queue.lease('crashed') == [1]
+        time.sleep(0.1)
+        assert queue.lease('alive') == [1]
+        assert queue.fail(1, 'crashed', status=500) is None
+        assert queue.complete(1, 'alive', {'Observation_id': '1'})
+
+        # a job that takes its worker down on every attempt is failed for good once it runs out of attempts
+        queue = WorkQueue(db_file=str(tmp_path / 'crash.sqlite'), lease_seconds=0.05, max_attempts=2)
+        queue.add([2])
+        assert queue.lease('first') == [2]
+        time.sleep(0.1)
+        assert queue.lease('second') == [2]
+        time.sleep(0.1)
+        assert queue.lease('third') == []
+        assert queue.counts()['failed'] == 1
+        assert queue.failures() == [{'observation_id': 2, 'attempts': 2, 'last_status': None,
+                                     'last_error': 'Lease expired'}]
+
+    def test_backoff_and_give_up(self, tmp_path):
+        """
+        Test that a failing job waits longer after each failure and is failed for good after max_attempts
+        """
+        queue = WorkQueue(db_file=str(tmp_path / 'queue.sqlite'), max_attempts=3, backoff_seconds=10,
+                          max_backoff_seconds=15)
+        assert [queue.backoff(attempts) for attempts in [1, 2, 3]] == [10, 15, 15]
+        queue.add([7])
+        queue.lease('a')
+        assert queue.fail(7, 'a', status=502) == 'pending'
+        assert queue.lease('a') == []
+        assert queue.next_ready() > time.time() + 5
+
+        queue = WorkQueue(db_file=str(tmp_path / 'retry.sqlite'), max_attempts=3, backoff_seconds=0)
+        queue.add([7])
+        for state in ['pending', 'pending', 'failed']:
+            assert queue.lease('a') == [7]
+            assert queue.fail(7, 'a', error='ConnectionError()') == state
+        assert queue.failures() == [{'observation_id': 7, 'attempts': 3, 'last_status': None,
+                                     'last_error': 'ConnectionError()'}]
+        assert queue.next_ready() is None
+
+        # failed jobs are given their attempts again
+        assert queue.retry_failed() == 1
+        assert queue.lease('a') == [7]
+        queue.fail(7, 'a')
+        queue.lease('a')
+        queue.fail(7, 'a')
+        queue.lease('a')
+        assert queue.fail(7, 'a') == 'failed'
+        queue.add([7])
+        assert queue.lease('a') == [7]
+
+    def test_scrape_through_queue(self):
+        """
+        Test that workers scrape the observations of the stand-in, leaving the missing observation failed in the queue
+        """
+        prepare_directory()
+        recording = Recording.synthetic(num_sats=1, events_per_sat=1, observations_per_sat=3)
+        observation_ids = [int(observation_id) for observation_id in recording.observations]
+        server = make_server(recording)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        previous = cnst.web_address
+        cnst.web_address = f'http://{server.server_address[0]}:{server.server_address[1]}/'
+        try:
+            queue = WorkQueue(max_attempts=2, backoff_seconds=0)
+            scraper = ObservationScraper(fetch_waterfalls=False, fetch_logging=False, prints=False)
+            scraper.queue_scrape_observations(observation_ids + [1], queue=queue, processes=2, write_disk=False)
+            # a second run finds every job finished and fetches nothing
+            assert work(queue, scraper) == 0
+        finally:
+            cnst.web_address = previous
+            server.shutdown()
+            server.server_close()
+
+        assert [int(observation['Observation_id']) for observation in scraper.observations_list] == observation_ids
+        assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 3, 'failed': 1}
+        assert queue.failures() == [{'observation_id': 1, 'attempts': 2, 'last_status': 404, 'last_error': None}]